@@ -0,0 +1,68 @@
+"""
+Benchmark parsing a webctrl BulkTrendServer response as json against the streaming csv parser in sensors.bulktrend
+
+Builds a synthetic response for several trends and prints samples/sec and peak python memory for both formats.
+
+Usage: python3 benchmarks/bench_bulktrend.py [<trends>] [<samples per trend>]
+"""
+from pathlib import Path
+
+import json
+import numpy
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append(str(Path(os.path.dirname(os.path.realpath(__file__))).parent))
+from sensors import bulktrend, reshape
+
+
+CHUNK_SIZE = 65536
+
+
+def make_responses(trend_count, sample_count):
+    """
+    Create the same trends encoded in the json and csv response formats
+    """
+    timestamps = [str(1282017600000 + i * 60000) for i in range(sample_count)]
+    values = [str(round(v, 2)) for v in numpy.random.rand(sample_count) * 100]
+    trend_ids = ['ABSPATH:1:#building/trend_' + str(i) + '_tn' for i in range(trend_count)]
+    json_response = json.dumps([{'id': trend_id, 's': [{'t': t, 'a': v} for t, v in zip(timestamps, values)]} for trend_id in trend_ids]).encode('utf-8')
+    csv_response = ''.join(trend_id + ',' + ','.join(t + ',' + v for t, v in zip(timestamps, values)) + '\r\n' for trend_id in trend_ids).encode('utf-8')
+    return json_response, csv_response
+
+
+def parse_json(response):
+    """
+    Parse the json format into per id timestamp and value arrays
+    """
+    trends = {}
+    for trend in json.loads(response.decode('utf-8')):
+        timestamps = numpy.array([sample['t'] for sample in trend['s']], dtype=numpy.int64) // 1000
+        values = reshape.to_float([sample.get('a', sample.get('d')) for sample in trend['s']])
+        trends[trend['id']] = (timestamps, values)
+    return trends
+
+
+def parse_csv(response):
+    """
+    Stream the csv format through sensors.bulktrend in CHUNK_SIZE chunks, as api_webctrl does
+    """
+    chunks = (response[i:i + CHUNK_SIZE] for i in range(0, len(response), CHUNK_SIZE))
+    return {trend.id: (trend.timestamps, trend.values) for trend in bulktrend.iter_trends(chunks)}
+
+
+if __name__ == '__main__':
+    trend_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    sample_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20160
+    json_response, csv_response = make_responses(trend_count, sample_count)
+    for name, function, response in [('json', parse_json, json_response), ('csv', parse_csv, csv_response)]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        function(response)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        samples = trend_count * sample_count
+        print('{:<5} {:>6.1f} MB response {:>8.3f} s {:>12.0f} samples/sec {:>8.1f} MB peak'.format(name, len(response) / 1e6, elapsed, samples / elapsed, peak / 1e6))
@@ -0,0 +1,63 @@
+"""
+Benchmark the fixed cost of a cron run of each script against a cycle of sensors/daemon.py
+
+A cron run starts an interpreter, imports the script, reads config.txt, creates an engine and connects to the database.
+The daemon pays this once; each cycle only checks out a pooled connection and reads the active script folders.
+Uses the database named in config.txt; no readings are requested or inserted.
+
+Usage: python3 benchmarks/bench_daemon.py [<repeats>]
+"""
+from pathlib import Path
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_PATH = str(Path(os.path.dirname(os.path.realpath(__file__))).parent)
+sys.path.append(PROJECT_PATH)
+from sensors import daemon, db, scripts
+
+
+# what a cron run does before it requests any readings
+COLD_START = 'import {module}; from sensors import db; conn = db.get_db_handler(); conn.execute("SELECT 1"); conn.close()'
+
+
+def time_cold_start(script_folder, repeats):
+    """
+    Return the median seconds for a new interpreter to import the script of script_folder and connect to the database
+    """
+    module = scripts.SCRIPT_MODULES[script_folder]
+    seconds = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable, '-c', COLD_START.format(module=module)],
+                       cwd=PROJECT_PATH + '/' + script_folder + '/script', check=True, stderr=subprocess.DEVNULL)
+        seconds.append(time.perf_counter() - start_time)
+    return statistics.median(seconds)
+
+
+def time_daemon_cycle(Session, repeats):
+    """
+    Return the median seconds the daemon spends per cycle before running any script
+    """
+    # the first cycle imports the scripts and opens the pooled connection
+    daemon.get_active_script_folders(Session)
+    seconds = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        daemon.get_active_script_folders(Session)
+        seconds.append(time.perf_counter() - start_time)
+    return statistics.median(seconds)
+
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for script_folder in sorted(scripts.SCRIPT_MODULES):
+        scripts.load_script(script_folder)
+    Session = db.get_sessionmaker()
+    cycle_seconds = time_daemon_cycle(Session, repeats)
+    print('{:<10}{:>18}{:>18}'.format('script', 'cron run (s)', 'daemon cycle (s)'))
+    for script_folder in sorted(scripts.SCRIPT_MODULES):
+        print('{:<10}{:>18.3f}{:>18.4f}'.format(script_folder, time_cold_start(script_folder, repeats), cycle_seconds))
@@ -0,0 +1,61 @@
+"""
+Benchmark the previous hobo csv parsing in extract_hobo against extract_hobo.read_hobo_csv
+
+Writes a synthetic year-long 1-minute hobo export to a temporary file and prints rows/sec for both parsers.
+
+Usage: python3 benchmarks/bench_hobo.py [<minutes of readings>]
+"""
+from pathlib import Path
+
+import csv
+import numpy
+import os
+import pandas
+import sys
+import tempfile
+import time
+
+PROJECT_PATH = str(Path(os.path.dirname(os.path.realpath(__file__))).parent)
+sys.path.append(PROJECT_PATH + '/hobo/script')
+import extract_hobo
+
+
+def write_hobo_csv(file, minutes):
+    """
+    Write a hobo export with the same layout as hobo/To_Insert/9790163-sample.csv
+    """
+    datetimes = pandas.date_range('2017-02-03 16:00:00', periods=minutes, freq='min').strftime('%m/%d/%y %I:%M:%S %p')
+    readings = numpy.round(numpy.random.rand(minutes, 3) * 100, 3)
+    file.write('﻿"Plot Title: 9790163"\n')
+    file.write('"#","Date Time, GMT-10:00","Temp, °F (LGR S/N: 9790163, SEN S/N: 9790163)","RH, % (LGR S/N: 9790163, SEN S/N: 9790163)","Intensity, lum/ft² (LGR S/N: 9790163, SEN S/N: 9790163)"\n')
+    for i in range(minutes):
+        file.write('{},{},{},{},{}\n'.format(i + 1, datetimes[i], *readings[i]))
+
+
+def previous_parse(csv_filename):
+    """
+    The parsing previously done in extract_hobo.get_csv_from_folder_not_in_db, plus the float conversion done at insert time
+    """
+    with open(csv_filename, 'r') as file:
+        reader = csv.reader(file)
+        query_string = next(reader)[0].split(': ')[1]
+        table = list(reader)
+    csv_readings = pandas.DataFrame(table[1:], columns=table[0])
+    csv_readings = csv_readings.iloc[:, 1:]
+    csv_readings['Date Time, GMT-10:00'] = pandas.to_datetime(csv_readings['Date Time, GMT-10:00'])
+    readings = csv_readings.iloc[:, 1:].to_numpy(dtype=numpy.float64)
+    return query_string, csv_readings, readings
+
+
+if __name__ == '__main__':
+    minutes = int(sys.argv[1]) if len(sys.argv) > 1 else 525600
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8', delete=False) as file:
+        write_hobo_csv(file, minutes)
+    try:
+        for name, function in [('previous', previous_parse), ('typed', extract_hobo.read_hobo_csv)]:
+            start = time.perf_counter()
+            function(file.name)
+            elapsed = time.perf_counter() - start
+            print('{:<9} {:>8} rows {:>8.3f} s {:>12.0f} rows/sec'.format(name, minutes, elapsed, minutes / elapsed))
+    finally:
+        os.remove(file.name)
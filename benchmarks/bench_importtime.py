@@ -0,0 +1,78 @@
+"""
+Benchmark the time a new interpreter spends importing each script, with pandas, numpy and requests imported lazily
+as the scripts do now and imported eagerly as the scripts did before sensors.lazy
+
+Runs python -X importtime for each script in its */script folder and adds up the self time of every imported module,
+then prints the modules with the largest cumulative import time of the lazy run.
+Nothing connects to the database.
+
+Usage: python3 benchmarks/bench_importtime.py [<repeats>] [<top modules>]
+"""
+from pathlib import Path
+
+import collections
+import os
+import statistics
+import subprocess
+import sys
+
+PROJECT_PATH = str(Path(os.path.dirname(os.path.realpath(__file__))).parent)
+sys.path.append(PROJECT_PATH)
+from sensors import scripts
+
+
+# the heavy modules the scripts imported at the top before they were imported lazily
+EAGER_IMPORTS = 'import numpy, pandas, requests; '
+
+
+def parse_importtime(stderr):
+    """
+    Return a dictionary of module: (self microseconds, cumulative microseconds) parsed from the stderr of python -X importtime
+    """
+    import_times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative_time, module = line[len('import time:'):].split('|')
+        import_times[module.strip()] = (int(self_time), int(cumulative_time))
+    return import_times
+
+
+def time_import(script_folder, statement):
+    """
+    Return the import times of a new interpreter running statement in the */script folder of script_folder
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            cwd=PROJECT_PATH + '/' + script_folder + '/script', check=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    return parse_importtime(result.stderr)
+
+
+def total_seconds(import_times):
+    """
+    Return the seconds spent importing every module in import_times
+    """
+    return sum(self_time for self_time, cumulative_time in import_times.values()) / 1e6
+
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    top_modules = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    print('{:<10}{:>14}{:>14}{:>10}'.format('script', 'eager (s)', 'lazy (s)', 'modules'))
+    slowest_modules = collections.defaultdict(list)
+    for script_folder, module in sorted(scripts.SCRIPT_MODULES.items()):
+        eager_seconds = []
+        lazy_seconds = []
+        for _ in range(repeats):
+            eager_seconds.append(total_seconds(time_import(script_folder, EAGER_IMPORTS + 'import ' + module)))
+            import_times = time_import(script_folder, 'import ' + module)
+            lazy_seconds.append(total_seconds(import_times))
+        for imported_module, (self_time, cumulative_time) in import_times.items():
+            slowest_modules[imported_module].append(cumulative_time)
+        print('{:<10}{:>14.3f}{:>14.3f}{:>10}'.format(script_folder, statistics.median(eager_seconds),
+                                                      statistics.median(lazy_seconds), len(import_times)))
+    print()
+    print('slowest imports of the lazy runs (cumulative ms, max over scripts):')
+    for imported_module, cumulative_times in sorted(slowest_modules.items(), key=lambda item: max(item[1]),
+                                                    reverse=True)[:top_modules]:
+        print('    {:<40}{:>10.1f}'.format(imported_module, max(cumulative_times) / 1000))
@@ -0,0 +1,97 @@
+"""
+Benchmark inserting readings and then updating their log_id against inserting them with log_id from sensors.loader
+
+Fills a temporary table named reading (which hides the real reading table for this session) with <rows> readings,
+then times inserting one egauge run (<purposes> purposes of 60 readings each) both ways.
+Uses the database named in config.txt; nothing is committed.
+
+Usage: python3 benchmarks/bench_log_id.py [<rows>] [<purposes>] [<runs>]
+"""
+from pathlib import Path
+from sqlalchemy import text
+
+import os
+import pandas
+import sys
+import time
+
+PROJECT_PATH = str(Path(os.path.dirname(os.path.realpath(__file__))).parent)
+sys.path.append(PROJECT_PATH)
+from sensors import db, loader
+
+
+# the reading table as created by sensors.orm and init_database.py, without foreign keys
+CREATE_READING = """
+    CREATE TEMPORARY TABLE reading (
+        datetime TIMESTAMP(6), purpose_id BIGINT, units VARCHAR(255) NOT NULL, reading DOUBLE PRECISION NOT NULL,
+        upload_timestamp TIMESTAMP(6) NOT NULL DEFAULT now(), log_id INTEGER, PRIMARY KEY (datetime, purpose_id)
+    )
+"""
+FILL_READING = """
+    INSERT INTO reading (datetime, purpose_id, units, reading, upload_timestamp, log_id)
+    SELECT timestamp '2010-01-01' + minute * interval '1 minute', purpose_id, 'kW', random(),
+        timestamp '2010-01-01' + minute * interval '1 minute', minute
+    FROM generate_series(0, :minutes - 1) minute, generate_series(1, :purposes) purpose_id
+"""
+# the update each script ran for every purpose after inserting its readings
+UPDATE_LOG_ID = """
+    UPDATE reading SET log_id = :log_id WHERE purpose_id = :purpose_id AND upload_timestamp = :upload_timestamp
+"""
+
+
+def make_run(start_minute, purposes):
+    """
+    Return a reading frame of 60 new readings for each of purposes, starting start_minute after 2010-01-01
+    """
+    datetimes = pandas.Timestamp('2010-01-01') + pandas.to_timedelta(range(start_minute, start_minute + 60), unit='min')
+    return pandas.DataFrame({'purpose_id': [purpose_id for purpose_id in range(1, purposes + 1) for _ in datetimes],
+                             'datetime': list(datetimes) * purposes,
+                             'reading': 1.0,
+                             'units': 'kW'})
+
+
+def time_update_after_insert(conn, reading_frame, upload_timestamp, log_ids):
+    """
+    Insert reading_frame without log_id, then update the log_id of each purpose's readings; return the seconds for both
+    """
+    start_time = time.perf_counter()
+    loader.copy_readings(conn, reading_frame, upload_timestamp)
+    insert_seconds = time.perf_counter() - start_time
+    for purpose_id, log_id in log_ids.items():
+        conn.execute(text(UPDATE_LOG_ID), {'log_id': log_id, 'purpose_id': purpose_id, 'upload_timestamp': upload_timestamp})
+    return insert_seconds, time.perf_counter() - start_time - insert_seconds
+
+
+def time_insert_with_log_id(conn, reading_frame, upload_timestamp, log_ids):
+    """
+    Insert reading_frame with the log_id of each purpose; return the seconds
+    """
+    start_time = time.perf_counter()
+    loader.copy_readings(conn, reading_frame, upload_timestamp, log_ids=log_ids)
+    return time.perf_counter() - start_time
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5000000
+    purposes = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    runs = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    conn = db.get_sessionmaker()()
+    conn.execute(text(CREATE_READING))
+    minutes = rows // purposes
+    start_time = time.perf_counter()
+    conn.execute(text(FILL_READING), {'minutes': minutes, 'purposes': purposes})
+    conn.execute(text('ANALYZE reading'))
+    print('filled reading with {} rows in {:.1f} s'.format(minutes * purposes, time.perf_counter() - start_time))
+    log_ids = {purpose_id: minutes + purpose_id for purpose_id in range(1, purposes + 1)}
+    print('{:<6}{:>14}{:>14}{:>20}'.format('run', 'insert (s)', 'update (s)', 'insert+log_id (s)'))
+    totals = [0, 0, 0]
+    for run in range(runs):
+        upload_timestamp = pandas.Timestamp('2030-01-01') + pandas.Timedelta(seconds=run)
+        # each run inserts a new hour of readings, like a cron run
+        insert_seconds, update_seconds = time_update_after_insert(conn, make_run(minutes + 120 * run, purposes), upload_timestamp, log_ids)
+        log_id_seconds = time_insert_with_log_id(conn, make_run(minutes + 120 * run + 60, purposes), upload_timestamp, log_ids)
+        print('{:<6}{:>14.4f}{:>14.4f}{:>20.4f}'.format(run, insert_seconds, update_seconds, log_id_seconds))
+        totals = [total + seconds for total, seconds in zip(totals, (insert_seconds, update_seconds, log_id_seconds))]
+    print('{:<6}{:>14.4f}{:>14.4f}{:>20.4f}'.format('mean', *(total / runs for total in totals)))
+    conn.rollback()
+    conn.close()
@@ -0,0 +1,124 @@
+"""
+Benchmark the hand-written pivot views in sql_views against the views sensors.pivot generates from sql_views/pivot
+
+Fills temporary tables named sensor_info and reading (which hide the real tables for this session) with the classroom,
+power and weather purposes of two buildings plus <purposes> other power purposes, each with 5-minute readings for <days> days,
+then times the select of each hand-written view and of its generated view, and counts the rows that are in one
+but not the other. Rows whose pivoted columns are all NULL are only in the hand-written views and are not counted.
+Uses the database named in config.txt; nothing is committed.
+
+Usage: python3 benchmarks/bench_pivot.py [<days>] [<purposes>] [<runs>]
+"""
+from pathlib import Path
+from sqlalchemy import text
+
+import os
+import sys
+import time
+
+PROJECT_PATH = str(Path(os.path.dirname(os.path.realpath(__file__))).parent)
+sys.path.append(PROJECT_PATH)
+from sensors import db, matview, pivot
+
+
+VIEW_NAMES = ('view-data-comfort-analysis', 'view-readings-as-columns', 'single_line_CO2_temp_weather_ac_fans')
+CREATE_SENSOR_INFO = """
+    CREATE TEMPORARY TABLE sensor_info (LIKE public.sensor_info INCLUDING ALL)
+"""
+# the reading table as created by sensors.orm, without partitions or foreign keys
+CREATE_READING = """
+    CREATE TEMPORARY TABLE reading (
+        datetime TIMESTAMP(6), purpose_id BIGINT, units VARCHAR(255) NOT NULL, reading DOUBLE PRECISION NOT NULL,
+        upload_timestamp TIMESTAMP(6) NOT NULL DEFAULT now(), log_id INTEGER, PRIMARY KEY (datetime, purpose_id)
+    );
+    CREATE INDEX ON reading (purpose_id, datetime)
+"""
+INSERT_SENSOR_INFO = """
+    INSERT INTO sensor_info (purpose_id, building, variable_name, unit, type, appliance, room, is_active)
+    VALUES (:purpose_id, :building, :variable_name, :unit, :type, :appliance, :room, true)
+"""
+FILL_READING = """
+    INSERT INTO reading (datetime, purpose_id, units, reading)
+    SELECT timestamp '2017-09-01' + step * interval '5 minutes', purpose_id, unit, random() * 100
+    FROM generate_series(0, :steps - 1) step, sensor_info
+"""
+# rows of one select that are not in the other and have a pivoted column that is not NULL
+COUNT_DIFFERENCE = """
+    SELECT count(*) FROM ({select} EXCEPT {other_select}) difference
+    WHERE EXISTS (SELECT FROM jsonb_each(to_jsonb(difference)) WHERE key = ANY(:column_names) AND value <> 'null')
+"""
+# (building, variable_name, unit, type, appliance, room) of the purposes of each classroom building
+BUILDING_PURPOSES = [
+    ('temperature', 'F', 'Temperature-air', None, 'Classroom'),
+    ('mrt', 'F', 'Temperature-mrt', None, 'Classroom'),
+    ('humidity', '%', 'Humidity', None, 'Classroom'),
+    ('co2', 'ppm', 'CO2', None, 'Classroom'),
+    ('air-handler-avg', 'kW', 'Power-avg (kW)', 'AC air handling unit', None),
+    ('chiller-avg', 'kW', 'Power-avg (kW)', 'AC chiller', None),
+    ('ceiling-fans-avg', 'kW', 'Power-avg (kW)', 'Ceiling fans', None),
+]
+WEATHER_TYPES = ['Temperature-exterior air', 'Humidity-exterior', 'Wind direction', 'Wind-speed', 'Light-w/m2',
+                 'Barometric-pressure', 'Temperature-exterior dewpoint']
+
+
+def make_sensor_info(purposes):
+    """
+    Return sensor_info rows for the purposes of frog-1, frog-2 and weather-station and for purposes other power purposes
+    """
+    rows = []
+    for building in ('frog-1', 'frog-2'):
+        for variable_name, unit, sensor_type, appliance, room in BUILDING_PURPOSES:
+            rows.append({'building': building, 'variable_name': variable_name, 'unit': unit, 'type': sensor_type,
+                         'appliance': appliance, 'room': room})
+    for sensor_type in WEATHER_TYPES:
+        rows.append({'building': 'weather-station', 'variable_name': sensor_type, 'unit': '', 'type': sensor_type,
+                     'appliance': None, 'room': None})
+    for purpose in range(purposes):
+        rows.append({'building': 'building-' + str(purpose % 10), 'variable_name': 'circuit-' + str(purpose), 'unit': 'kW',
+                     'type': 'Power-avg (kW)', 'appliance': 'Plug loads', 'room': None})
+    # purpose_ids 84 and 85 are left out of the hand-written views, so the generated purposes start after them
+    for purpose_id, row in enumerate(rows, start=100):
+        row['purpose_id'] = purpose_id
+    return rows
+
+
+def time_query(conn, query, runs):
+    """
+    Return the mean seconds and the number of rows of runs executions of query
+    """
+    start_time = time.perf_counter()
+    for run in range(runs):
+        rows = len(conn.execute(text(query)).fetchall())
+    return (time.perf_counter() - start_time) / runs, rows
+
+
+if __name__ == '__main__':
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    purposes = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    runs = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    conn = db.get_sessionmaker()()
+    conn.execute(text(CREATE_SENSOR_INFO))
+    conn.execute(text(CREATE_READING))
+    conn.execute(text(INSERT_SENSOR_INFO), make_sensor_info(purposes))
+    start_time = time.perf_counter()
+    conn.execute(text(FILL_READING), {'steps': days * 288})
+    conn.execute(text('ANALYZE sensor_info; ANALYZE reading'))
+    print('filled reading with {} rows in {:.1f} s'.format(conn.execute(text('SELECT count(*) FROM reading')).scalar(),
+                                                            time.perf_counter() - start_time))
+    sensor_info_rows = pivot.get_sensor_info_rows(conn)
+    print('{:<40}{:>16}{:>16}{:>10}{:>10}{:>14}'.format('view', 'hand-written (s)', 'generated (s)', 'rows', 'rows',
+                                                        'differences'))
+    for view_name in VIEW_NAMES:
+        hand_written_select = matview.read_view(matview.SQL_VIEWS_PATH + '/' + view_name + '.sql')[1].replace(':', '\\:')
+        spec = pivot.read_spec(pivot.PIVOT_PATH + '/' + view_name + '.json')
+        generated_select = pivot.build_view(spec, sensor_info_rows).replace(':', '\\:')
+        hand_written_seconds, hand_written_rows = time_query(conn, hand_written_select, runs)
+        generated_seconds, generated_rows = time_query(conn, generated_select, runs)
+        column_names = [column['name'] for column in spec['columns']]
+        differences = sum(conn.execute(text(COUNT_DIFFERENCE.format(select='(' + select + ')', other_select='(' + other_select + ')')),
+                                       {'column_names': column_names}).scalar()
+                          for select, other_select in ((hand_written_select, generated_select), (generated_select, hand_written_select)))
+        print('{:<40}{:>16.3f}{:>16.3f}{:>10}{:>10}{:>14}'.format(view_name, hand_written_seconds, generated_seconds,
+                                                                  hand_written_rows, generated_rows, differences))
+    conn.rollback()
+    conn.close()
@@ -0,0 +1,68 @@
+"""
+Benchmark the per-cell egauge reshape against sensors.reshape.melt_wide_readings
+
+Builds a synthetic egauge api response and prints rows/sec for both approaches.
+
+Usage: python3 benchmarks/bench_reshape.py [<minutes of readings>] [<registers>]
+"""
+from collections import namedtuple
+from pathlib import Path
+
+import numpy
+import os
+import pandas
+import pendulum
+import sys
+import time
+
+PROJECT_PATH = str(Path(os.path.dirname(os.path.realpath(__file__))).parent)
+sys.path.append(PROJECT_PATH)
+from sensors import orm, reshape
+
+
+PurposeSensor = namedtuple('PurposeSensor', ['purpose_id', 'data_sensor_info_mapping', 'unit'])
+
+
+def make_readings(minutes, registers):
+    """
+    Create a dataframe shaped like an egauge api csv response
+    """
+    readings = pandas.DataFrame(numpy.random.rand(minutes, registers), columns=['Register ' + str(i) + ' [kW]' for i in range(registers)])
+    readings.insert(0, 'Date & Time', numpy.arange(1549015200, 1549015200 + minutes * 60, 60))
+    purpose_sensors = [PurposeSensor(i, column, 'kW') for i, column in enumerate(readings.columns[1:])]
+    return readings, purpose_sensors
+
+
+def per_cell_reshape(readings, purpose_sensors, current_time):
+    """
+    The reshape previously done in api_egauge.insert_readings_into_database
+    """
+    reading_rows = []
+    columns = list(readings.columns.values)
+    for purpose_sensor in purpose_sensors:
+        for row in readings.itertuples():
+            row_datetime = pendulum.from_timestamp(row[1])
+            row_datetime = row_datetime.set(microsecond=row_datetime.microsecond - (row_datetime.microsecond % 10000))
+            for i, column_reading in enumerate(row[2:]):
+                if purpose_sensor.data_sensor_info_mapping == columns[i+1]:
+                    reading_rows.append(orm.Reading(purpose_id=purpose_sensor.purpose_id, datetime=row_datetime, reading=column_reading, units=purpose_sensor.unit, upload_timestamp=current_time))
+    return reading_rows
+
+
+def columnar_reshape(readings, purpose_sensors, current_time):
+    """
+    The reshape now done in api_egauge.insert_readings_into_database
+    """
+    return reshape.melt_wide_readings(readings, reshape.epoch_to_datetime(readings['Date & Time']), purpose_sensors)
+
+
+if __name__ == '__main__':
+    minutes = int(sys.argv[1]) if len(sys.argv) > 1 else 1440
+    registers = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    readings, purpose_sensors = make_readings(minutes, registers)
+    current_time = pendulum.now('Pacific/Honolulu')
+    for name, function in [('per-cell', per_cell_reshape), ('columnar', columnar_reshape)]:
+        start = time.perf_counter()
+        rows = len(function(readings, purpose_sensors, current_time))
+        elapsed = time.perf_counter() - start
+        print('{:<10} {:>9} rows {:>8.3f} s {:>12.0f} rows/sec'.format(name, rows, elapsed, rows / elapsed))
@@ -0,0 +1,122 @@
+"""
+Benchmark dashboard queries over raw readings against the same queries over sensors.rollup's reading_rollup table
+
+Fills temporary tables named reading and reading_rollup (which hide the real tables for this session) with <days> days
+of 1-minute readings of <purposes> purposes, then times:
+    - the 5-minute averages of eguage_5min_avg_view2 and the hourly averages of dashbd_indoorenv_weatherstation_hrly,
+      from reading and from reading_rollup
+    - inserting one run of readings (60 readings per purpose) with sensors.loader, which also updates the touched rollups
+Uses the database named in config.txt; nothing is committed.
+
+Usage: python3 benchmarks/bench_rollup.py [<days>] [<purposes>] [<runs>]
+"""
+from pathlib import Path
+from sqlalchemy import text
+
+import os
+import pandas
+import sys
+import time
+
+PROJECT_PATH = str(Path(os.path.dirname(os.path.realpath(__file__))).parent)
+sys.path.append(PROJECT_PATH)
+from sensors import db, loader, rollup
+
+
+# the reading table as created by sensors.orm, without partitions or foreign keys
+CREATE_READING = """
+    CREATE TEMPORARY TABLE reading (
+        datetime TIMESTAMP(6), purpose_id BIGINT, units VARCHAR(255) NOT NULL, reading DOUBLE PRECISION NOT NULL,
+        upload_timestamp TIMESTAMP(6) NOT NULL DEFAULT now(), log_id INTEGER, PRIMARY KEY (datetime, purpose_id)
+    );
+    CREATE INDEX ON reading (purpose_id, datetime)
+"""
+CREATE_READING_ROLLUP = """
+    CREATE TEMPORARY TABLE reading_rollup (LIKE public.reading_rollup INCLUDING ALL)
+"""
+FILL_READING = """
+    INSERT INTO reading (datetime, purpose_id, units, reading)
+    SELECT timestamp '2019-01-01' + minute * interval '1 minute', purpose_id, 'kW', random()
+    FROM generate_series(0, :minutes - 1) minute, generate_series(1, :purposes) purpose_id
+"""
+# 5-minute averages of two purposes over the last week, as selected from eguage_5min_avg_view2
+FIVE_MINUTE_QUERIES = {
+    'reading': """
+        SELECT date_trunc('hour', datetime) + (floor(date_part('minute', datetime) / 5) + 1) * interval '5 minutes', purpose_id, avg(reading)
+        FROM reading WHERE purpose_id = ANY(ARRAY[1, 2]) AND datetime >= :week_start GROUP BY 1, 2 ORDER BY 1, 2
+    """,
+    'reading_rollup': """
+        SELECT bucket + interval '5 minutes', purpose_id, reading_sum / reading_count FROM reading_rollup
+        WHERE bucket_seconds = 300 AND purpose_id = ANY(ARRAY[1, 2]) AND bucket >= :week_start ORDER BY 1, 2
+    """,
+}
+# hourly average, min and max of every purpose, as computed by dashbd_indoorenv_weatherstation_hrly
+HOURLY_QUERIES = {
+    'reading': """
+        SELECT date_trunc('hour', datetime), purpose_id, avg(reading), min(reading), max(reading) FROM reading GROUP BY 1, 2
+    """,
+    'reading_rollup': """
+        SELECT bucket, purpose_id, reading_sum / reading_count, reading_min, reading_max FROM reading_rollup WHERE bucket_seconds = 3600
+    """,
+}
+
+
+def time_query(conn, query, parameters, runs):
+    """
+    Return the mean seconds and the number of rows of runs executions of query
+    """
+    start_time = time.perf_counter()
+    for run in range(runs):
+        rows = len(conn.execute(text(query), parameters).fetchall())
+    return (time.perf_counter() - start_time) / runs, rows
+
+
+def make_run(start_minute, purposes):
+    """
+    Return a reading frame of 60 new readings for each of purposes, starting start_minute after 2019-01-01
+    """
+    datetimes = pandas.Timestamp('2019-01-01') + pandas.to_timedelta(range(start_minute, start_minute + 60), unit='min')
+    return pandas.DataFrame({'purpose_id': [purpose_id for purpose_id in range(1, purposes + 1) for _ in datetimes],
+                             'datetime': list(datetimes) * purposes,
+                             'reading': 1.0,
+                             'units': 'kW'})
+
+
+if __name__ == '__main__':
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 365
+    purposes = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    runs = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    conn = db.get_sessionmaker()()
+    conn.execute(text(CREATE_READING))
+    conn.execute(text(CREATE_READING_ROLLUP))
+    minutes = days * 1440
+    start_time = time.perf_counter()
+    conn.execute(text(FILL_READING), {'minutes': minutes, 'purposes': purposes})
+    print('filled reading with {} rows in {:.1f} s'.format(minutes * purposes, time.perf_counter() - start_time))
+    start_time = time.perf_counter()
+    end_datetime = pandas.Timestamp('2019-01-01') + pandas.Timedelta(minutes=minutes)
+    rollup.update_rollups(conn, {purpose_id: (pandas.Timestamp('2019-01-01'), end_datetime) for purpose_id in range(1, purposes + 1)})
+    conn.execute(text('ANALYZE reading; ANALYZE reading_rollup'))
+    print('filled reading_rollup in {:.1f} s'.format(time.perf_counter() - start_time))
+    parameters = {'week_start': end_datetime - pandas.Timedelta(days=7)}
+    print('{:<24}{:>16}{:>10}'.format('query', 'mean (s)', 'rows'))
+    for name, queries in (('5-minute averages', FIVE_MINUTE_QUERIES), ('hourly aggregates', HOURLY_QUERIES)):
+        for table, query in queries.items():
+            print('{:<24}{:>16.4f}{:>10}'.format(name + ' ' + ('raw' if table == 'reading' else 'rollup'), *time_query(conn, query, parameters, runs)))
+    run_seconds = []
+    rollup_seconds = []
+    for run in range(runs):
+        # each run inserts the next hour of readings, like a cron run
+        reading_frame = make_run(minutes + 60 * run, purposes)
+        start_time = time.perf_counter()
+        loader.copy_readings(conn, reading_frame, pandas.Timestamp('2030-01-01'))
+        run_seconds.append(time.perf_counter() - start_time)
+        # the part of the run spent updating the rollups, timed by computing the same buckets again
+        inserted_ranges = {purpose_id: (reading_frame['datetime'].min(), reading_frame['datetime'].max()) for purpose_id in range(1, purposes + 1)}
+        start_time = time.perf_counter()
+        rollup.update_rollups(conn, inserted_ranges)
+        rollup_seconds.append(time.perf_counter() - start_time)
+    print('{:<24}{:>16.4f}'.format('insert run', sum(run_seconds) / runs))
+    print('{:<24}{:>16.4f}'.format('  of which rollups', sum(rollup_seconds) / runs))
+    conn.rollback()
+    conn.close()
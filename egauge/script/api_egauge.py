@@ -8,44 +8,27 @@ The last_updated_datetime in the sensor_info table should be set to a valid valu
 """
 from io import StringIO
 from pathlib import Path
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import or_
 
-import configparser
+import argparse
+import concurrent.futures
 import logging
-import orm_egauge
 import os
-import pandas
 import pendulum
-import requests
 # import sqlalchemy #used for errors like sqlalchemy.exc.InternalError, sqlalchemy.exc.OperationalError
-# import sys
+import sys
+import time
 
+# add the project folder to sys.path so the shared sensors package can be imported
+sys.path.append(str(Path(os.path.dirname(os.path.realpath(__file__))).parent.parent))
+from sensors import db, journal, lazy, loader, metrics, orm, profiling, reshape, schedule
 
-SCRIPT_NAME = os.path.basename(__file__)
-logging.basicConfig(filename='error.log', format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+pandas = lazy.lazy_import('pandas')
+requests = lazy.lazy_import('requests')
 
 
-# connect to database by creating a session
-def get_db_handler():
-    """
-    1. get database name from text file "config.txt" in parent directory of webctrl/script/
-    2. create a sqlalchemy engine for database using database url
-    3. use sqlalchemy sessionmaker to create Session object from engine
-    4. create an instance of Session called conn (represents database "connection")
-    """
-    # get path of config file located in parent of parent directory
-    config_path = str(Path(os.path.dirname(os.path.realpath(__file__))).parent.parent) + "/config.txt"
-    with open(config_path, "r") as file:
-        #prepend '[DEFAULT]\n' since ConfigParser requires section headers in config files
-        config_string = '[DEFAULT]\n' + file.read()
-    config = configparser.ConfigParser()
-    config.read_string(config_string)
-    db_url = "postgresql:///" + config['DEFAULT']['db']
-    db = create_engine(db_url)
-    Session = sessionmaker(db)
-    conn = Session()
-    return conn
+SCRIPT_NAME = os.path.basename(__file__)
+logging.basicConfig(filename='error.log', format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
 
 
 #THIS FUNCTION WAS DISSOLVED INTO get_data_from_api() BUT REMAINS HERE FOR REFERENCE
@@ -55,30 +38,24 @@ def get_db_handler():
 # def get_most_recent_timestamp_from_db(conn):
 #     last_reading_timestamp = ''
 #     # conn.query(func.max...)[0][0] returns the first element in the first tuple in a list
-#     latest_datetime_successfully_inserted = conn.query(func.max(orm_egauge.ErrorLog.timestamp)).filter_by(is_success=True)[0][0]
+#     latest_datetime_successfully_inserted = conn.query(func.max(orm.ErrorLog.timestamp)).filter_by(is_success=True)[0][0]
 #     if latest_datetime_successfully_inserted:
 #         # shift timestamp 10 hours forward since HST is GMT - 10 hours
 #         last_reading_timestamp = arrow.get(latest_datetime_successfully_inserted).shift(hours = +10)
 #     return last_reading_timestamp
 
 
-# returns a readings dataframe
-#def get_readings_from_egauge_api(conn, query_string):
-def get_data_from_api(conn, query_string):
+def get_api_time_window(conn, query_string, current_time):
     """
     1. get a list of purpose_sensors that contain purpose id, sensor mapping, and last_updated_datetime
     from sensor_info table where rows have matching query_string and are active
-    2. download the data from api
+    2. use last_updated_datetime and current_time to get the time window of readings to request from the api
 
-    3. generate timestamp of data downloaded from api during 2 for each purpose_sensor tuple
-    4. for each purpose_sensor use purpose_id from 1 to insert success or failure in error_log
+    returns purpose_sensors and the time window as a dict of api parameters
     """
-    current_time = pendulum.now('Pacific/Honolulu')
-    # truncate time to hundredths of a second
-    current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
     # The next lines of code before setting api_start_time used to be in their own function get_most_recent_timestamp_from_db()
-    purpose_sensors = conn.query(orm_egauge.SensorInfo.purpose_id, orm_egauge.SensorInfo.data_sensor_info_mapping, orm_egauge.SensorInfo.last_updated_datetime, orm_egauge.SensorInfo.unit).\
-        filter_by(query_string=query_string,is_active=True)
+    purpose_sensors = conn.query(orm.SensorInfo.purpose_id, orm.SensorInfo.data_sensor_info_mapping, orm.SensorInfo.last_updated_datetime, orm.SensorInfo.unit).\
+        filter_by(query_string=query_string,is_active=True).order_by(orm.SensorInfo.purpose_id).all()
     last_updated_datetime = purpose_sensors[0].last_updated_datetime
     if last_updated_datetime:
         # Egauge api returns readings including the start time and excluding the end time.
@@ -91,84 +68,152 @@ def get_data_from_api(conn, query_string):
     current_timestamp = current_time.int_timestamp
     if api_start_timestamp > current_timestamp:
         raise ValueError('Error: api_start_timestamp ' + str(api_start_timestamp) + ' was later than current_timestamp ' + str(current_timestamp))
+    time_window = {'t': api_start_timestamp, 'f': current_timestamp}
+    return purpose_sensors, time_window
+
+
+def request_readings(query_string, time_window, timeout=None):
+    """
+    Download the readings in time_window from the egauge api and return them as a dataframe sorted by time
+
+    Does not use the database, so it can run in a worker thread.
+    timeout is passed to requests and limits how long to wait for the egauge to connect and respond.
+    The request and the csv parsing are timed as the request and parse_csv stages of sensors.metrics.
+    """
     delta_compression = 'C'
     output_csv = 'c'
     unit_of_time = 'm'
     host = 'http://{}.egaug.es/cgi-bin/egauge-show?'
     host = host.format(str(query_string)) + '&' + unit_of_time + '&' + output_csv + '&' + delta_compression
-    time_window = {'t': api_start_timestamp, 'f': current_timestamp}
-    request = requests.get(host, params=time_window)
+    with metrics.stage('request'):
+        request = requests.get(host, params=time_window, timeout=timeout)
+    metrics.add('request', bytes=len(request.content))
     if request.status_code == requests.codes.ok:
-        print('[' + str(current_time) + '] ' + 'Request was successful' + str(request))
-        readings = pandas.read_csv(StringIO(request.text))
-        readings = readings.sort_values(by='Date & Time')
+        with metrics.stage('parse_csv'):
+            readings = pandas.read_csv(StringIO(request.text))
+            readings = readings.sort_values(by='Date & Time')
+        metrics.add('parse_csv', rows=readings.shape[0])
         # # Set header=False if we don't want to append header and set index=False to remove index column.
         # readings.to_csv(path_or_buf=output_file, index=False, header=False, mode='a+')
         # # readings.to_csv(path_or_buf=output_file, mode='a+')
-        for purpose_sensor in purpose_sensors:
-            error_log_row = orm_egauge.ErrorLog(purpose_id=purpose_sensor.purpose_id, datetime=current_time, was_success=True, pipeline_stage=orm_egauge.ErrorLog.PipelineStageEnum.data_acquisition)
-            conn.add(error_log_row)
-        conn.commit()
-        return readings, purpose_sensors
+        return readings
     else:
         request.raise_for_status()
 
 
+def log_success_to_connect_to_api(conn, purpose_sensors, current_time):
+    """
+    for each purpose_sensor insert a successful data_acquisition row into error_log, all in one insert
+    """
+    print('[' + str(current_time) + '] ' + 'Request was successful')
+    error_log_journal = journal.Journal()
+    for purpose_sensor in purpose_sensors:
+        error_log_journal.record(purpose_sensor.purpose_id, current_time, orm.ErrorLog.PipelineStageEnum.data_acquisition, was_success=True)
+    error_log_journal.flush(conn)
+    conn.commit()
+
+
+# returns a readings dataframe
+#def get_readings_from_egauge_api(conn, query_string):
+def get_data_from_api(conn, query_string, timeout=None):
+    """
+    1. get purpose_sensors and the api time window for query_string
+    2. download the data from api
+
+    3. generate timestamp of data downloaded from api during 2 for each purpose_sensor tuple
+    4. for each purpose_sensor use purpose_id from 1 to insert success or failure in error_log
+    """
+    current_time = pendulum.now('Pacific/Honolulu')
+    # truncate time to hundredths of a second
+    current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
+    purpose_sensors, time_window = get_api_time_window(conn, query_string, current_time)
+    readings = request_readings(query_string, time_window, timeout)
+    log_success_to_connect_to_api(conn, purpose_sensors, current_time)
+    return readings, purpose_sensors
+
+
+def get_data_from_api_concurrently(conn, query_strings, max_workers, timeout):
+    """
+    Download readings for several egauges at once
+
+    1. for each query_string get purpose_sensors and the api time window (in the main thread, since conn is not thread safe)
+    2. request readings for up to max_workers egauges at a time in a thread pool
+    3. yield (query_string, readings, purpose_sensors) as each request finishes, logging success to error_log,
+    so the caller can insert readings while other requests are still in flight
+
+    Failures to get a time window or to download readings are logged to error_log and are not yielded.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for query_string in query_strings:
+            current_time = pendulum.now('Pacific/Honolulu')
+            current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
+            try:
+                with metrics.stage('time_window'):
+                    purpose_sensors, time_window = get_api_time_window(conn, query_string, current_time)
+            except Exception as e:
+                log_failure_to_connect_to_api(conn, e, query_string)
+                continue
+            future = executor.submit(request_readings, query_string, time_window, timeout)
+            futures[future] = (query_string, purpose_sensors, current_time)
+        for future in concurrent.futures.as_completed(futures):
+            query_string, purpose_sensors, current_time = futures[future]
+            try:
+                readings = future.result()
+            # catch egauge api request exceptions like requests.exceptions.ConnectionError, requests.exceptions.Timeout
+            except Exception as e:
+                log_failure_to_connect_to_api(conn, e, query_string)
+                continue
+            log_success_to_connect_to_api(conn, purpose_sensors, current_time)
+            yield query_string, readings, purpose_sensors
+
+
 #def insert_egauge_readings_into_db(conn, readings, sensors):
 def insert_readings_into_database(conn, readings, purpose_sensors):
     """
-    1. iterate through purpose_sensors list
-        2. iterate through rows in readings
-            3. iterate through columns in row
-                4. insert values where column name matches data_sensor_info_mapping
-                5. keep track of last reading datetimes in new_last_updated_datetime
-        6. attempt to update last_updated_datetime to new_last_updated_datetime using purpose_sensor.purpose_id if
-        any rows were inserted
-        7. generate timestamp of data insert attempt during step 2
-        8. use purpose_sensor.purpose_id to insert success or failure of data insert attempt during step 2
-    9. commit database inserts and updates
+    1. reshape readings into a reading frame with one row per reading of each purpose_sensor
+    (readings columns are matched to purpose_sensor.data_sensor_info_mapping)
+    2. generate timestamp of data insert attempt
+    3. use purpose_sensor.purpose_id to record a success row for each purpose_sensor in a sensors.journal.Journal,
+    and flush it to insert every row and get their log_ids (the rows are rolled back with the readings if step 4 fails)
+    4. bulk load every row of the reading frame into the reading table with the log_id of its purpose,
+    skipping readings already in the table
+    5. iterate through purpose_sensors list and attempt to update last_updated_datetime to the purpose's
+    latest reading datetime if any rows were inserted
+    6. commit database inserts and updates
+
+    returns a dict of the number of readings inserted for each purpose_id
     """
     current_time = pendulum.now('Pacific/Honolulu')
     current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
-    rows_returned = readings.shape[0]
-    for purpose_sensor in purpose_sensors:
-        # The reading time of the last row inserted into the reading table
-        rows_inserted = 0
-        new_last_updated_datetime = ''
-        # check if any values were returned
-        if rows_returned > 0:
-            # get a list of column names from readings dataframe
-            columns = list(readings.columns.values)
-            # attempt to insert data from each row of the readings dataframe into reading table
-            for row in readings.itertuples():
-                # appears that no timezone shifting needed but needs further testing
-                row_datetime = pendulum.from_timestamp(row[1])  # in_timezone('Pacific/Honolulu')
-                row_datetime = row_datetime.set(microsecond=row_datetime.microsecond - (row_datetime.microsecond % 10000))
-                # iterate through each column after "Date & Time"
-                for i, column_reading in enumerate(row[2:]):
-                    row_reading = column_reading
-                    # get column name
-                    column_name = columns[i+1]
-                    # only insert column's reading if data_sensor_info_mapping matches column_name
-                    if purpose_sensor.data_sensor_info_mapping == column_name:
-                        reading_row = orm_egauge.Reading(purpose_id=purpose_sensor.purpose_id, datetime=row_datetime, reading=row_reading, units=purpose_sensor.unit, upload_timestamp=current_time)
-                        conn.add(reading_row)
-                        rows_inserted += 1
-                        new_last_updated_datetime = row_datetime
-        if rows_inserted > 0:
-            conn.query(orm_egauge.SensorInfo.purpose_id).filter(orm_egauge.SensorInfo.purpose_id == purpose_sensor.purpose_id).update({"last_updated_datetime": new_last_updated_datetime})
-        error_log_row = orm_egauge.ErrorLog(purpose_id=purpose_sensor.purpose_id, datetime=current_time, pipeline_stage=orm_egauge.ErrorLog.PipelineStageEnum.database_insertion, was_success=True)
-        conn.add(error_log_row)
-        # need to flush and refresh to get error_log_row.log_id
-        conn.flush()
-        conn.refresh(error_log_row)
-        # update current set of readings with related log_id
-        conn.query(orm_egauge.Reading.log_id).\
-            filter(orm_egauge.Reading.purpose_id == purpose_sensor.purpose_id,
-                   orm_egauge.Reading.upload_timestamp == current_time).\
-            update({'log_id':error_log_row.log_id})
-        print(str(rows_inserted) + ' readings(s) attempted to be inserted by ' + SCRIPT_NAME)
-    conn.commit()
+    # appears that no timezone shifting needed but needs further testing
+    with metrics.stage('reshape'):
+        reading_frame = reshape.melt_wide_readings(readings, reshape.epoch_to_datetime(readings['Date & Time']), purpose_sensors)
+    metrics.add('reshape', rows=reading_frame.shape[0])
+    with metrics.stage('error_log'):
+        error_log_journal = journal.Journal()
+        # the log_ids are returned in the order the rows were recorded, so they are matched to the same list of purpose_ids
+        purpose_ids = [purpose_sensor.purpose_id for purpose_sensor in purpose_sensors]
+        for purpose_id in purpose_ids:
+            error_log_journal.record(purpose_id, current_time, orm.ErrorLog.PipelineStageEnum.database_insertion, was_success=True)
+        # the error_log rows are inserted first to get the log_id of each purpose
+        log_ids = error_log_journal.flush(conn)
+    metrics.add('error_log', rows=len(log_ids))
+    with metrics.stage('copy'):
+        rows_inserted = loader.copy_readings(conn, reading_frame, current_time, log_ids=dict(zip(purpose_ids, log_ids)))
+    metrics.add('copy', rows=sum(rows_inserted.values()))
+    new_last_updated_datetimes = reshape.last_reading_datetimes(reading_frame)
+    with metrics.stage('update_sensor_info'):
+        for purpose_sensor in purpose_sensors:
+            if purpose_sensor.purpose_id in new_last_updated_datetimes.index:
+                new_last_updated_datetime = new_last_updated_datetimes[purpose_sensor.purpose_id].to_pydatetime()
+                # only move last_updated_datetime forward, since a backfill may insert readings older than it
+                conn.query(orm.SensorInfo.purpose_id).filter(orm.SensorInfo.purpose_id == purpose_sensor.purpose_id,
+                                                                    or_(orm.SensorInfo.last_updated_datetime == None, orm.SensorInfo.last_updated_datetime < new_last_updated_datetime)).\
+                    update({"last_updated_datetime": new_last_updated_datetime}, synchronize_session=False)
+            print(str(rows_inserted.get(purpose_sensor.purpose_id, 0)) + ' reading(s) inserted by ' + SCRIPT_NAME)
+        conn.commit()
+    return rows_inserted
 
 
 #log_failure_to_get_readings_from_egauge_api
@@ -176,12 +221,13 @@ def log_failure_to_connect_to_api(conn, exception, query_string):
     current_time = pendulum.now('Pacific/Honolulu')
     current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
     # get all purpose_ids associated with query_string
-    purpose_ids = [purpose_id[0] for purpose_id in conn.query(orm_egauge.SensorInfo.purpose_id).filter_by(query_string=query_string, is_active=True)]
+    purpose_ids = [purpose_id[0] for purpose_id in conn.query(orm.SensorInfo.purpose_id).filter_by(query_string=query_string, is_active=True)]
     logging.exception('Egauge API data request error')
+    error_log_journal = journal.Journal()
     for purpose_id in purpose_ids:
-        error_log_row = orm_egauge.ErrorLog(datetime=current_time, error_type=exception.__class__.__name__, pipeline_stage=orm_egauge.ErrorLog.PipelineStageEnum.data_acquisition, purpose_id=purpose_id, was_success=False)
-        conn.add(error_log_row)
-        conn.commit()
+        error_log_journal.record(purpose_id, current_time, orm.ErrorLog.PipelineStageEnum.data_acquisition, was_success=False, error_type=exception.__class__.__name__)
+    error_log_journal.flush(conn)
+    conn.commit()
 
 
 #log_failure_to_insert_egauge_readings_into_db
@@ -191,28 +237,61 @@ def log_failure_to_connect_to_database(conn, exception, purpose_sensors):
     current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
     logging.exception('Egauge reading insertion error')
     conn.rollback()
+    error_log_journal = journal.Journal()
     for purpose_sensor in purpose_sensors:
-        error_log_row = orm_egauge.ErrorLog(datetime=current_time, error_type=exception.__class__.__name__, purpose_id=purpose_sensor.purpose_id, pipeline_stage=orm_egauge.ErrorLog.PipelineStageEnum.database_insertion, was_success=False)
-        conn.add(error_log_row)
-        conn.commit()
+        error_log_journal.record(purpose_sensor.purpose_id, current_time, orm.ErrorLog.PipelineStageEnum.database_insertion, was_success=False, error_type=exception.__class__.__name__)
+    error_log_journal.flush(conn)
+    conn.commit()
 
 
-if __name__ == '__main__':
-    # start the database connection
-    conn = get_db_handler()
-    # get a list of all unique query_string's for active egauges from sensor_info table
-    query_strings = [query_string[0] for query_string in conn.query(orm_egauge.SensorInfo.query_string).filter_by(script_folder=orm_egauge.SensorInfo.ScriptFolderEnum.egauge, is_active=True).distinct()]
+def run(Session, max_workers=8, timeout=60):
+    """
+    Request readings from every active egauge that is due to be polled and insert them, using a session created with Session
+
+    An egauge is due if any of its purposes is due according to sensors.schedule;
+    the next poll of each purpose is scheduled from its sample_resolution and whether new readings were inserted.
+    Called once per cron run by __main__ and once per cycle by sensors/daemon.py
+    The time and rows of each stage are recorded in run_metrics by sensors.metrics.
+    """
+    metrics.start_run('egauge')
+    conn = Session()
+    current_time = pendulum.now('Pacific/Honolulu')
+    current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
+    purposes = conn.query(orm.SensorInfo.purpose_id, orm.SensorInfo.query_string, orm.SensorInfo.sample_resolution).filter_by(script_folder=orm.SensorInfo.ScriptFolderEnum.egauge, is_active=True).all()
+    due_purpose_ids = schedule.get_due_purpose_ids(conn, [purpose.purpose_id for purpose in purposes], current_time)
+    # get a list of all unique query_string's for active egauges with a purpose that is due
+    query_strings = sorted(set(purpose.query_string for purpose in purposes if purpose.purpose_id in due_purpose_ids))
+    print(str(len(query_strings)) + ' egauge(s) due to be polled')
     for query_string in query_strings:
+        profiling.tag(query_string)
+    # purposes of egauges that fail or return nothing are backed off
+    new_readings = {}
+    # requests run in worker threads; readings are inserted one egauge at a time as requests finish
+    for query_string, readings, purpose_sensors in get_data_from_api_concurrently(conn, query_strings, max_workers, timeout):
         try:
-            # readings is a pandas dataframe
-            readings, purpose_sensors = get_data_from_api(conn, query_string)
-        # catch egauge api request exceptions like requests.exceptions.ConnectionError, ValueError
-        except (requests.exceptions.ConnectionError, Exception) as e:
-            log_failure_to_connect_to_api(conn, e, query_string)
-            continue
-        try:
-            insert_readings_into_database(conn, readings, purpose_sensors)
+            new_readings.update(insert_readings_into_database(conn, readings, purpose_sensors))
         # catch database errors like sqlalchemy.exc.InternalError, sqlalchemy.exc.OperationalError
         except Exception as e:
             log_failure_to_connect_to_database(conn, e, purpose_sensors)
+    with metrics.stage('schedule'):
+        for purpose in purposes:
+            if purpose.query_string in query_strings:
+                schedule.record_poll(conn, purpose.purpose_id, purpose.sample_resolution, new_readings.get(purpose.purpose_id, 0), current_time)
+        conn.commit()
     conn.close()
+    metrics.finish_run(Session)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Request readings from active egauges and insert them into the database')
+    parser.add_argument('--max-workers', type=int, default=8, help='maximum number of egauges to request readings from at once')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for an egauge to connect or send data')
+    parser.add_argument('--profile', choices=('cpu', 'memory', 'all'),
+                        help='profile the run with cProfile (cpu), tracemalloc (memory) or both (all), writing the profiles next to error.log (default: the SENSORS_PROFILE environment variable)')
+    parser.add_argument('--start-delay', type=float, default=schedule.START_DELAY,
+                        help='wait a random number of seconds up to this before requesting readings, so runs started by cron at the same second are spread out (default ' + str(schedule.START_DELAY) + ')')
+    args = parser.parse_args()
+    time.sleep(schedule.get_start_delay(args.start_delay))
+    # start the database connection
+    with profiling.profile_run('egauge', args.profile):
+        run(db.get_sessionmaker(), args.max_workers, args.timeout)
@@ -5,11 +5,21 @@ Test suite for api_egauge using the unittest module
 WARNING: running this test modifies the postgresql database named "test"
 """
 from freezegun import freeze_time
+from pathlib import Path
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
 
+# api_egauge appends the project folder to sys.path, so it is imported before sensors
 import api_egauge
-import orm_egauge
+from sensors import orm
+import http.server
+import os
 import pandas
 import pendulum
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
 
 
@@ -27,25 +37,25 @@ class TestEgaugeAPI(unittest.TestCase):
 
 
     def setUp(self):
-        db = api_egauge.create_engine(self.db_url)
-        orm_egauge.BASE.metadata.create_all(db)
+        db = create_engine(self.db_url)
+        orm.BASE.metadata.create_all(db)
 
 
     def tearDown(self):
-        db = api_egauge.create_engine(self.db_url)
-        orm_egauge.BASE.metadata.drop_all(db)
+        db = create_engine(self.db_url)
+        orm.BASE.metadata.drop_all(db)
 
 
     # test if two subsequent calls to get_data_from_api() will return duplicate timestamps
     def test_api_requested_data_doesnt_overlap(self):
-        db = api_egauge.create_engine(self.db_url)
-        Session = api_egauge.sessionmaker(db)
+        db = create_engine(self.db_url)
+        Session = sessionmaker(db)
         conn = Session()
         timestamps = [pendulum.parse('2019-02-01T00:00:00-10:00'), pendulum.parse('2019-02-01T00:05:00-10:00'), pendulum.parse('2019-02-01T00:10:00-10:00')]
         # Shift timestamp back by 60 seconds when inserting table
         # because get_data_from_api() will use timestamp + 60 seconds
         # for the start time in its api request.
-        sensor_row = orm_egauge.SensorInfo(query_string=self.query_string, script_folder="egauge", purpose_id=1, data_sensor_info_mapping="Usage [kW]", last_updated_datetime=timestamps[0].subtract(seconds=60), is_active=True)
+        sensor_row = orm.SensorInfo(query_string=self.query_string, script_folder="egauge", purpose_id=1, data_sensor_info_mapping="Usage [kW]", last_updated_datetime=timestamps[0].subtract(seconds=60), is_active=True)
         conn.add(sensor_row)
         conn.commit()
         # get_data_from_api() adds 60 seconds to api_start_timestamp arg when making egauge api call
@@ -57,7 +67,7 @@ class TestEgaugeAPI(unittest.TestCase):
         print(index1)
         # reading_dataframe1.to_csv(path_or_buf='test_output.log', mode='a+')
 
-        conn.query(orm_egauge.SensorInfo.purpose_id).filter(orm_egauge.SensorInfo.query_string == self.query_string).update({"last_updated_datetime": timestamps[1].subtract(seconds=60)})
+        conn.query(orm.SensorInfo.purpose_id).filter(orm.SensorInfo.query_string == self.query_string).update({"last_updated_datetime": timestamps[1].subtract(seconds=60)})
         conn.commit()
         frozen_time2 = timestamps[2]
         with freeze_time(time_to_freeze=frozen_time2):
@@ -75,13 +85,13 @@ class TestEgaugeAPI(unittest.TestCase):
     # test get_data_from_api() for missing rows by confirming
     # if the correct number of values are returned from an api request
     def test_api_requested_data_for_missing_rows(self):
-        db = api_egauge.create_engine(self.db_url)
-        Session = api_egauge.sessionmaker(db)
+        db = create_engine(self.db_url)
+        Session = sessionmaker(db)
         conn = Session()
         start_timestamp = pendulum.parse('2019-02-01T00:00:00.000-10:00')
         end_timestamp = pendulum.parse('2019-02-01T00:15:44.100-10:00')
         #insert start_timestamp into database_insertion_timestamp
-        sensor_row = orm_egauge.SensorInfo(query_string=self.query_string, script_folder="egauge", purpose_id=1, data_sensor_info_mapping="Usage [kW]", last_updated_datetime=start_timestamp.subtract(seconds=60), is_active=True)
+        sensor_row = orm.SensorInfo(query_string=self.query_string, script_folder="egauge", purpose_id=1, data_sensor_info_mapping="Usage [kW]", last_updated_datetime=start_timestamp.subtract(seconds=60), is_active=True)
         conn.add(sensor_row)
         conn.commit()
         frozen_time = end_timestamp
@@ -109,5 +119,60 @@ class TestEgaugeAPI(unittest.TestCase):
     """
 
 
+class TestRequestReadingsThreads(unittest.TestCase):
+    """
+    A test of request_readings() in worker threads of a new interpreter, where pandas and requests are not imported yet,
+    like the first requests of a cron run
+
+    The readings are requested from a local http server instead of an egauge, so no database or network is used
+    """
+    csv = 'Date & Time,Usage [kW]\n1549015260,1.5\n1549015200,1.0\n'
+    threads = 8
+    # "host" is formatted into http://<query_string>.egaug.es/..., so a query_string with a path requests the local server
+    request_statement = """
+import api_egauge
+import concurrent.futures
+import sys
+with concurrent.futures.ThreadPoolExecutor(max_workers={threads}) as executor:
+    futures = [executor.submit(api_egauge.request_readings, sys.argv[1], {{'t': 1549015200, 'f': 1549015320}}, 10) for i in range({threads})]
+    for future in futures:
+        print(future.result().shape[0])
+"""
+
+
+    def setUp(self):
+        csv = self.csv.encode()
+
+        class CsvHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(csv)))
+                self.end_headers()
+                self.wfile.write(csv)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), CsvHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def test_request_readings_in_threads_of_a_cold_import(self):
+        query_string = '127.0.0.1:' + str(self.server.server_address[1]) + '/egauge'
+        script_path = str(Path(os.path.dirname(os.path.realpath(__file__))))
+        environment = dict(os.environ, PYTHONPATH=script_path, NO_PROXY='127.0.0.1', no_proxy='127.0.0.1')
+        # run in a temporary folder, since api_egauge logs to error.log in the current folder
+        with tempfile.TemporaryDirectory() as folder:
+            result = subprocess.run([sys.executable, '-c', self.request_statement.format(threads=self.threads), query_string],
+                                    cwd=folder, env=environment, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.split(), ['2'] * self.threads)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,72 +1,169 @@
 #!../../egauge/script/env/bin/python3
 from pathlib import Path
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import or_
 
-import configparser
+import argparse
+import collections
+import concurrent.futures
 import csv
 import glob
+import hashlib
 import logging
-import orm_hobo
 import os
-import pandas
 import pendulum
+import sys
+import time
+
+# add the project folder to sys.path so the shared sensors package can be imported
+sys.path.append(str(Path(os.path.dirname(os.path.realpath(__file__))).parent.parent))
+from sensors import db, journal, lazy, loader, metrics, orm, profiling, reshape
+
+numpy = lazy.lazy_import('numpy')
+pandas = lazy.lazy_import('pandas')
 
 
 logging.basicConfig(filename='error.log', format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+# hobo csv exports have one datetime column with this name and format, e.g. "02/03/17 04:00:00 PM"
+DATETIME_COLUMN = 'Date Time, GMT-10:00'
+DATETIME_FORMAT = '%m/%d/%y %I:%M:%S %p'
+# bytes read from a csv file at a time when hashing its contents
+HASH_BLOCK_SIZE = 1048576
+
+# identifies a csv file in the csv_file_manifest table
+ManifestKey = collections.namedtuple('ManifestKey', ['content_hash', 'file_size', 'modified_datetime'])
 
 
-def get_db_handler():
+def read_hobo_csv(csv_filename):
     """
-    connect to database by creating a session
+    Read a hobo csv export into its query_string (the hobo sensor id) and a readings dataframe
+
+    1. read the first line ("Plot Title: <query_string>") to get the query_string
+    2. read the header line to get the column names
+    3. read the remaining lines from the same file handle with pandas.read_csv, with every reading column typed as float
+    4. parse the datetime column with the fixed DATETIME_FORMAT instead of inferring the format row by row
+
+    The "#" row number column is dropped.
     """
-    config_path = str(Path(os.path.dirname(os.path.realpath(__file__))).parent.parent) + "/config.txt"
-    with open(config_path, "r") as file:
-        # prepend '[DEFAULT]\n' since ConfigParser requires section headers in config files
-        config_string = '[DEFAULT]\n' + file.read()
-    config = configparser.ConfigParser()
-    config.read_string(config_string)
-    db_url = "postgresql:///" + config['DEFAULT']['db']
-    # connect to the database
-    db = create_engine(db_url)
-    Session = sessionmaker(db)
-    conn = Session()
-    return conn
+    # utf-8-sig removes the byte order mark hobo exports start with
+    with open(csv_filename, 'r', encoding='utf-8-sig') as file:
+        # Remove the first row, which breaks the csv format and contains the hobo sensor id
+        line1 = next(csv.reader([file.readline()]))[0]
+        #Extract query_string
+        # the next commented out line has a weird bug that sometimes removes the last digit instead of the trailing quotation mark
+        # query_string = line1.split(': ')[1][0:-1]
+        query_string = line1.split(': ')[1][0:]
+        # check if trailing quotation mark is present and remove if so
+        if query_string[-1:] == "\"":
+            query_string = query_string[0:-1]
+        columns = next(csv.reader([file.readline()]))
+        # remove 1st column ("#"), since the dataframe has its own index column
+        csv_readings = pandas.read_csv(file, header=None, names=columns, usecols=columns[1:],
+                                       dtype={column: numpy.float64 for column in columns[2:]})
+    csv_readings[DATETIME_COLUMN] = pandas.to_datetime(csv_readings[DATETIME_COLUMN], format=DATETIME_FORMAT)
+    return query_string, csv_readings
+
+
+def parse_csv_file(csv_filename):
+    """
+    Read csv file with read_hobo_csv(), remove rows with duplicate datetimes and sort rows by datetime
+
+    Does not use the database, so it can run in a worker process.
+    Returns the query_string, the csv_readings dataframe and the seconds spent parsing
+    """
+    start_time = time.perf_counter()
+    query_string, csv_readings = read_hobo_csv(csv_filename)
+    #Remove duplicates
+    csv_readings = csv_readings.drop_duplicates(subset=[DATETIME_COLUMN])
+    #sort csv_readings dataframe by timestamp
+    csv_readings = csv_readings.sort_values(by=[DATETIME_COLUMN])
+    return query_string, csv_readings, time.perf_counter() - start_time
+
+
+def hash_csv_file(csv_filename, block_size=HASH_BLOCK_SIZE):
+    """
+    Return the sha256 hex digest of the contents of csv_filename
+    """
+    content_hash = hashlib.sha256()
+    with open(csv_filename, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            content_hash.update(block)
+    return content_hash.hexdigest()
+
+
+def get_csv_files_not_in_manifest(conn, csv_filenames):
+    """
+    Use the csv_file_manifest table to find the csv files that still need to be processed
+
+    1. stat each file and skip it if the manifest has a row with the same csv_filename, file_size and modified_datetime
+    2. hash the remaining files and skip a file if the manifest has a row with the same content_hash (e.g. the file was copied or touched),
+    adding a row with its new csv_filename and modified_datetime so the next run only needs to stat it
+
+    Files whose manifest row has outcome failed are processed again.
+    Returns a list of (csv_filename, ManifestKey) tuples for the files to process
+    """
+    current_time = pendulum.now('Pacific/Honolulu')
+    current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
+    Manifest = orm.CsvFileManifest
+    csv_files = []
+    for csv_filename in csv_filenames:
+        file_stat = os.stat(csv_filename)
+        modified_datetime = pendulum.from_timestamp(file_stat.st_mtime, tz='Pacific/Honolulu')
+        manifest_row = conn.query(Manifest).filter_by(csv_filename=csv_filename, file_size=file_stat.st_size, modified_datetime=modified_datetime).first()
+        if manifest_row and manifest_row.outcome != Manifest.OutcomeEnum.failed:
+            continue
+        content_hash = manifest_row.content_hash if manifest_row else hash_csv_file(csv_filename)
+        manifest_key = ManifestKey(content_hash, file_stat.st_size, modified_datetime)
+        processed_row = conn.query(Manifest).filter(Manifest.content_hash == content_hash, Manifest.outcome != Manifest.OutcomeEnum.failed).first()
+        if processed_row:
+            conn.merge(Manifest(csv_filename=csv_filename, outcome=processed_row.outcome, query_string=processed_row.query_string,
+                                earliest_reading_datetime=processed_row.earliest_reading_datetime, latest_reading_datetime=processed_row.latest_reading_datetime,
+                                rows_inserted=0, processed_datetime=current_time, **manifest_key._asdict()))
+            conn.commit()
+            continue
+        csv_files.append((csv_filename, manifest_key))
+    return csv_files
+
+
+def record_csv_file_outcome(conn, csv_filename, manifest_key, outcome, csv_metadata=None, rows_inserted=0):
+    """
+    Insert or update the csv_file_manifest row of csv_filename with the outcome of processing it and commit
+
+    csv_metadata is the metadata returned by get_csv_from_folder_not_in_db(), if the file was read
+    """
+    current_time = pendulum.now('Pacific/Honolulu')
+    current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
+    manifest_row = orm.CsvFileManifest(csv_filename=csv_filename, outcome=outcome, rows_inserted=rows_inserted, processed_datetime=current_time, **manifest_key._asdict())
+    if csv_metadata:
+        new_readings, earliest_csv_timestamp, csv_modified_timestamp, query_string, latest_csv_timestamp, sensor_info_rows = csv_metadata
+        manifest_row.query_string = query_string
+        manifest_row.earliest_reading_datetime = earliest_csv_timestamp
+        manifest_row.latest_reading_datetime = latest_csv_timestamp
+    try:
+        conn.merge(manifest_row)
+        conn.commit()
+    except Exception:
+        # the file is processed again by the next run, where its readings are found to be already inserted
+        conn.rollback()
+        logging.exception('record_csv_file_outcome')
 
 
-def get_csv_from_folder_not_in_db(conn, csv_filename):
+def get_csv_from_folder_not_in_db(conn, csv_filename, parsed_csv=None):
     """
     Create reading dataframe and metadata list using csv file
 
-    Takes database session 'conn' and 'csv_filename' string as arguments
+    Takes database session 'conn' and 'csv_filename' string as arguments,
+    and optionally 'parsed_csv', the result of parse_csv_file() if the file was already parsed in a worker process
 
-    Opens csv file, reads file as dataframe and extracts metadata into a list
+    Parses csv file as dataframe with parse_csv_file() and extracts metadata into a list
     Checks if the timestamp of the earliest and latest rows in dataframe are already in db for a given query_string
     """
     current_time = pendulum.now('Pacific/Honolulu')
     current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
     #assume there are no new readings by default
     new_readings = False
-    with open(csv_filename, 'r') as file:
-        reader = csv.reader(file)
-        # Remove the first row, which breaks the csv format and contains the hobo sensor id
-        line1 = next(reader)
-        line1 = line1[0]
-        #Extract query_string
-        # the next commented out line has a weird bug that sometimes removes the last digit instead of the trailing quotation mark
-        # query_string = line1.split(': ')[1][0:-1]
-        query_string = line1.split(': ')[1][0:]
-        # check if trailing quotation mark is present and remove if so
-        if query_string[-1:] is "\"":
-            query_string = query_string[0:-1]
-        #Store in table the remainder of the table
-        table = list(reader)
-    # #TEST
-    # print(table[0:3])
-    # create dataframe from table
-    csv_readings = pandas.DataFrame(table[1:], columns=table[0])
-    # remove 1st column from dataframe ("#"), since created dataframe automatically has its own index column
-    csv_readings = csv_readings.iloc[:, 1:]
+    if parsed_csv is None:
+        parsed_csv = parse_csv_file(csv_filename)
+    query_string, csv_readings = parsed_csv[:2]
     # #Extract timezone and units
     # timezone_units = csv_readings.columns
     # print("timezone_units: ", timezone_units)
@@ -78,55 +175,51 @@ def get_csv_from_folder_not_in_db(conn, csv_filename):
     # create a list of sensor_info_rows which will be used to iterate through each data_sensor_info_mapping in each csv_reading row in the insert...() function
     sensor_info_rows = []
     for data_sensor_info_mapping in csv_readings.columns[1:]:
-        purpose_id, last_updated_datetime, unit = conn.query(orm_hobo.SensorInfo.purpose_id, orm_hobo.SensorInfo.last_updated_datetime, orm_hobo.SensorInfo.unit).filter_by(query_string=query_string, data_sensor_info_mapping=data_sensor_info_mapping, is_active=True).first()[:3]
-        sensor_info_rows.append(orm_hobo.SensorInfo(data_sensor_info_mapping=data_sensor_info_mapping, purpose_id=purpose_id, last_updated_datetime=last_updated_datetime, unit=unit))
+        purpose_id, last_updated_datetime, unit = conn.query(orm.SensorInfo.purpose_id, orm.SensorInfo.last_updated_datetime, orm.SensorInfo.unit).filter_by(query_string=query_string, data_sensor_info_mapping=data_sensor_info_mapping, is_active=True).first()[:3]
+        sensor_info_rows.append(orm.SensorInfo(data_sensor_info_mapping=data_sensor_info_mapping, purpose_id=purpose_id, last_updated_datetime=last_updated_datetime, unit=unit))
     # # Units
     # timezone_units = [x.split(', ')[1] for x in timezone_units]
     # #Timezone needs no further pre-processing
     # timezone = timezone_units[0]
     # #But units do:
     # units = [x.split(' ')[0] for x in timezone_units[1:]]
-    #Remove duplicates
-    csv_readings = csv_readings.drop_duplicates(subset=['Date Time, GMT-10:00'])
-    #convert date column from string objects to datetimes
-    csv_readings['Date Time, GMT-10:00'] = pandas.to_datetime(csv_readings['Date Time, GMT-10:00'])
-    #sort csv_readings dataframe by timestamp
-    csv_readings = csv_readings.sort_values(by=['Date Time, GMT-10:00'])
     # #TEST
     # csv_readings.to_csv(path_or_buf='output.txt')
     csv_modified_timestamp = pendulum.from_timestamp(os.path.getmtime(csv_filename), tz='Pacific/Honolulu')
-    earliest_csv_timestamp = pendulum.instance(csv_readings.iloc[0]['Date Time, GMT-10:00'], 'Pacific/Honolulu')
-    latest_csv_timestamp = pendulum.instance(csv_readings.iloc[csv_readings.shape[0]-1]['Date Time, GMT-10:00'], 'Pacific/Honolulu')
+    earliest_csv_timestamp = pendulum.instance(csv_readings.iloc[0][DATETIME_COLUMN], 'Pacific/Honolulu')
+    latest_csv_timestamp = pendulum.instance(csv_readings.iloc[csv_readings.shape[0]-1][DATETIME_COLUMN], 'Pacific/Honolulu')
+    csv_details = get_csv_details(csv_filename, csv_modified_timestamp, earliest_csv_timestamp, latest_csv_timestamp)
+    # the rows are committed with the readings, or rolled back with them if the insertion fails
+    error_log_journal = journal.Journal()
     for sensor_info_row in sensor_info_rows:
-        error_log_row = orm_hobo.ErrorLog(was_success=True, purpose_id=sensor_info_row.purpose_id, datetime=current_time, pipeline_stage=orm_hobo.ErrorLog.PipelineStageEnum.data_acquisition)
-        conn.add(error_log_row)
-        # need to flush and refresh to get error_log_row.log_id
-        conn.flush()
-        conn.refresh(error_log_row)
-        csv_filename_row = orm_hobo.ErrorLogDetails(log_id=error_log_row.log_id, information_type="csv_filename", information_value=csv_filename)
-        conn.add(csv_filename_row)
-        csv_modified_timestamp_row = orm_hobo.ErrorLogDetails(log_id=error_log_row.log_id, information_type="csv_modified_timestamp", information_value=csv_modified_timestamp)
-        conn.add(csv_modified_timestamp_row)
-        earliest_csv_timestamp_row = orm_hobo.ErrorLogDetails(log_id=error_log_row.log_id, information_type="earliest_csv_timestamp", information_value=earliest_csv_timestamp)
-        conn.add(earliest_csv_timestamp_row)
-        latest_csv_timestamp_row = orm_hobo.ErrorLogDetails(log_id=error_log_row.log_id, information_type="latest_csv_timestamp", information_value=latest_csv_timestamp)
-        conn.add(latest_csv_timestamp_row)
+        error_log_journal.record(sensor_info_row.purpose_id, current_time, orm.ErrorLog.PipelineStageEnum.data_acquisition, was_success=True, details=csv_details)
+    error_log_journal.flush(conn)
     # check if earliest and latest file_timestamps are already in db and set new_readings variable
     # assume that if first or last timestamps in csv were already inserted for that given timestamp and query_string, then all were already inserted
-    earliest_csv_timestamp_is_in_db = conn.query(orm_hobo.Reading).filter_by(datetime=earliest_csv_timestamp, purpose_id=sensor_info_rows[0].purpose_id).first()
-    latest_csv_timestamp_is_in_db = conn.query(orm_hobo.Reading).filter_by(datetime=latest_csv_timestamp, purpose_id=sensor_info_rows[0].purpose_id).first()
+    earliest_csv_timestamp_is_in_db = conn.query(orm.Reading).filter_by(datetime=earliest_csv_timestamp, purpose_id=sensor_info_rows[0].purpose_id).first()
+    latest_csv_timestamp_is_in_db = conn.query(orm.Reading).filter_by(datetime=latest_csv_timestamp, purpose_id=sensor_info_rows[0].purpose_id).first()
     if not earliest_csv_timestamp_is_in_db and not latest_csv_timestamp_is_in_db:
         new_readings = True
     return csv_readings, (new_readings, earliest_csv_timestamp, csv_modified_timestamp, query_string, latest_csv_timestamp, sensor_info_rows)
 
 
+def get_csv_details(csv_filename, csv_modified_timestamp, earliest_csv_timestamp, latest_csv_timestamp):
+    """
+    Return the error_log_details information_type: information_value of a csv file, written for each of its sensors
+    """
+    return {'csv_filename': csv_filename, 'csv_modified_timestamp': csv_modified_timestamp,
+            'earliest_csv_timestamp': earliest_csv_timestamp, 'latest_csv_timestamp': latest_csv_timestamp}
+
+
 def insert_csv_readings_into_db(conn, csv_readings, csv_metadata, csv_filename):
     """
-    Parse rows in csv_readings dataframe into readings table rows and insert
+    Reshape csv_readings dataframe into readings table rows and bulk load them
 
     Check csv_readings dataframe was set and that it has at least one row
 
     Use csv_metadata
+
+    Returns the number of rows inserted
     """
     current_time = pendulum.now('Pacific/Honolulu')
     current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
@@ -134,60 +227,54 @@ def insert_csv_readings_into_db(conn, csv_readings, csv_metadata, csv_filename):
     #check if csv_readings was initialized as a dataframe
     if isinstance(csv_readings, pandas.DataFrame):
         if csv_readings.empty:
-            return
+            return 0
         else:
             print('readings extracted from csv')
     #executes if not initialized as a dataframe
     elif not csv_readings:
         logging.exception('csv_readings set to None')
-        return
+        return 0
     new_readings, earliest_csv_timestamp, csv_modified_timestamp, query_string, latest_csv_timestamp, sensor_info_rows = csv_metadata
     if not new_readings:
         raise Exception("csv readings already inserted")
-    rows_returned = csv_readings.shape[0]
-    if rows_returned > 0:
-        for csv_reading in csv_readings.itertuples():
-            for i in range(0, len(sensor_info_rows)):
-                reading_row = orm_hobo.Reading(datetime=csv_reading[1], purpose_id=sensor_info_rows[i].purpose_id, reading=csv_reading[i+2], units=sensor_info_rows[i].unit, upload_timestamp=current_time)
-                conn.add(reading_row)
-            last_reading_row_datetime = csv_reading[1]
+    with metrics.stage('reshape'):
+        reading_frame = reshape.melt_wide_readings(csv_readings, csv_readings[DATETIME_COLUMN], sensor_info_rows)
+    metrics.add('reshape', rows=reading_frame.shape[0])
+    # insert the error_log rows and their details first so readings can be inserted with their log_id
+    with metrics.stage('error_log'):
+        csv_details = get_csv_details(csv_filename, csv_modified_timestamp, earliest_csv_timestamp, latest_csv_timestamp)
+        error_log_journal = journal.Journal()
+        for sensor_info_row in sensor_info_rows:
+            error_log_journal.record(sensor_info_row.purpose_id, current_time, orm.ErrorLog.PipelineStageEnum.database_insertion, was_success=True, details=csv_details)
+        log_ids = error_log_journal.flush(conn)
+    metrics.add('error_log', rows=len(log_ids))
+    with metrics.stage('copy'):
+        rows_inserted = sum(loader.copy_readings(conn, reading_frame, current_time, log_ids=dict(zip([sensor_info_row.purpose_id for sensor_info_row in sensor_info_rows], log_ids))).values())
+    metrics.add('copy', rows=rows_inserted)
+    last_reading_row_datetimes = reshape.last_reading_datetimes(reading_frame)
     #update last_updated_datetime column for relevant rows in sensor_info table
-    for sensor_info_row in sensor_info_rows:
-        # account for if csv files uploaded out of order by checking if last_reading_row_datetime is later than last_updated_datetime
-        if not sensor_info_row.last_updated_datetime or sensor_info_row.last_updated_datetime < last_reading_row_datetime:
-            conn.query(orm_hobo.SensorInfo.purpose_id).filter(orm_hobo.SensorInfo.purpose_id == sensor_info_row.purpose_id).update({"last_updated_datetime": last_reading_row_datetime})
-        error_log_row = orm_hobo.ErrorLog(was_success=True, purpose_id=sensor_info_row.purpose_id, datetime=current_time, pipeline_stage=orm_hobo.ErrorLog.PipelineStageEnum.database_insertion)
-        conn.add(error_log_row)
-        # need to flush and refresh to get error_log_row.log_id
-        conn.flush()
-        conn.refresh(error_log_row)
-        csv_filename_row = orm_hobo.ErrorLogDetails(log_id=error_log_row.log_id, information_type="csv_filename", information_value=csv_filename)
-        conn.add(csv_filename_row)
-        csv_modified_timestamp_row = orm_hobo.ErrorLogDetails(log_id=error_log_row.log_id, information_type="csv_modified_timestamp", information_value=csv_modified_timestamp)
-        conn.add(csv_modified_timestamp_row)
-        earliest_csv_timestamp_row = orm_hobo.ErrorLogDetails(log_id=error_log_row.log_id, information_type="earliest_csv_timestamp", information_value=earliest_csv_timestamp)
-        conn.add(earliest_csv_timestamp_row)
-        latest_csv_timestamp_row = orm_hobo.ErrorLogDetails(log_id=error_log_row.log_id, information_type="latest_csv_timestamp", information_value=latest_csv_timestamp)
-        conn.add(latest_csv_timestamp_row)
-        # update current sensor_info_row's set of readings with related log_id
-        conn.query(orm_hobo.Reading.log_id).\
-            filter(orm_hobo.Reading.purpose_id == sensor_info_row.purpose_id,
-                   orm_hobo.Reading.upload_timestamp == current_time).\
-            update({'log_id': error_log_row.log_id})
-    conn.commit()
+    with metrics.stage('update_sensor_info'):
+        for sensor_info_row in sensor_info_rows:
+            last_reading_row_datetime = last_reading_row_datetimes[sensor_info_row.purpose_id].to_pydatetime()
+            # account for if csv files uploaded out of order by checking if last_reading_row_datetime is later than last_updated_datetime
+            # (checked in the update too, in case another file for the same sensor is being inserted in parallel)
+            if not sensor_info_row.last_updated_datetime or sensor_info_row.last_updated_datetime < last_reading_row_datetime:
+                conn.query(orm.SensorInfo.purpose_id).\
+                    filter(orm.SensorInfo.purpose_id == sensor_info_row.purpose_id,
+                           or_(orm.SensorInfo.last_updated_datetime == None, orm.SensorInfo.last_updated_datetime < last_reading_row_datetime)).\
+                    update({"last_updated_datetime": last_reading_row_datetime}, synchronize_session=False)
+        conn.commit()
+    return rows_inserted
 
 
 def log_failure_to_get_csv_readings_from_folder_not_in_db(conn, csv_filename, exception):
     current_time = pendulum.now('Pacific/Honolulu')
     current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
     logging.exception('log_failure_to_get_csv_readings_from_folder_not_in_db')
-    error_log_row = orm_hobo.ErrorLog(was_success=False, datetime=current_time, error_type=exception.__class__.__name__, pipeline_stage=orm_hobo.ErrorLog.PipelineStageEnum.data_acquisition)
-    conn.add(error_log_row)
-    # need to flush and refresh to get error_log_row.log_id
-    conn.flush()
-    conn.refresh(error_log_row)
-    csv_filename_row = orm_hobo.ErrorLogDetails(log_id=error_log_row.log_id, information_type="csv_filename", information_value=csv_filename)
-    conn.add(csv_filename_row)
+    # error_log rows flushed before the failure are committed with this row, as orm rows added to the session were
+    error_log_journal = journal.Journal()
+    error_log_journal.record(None, current_time, orm.ErrorLog.PipelineStageEnum.data_acquisition, was_success=False, error_type=exception.__class__.__name__, details={'csv_filename': csv_filename})
+    error_log_journal.flush(conn)
     conn.commit()
 
 
@@ -198,38 +285,108 @@ def log_failure_to_insert_csv_readings_into_db(conn, csv_filename, csv_metadata,
     #rollback any reading insertions during that iteration of for loop in main
     conn.rollback()
     logging.exception('log_failure_to_insert_csv_readings_into_db')
+    csv_details = get_csv_details(csv_filename, csv_modified_timestamp, earliest_csv_timestamp, latest_csv_timestamp)
+    error_log_journal = journal.Journal()
     for sensor_info_row in sensor_info_rows:
         # set was_success to "" if readings were already inserted
-        if not new_readings:
-            error_log_row = orm_hobo.ErrorLog(purpose_id=sensor_info_row.purpose_id, datetime=current_time, error_type=exception.__class__.__name__,pipeline_stage=orm_hobo.ErrorLog.PipelineStageEnum.database_insertion)
-        # set was_success to False if readings were new but an error was thrown
-        else:
-            error_log_row = orm_hobo.ErrorLog(purpose_id=sensor_info_row.purpose_id, was_success=False, datetime=current_time, error_type=exception.__class__.__name__,  pipeline_stage=orm_hobo.ErrorLog.PipelineStageEnum.database_insertion)
-        conn.add(error_log_row)
-        # need to flush and refresh to get error_log_row.log_id
-        conn.flush()
-        conn.refresh(error_log_row)
-        csv_filename_row = orm_hobo.ErrorLogDetails(log_id=error_log_row.log_id, information_type="csv_filename", information_value=csv_filename)
-        conn.add(csv_filename_row)
-        csv_modified_timestamp_row = orm_hobo.ErrorLogDetails(log_id=error_log_row.log_id, information_type="csv_modified_timestamp", information_value=csv_modified_timestamp)
-        conn.add(csv_modified_timestamp_row)
-        earliest_csv_timestamp_row = orm_hobo.ErrorLogDetails(log_id=error_log_row.log_id, information_type="earliest_csv_timestamp", information_value=earliest_csv_timestamp)
-        conn.add(earliest_csv_timestamp_row)
-        latest_csv_timestamp_row = orm_hobo.ErrorLogDetails(log_id=error_log_row.log_id, information_type="latest_csv_timestamp", information_value=latest_csv_timestamp)
-        conn.add(latest_csv_timestamp_row)
+        # or to False if readings were new but an error was thrown
+        error_log_journal.record(sensor_info_row.purpose_id, current_time, orm.ErrorLog.PipelineStageEnum.database_insertion, was_success=False if new_readings else None, error_type=exception.__class__.__name__, details=csv_details)
+    error_log_journal.flush(conn)
     conn.commit()
 
 
+def process_csv_file(conn, csv_filename, parse_future=None, manifest_key=None):
+    """
+    Get readings from csv_filename and insert them, logging success or failure of each step to error_log
+
+    parse_future is an optional future for parse_csv_file(csv_filename) running in a worker process
+    If manifest_key is given, the outcome is recorded in the csv_file_manifest table
+    Returns the seconds spent parsing (0 if unknown) and the seconds spent on the database
+    """
+    parse_seconds = 0
+    start_time = time.perf_counter()
+    try:
+        if parse_future:
+            parsed_csv = parse_future.result()
+        else:
+            parsed_csv = parse_csv_file(csv_filename)
+        parse_seconds = parsed_csv[2]
+        profiling.tag(parsed_csv[0])
+        # files may be parsed in worker processes, so the parse time is added to the metrics of this process here
+        metrics.add('parse_csv', seconds=parse_seconds, calls=1, rows=parsed_csv[1].shape[0],
+                    bytes=manifest_key.file_size if manifest_key else 0)
+        # time the database work separately from parsing
+        start_time = time.perf_counter()
+        with metrics.stage('check_inserted'):
+            csv_readings, csv_metadata = get_csv_from_folder_not_in_db(conn, csv_filename, parsed_csv)
+    except Exception as exception:
+        log_failure_to_get_csv_readings_from_folder_not_in_db(conn, csv_filename, exception)
+        if manifest_key:
+            record_csv_file_outcome(conn, csv_filename, manifest_key, orm.CsvFileManifest.OutcomeEnum.failed)
+        return parse_seconds, time.perf_counter() - start_time
+    try:
+        rows_inserted = insert_csv_readings_into_db(conn, csv_readings, csv_metadata, csv_filename)
+        outcome = orm.CsvFileManifest.OutcomeEnum.inserted
+    except Exception as exception:
+        log_failure_to_insert_csv_readings_into_db(conn, csv_filename, csv_metadata, exception)
+        rows_inserted = 0
+        # new_readings is False if the readings were already inserted
+        outcome = orm.CsvFileManifest.OutcomeEnum.failed if csv_metadata[0] else orm.CsvFileManifest.OutcomeEnum.already_inserted
+    if manifest_key:
+        with metrics.stage('manifest'):
+            record_csv_file_outcome(conn, csv_filename, manifest_key, outcome, csv_metadata, rows_inserted)
+    return parse_seconds, time.perf_counter() - start_time
+
+
+def process_parsed_csv_file(Session, csv_filename, parse_future, manifest_key=None):
+    """
+    Run process_csv_file() in its own session, so files can be inserted from several threads
+    """
+    conn = Session()
+    try:
+        return process_csv_file(conn, csv_filename, parse_future, manifest_key)
+    finally:
+        conn.close()
+
+
+def run(Session, workers=1, db_workers=2):
+    """
+    Insert readings from the hobo csv files in ./to-insert that are not in the csv_file_manifest table
+
+    Session should allow at least db_workers connections when workers is more than 1.
+    Called once per cron run by __main__ and once per cycle by sensors/daemon.py
+    The time and rows of each stage are recorded in run_metrics by sensors.metrics.
+    """
+    metrics.start_run('hobo')
+    conn = Session()
+    # skip files that were already processed without parsing them
+    with metrics.stage('manifest'):
+        csv_files = get_csv_files_not_in_manifest(conn, glob.glob('./to-insert/*.csv'))
+    csv_filenames = [csv_filename for csv_filename, manifest_key in csv_files]
+    print(str(len(csv_files)) + ' new csv file(s) found')
+    file_timings = []
+    if workers > 1:
+        conn.close()
+        # parse files in worker processes and insert each parsed file as soon as a database connection is free
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as parse_executor, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=db_workers) as db_executor:
+            parse_futures = [parse_executor.submit(parse_csv_file, csv_filename) for csv_filename in csv_filenames]
+            db_futures = [db_executor.submit(process_parsed_csv_file, Session, csv_filename, parse_future, manifest_key) for (csv_filename, manifest_key), parse_future in zip(csv_files, parse_futures)]
+            file_timings = [db_future.result() for db_future in db_futures]
+    else:
+        file_timings = [process_csv_file(conn, csv_filename, manifest_key=manifest_key) for csv_filename, manifest_key in csv_files]
+        conn.close()
+    for csv_filename, (parse_seconds, db_seconds) in zip(csv_filenames, file_timings):
+        print('{}: parsed in {:.3f} s, database in {:.3f} s'.format(csv_filename, parse_seconds, db_seconds))
+    metrics.finish_run(Session)
+
+
 if __name__=='__main__':
-    conn = get_db_handler()
-    csv_filenames = glob.glob('./to-insert/*.csv')
-    for csv_filename in csv_filenames:
-        try:
-             csv_readings, csv_metadata = get_csv_from_folder_not_in_db(conn, csv_filename)
-        except Exception as exception:
-             log_failure_to_get_csv_readings_from_folder_not_in_db(conn, csv_filename, exception)
-             continue
-        try:
-             insert_csv_readings_into_db(conn, csv_readings, csv_metadata, csv_filename)
-        except Exception as exception:
-             log_failure_to_insert_csv_readings_into_db(conn, csv_filename, csv_metadata, exception)
+    parser = argparse.ArgumentParser(description='Insert readings from hobo csv files in ./to-insert into the database')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes parsing csv files at once; 1 parses and inserts one file at a time')
+    parser.add_argument('--db-workers', type=int, default=2, help='number of database connections inserting files at once when --workers is more than 1')
+    parser.add_argument('--profile', choices=('cpu', 'memory', 'all'),
+                        help='profile the run with cProfile (cpu), tracemalloc (memory) or both (all), writing the profiles next to error.log (default: the SENSORS_PROFILE environment variable)')
+    args = parser.parse_args()
+    with profiling.profile_run('hobo', args.profile):
+        run(db.get_sessionmaker(pool_size=max(args.db_workers, 1)), args.workers, args.db_workers)
@@ -0,0 +1,50 @@
+#!../../egauge/script/env/bin/python3
+"""
+Test suite for extract_hobo using the unittest module
+"""
+from pathlib import Path
+
+import extract_hobo
+import numpy
+import os
+import pandas
+import shutil
+import tempfile
+import unittest
+
+
+class TestHoboCsv(unittest.TestCase):
+    """
+    A test suite for extract_hobo
+
+    Currently has tests for read_hobo_csv() and hash_csv_file() using the sample csv in hobo/To_Insert
+    """
+    csv_filename = str(Path(os.path.dirname(os.path.realpath(__file__))).parent) + '/To_Insert/9790163-sample.csv'
+
+
+    def test_read_hobo_csv_extracts_query_string_and_typed_columns(self):
+        query_string, csv_readings = extract_hobo.read_hobo_csv(self.csv_filename)
+        self.assertEqual(query_string, '9790163')
+        self.assertEqual(list(csv_readings.columns), ['Date Time, GMT-10:00',
+                                                      'Temp, °F (LGR S/N: 9790163, SEN S/N: 9790163)',
+                                                      'RH, % (LGR S/N: 9790163, SEN S/N: 9790163)',
+                                                      'Intensity, lum/ft² (LGR S/N: 9790163, SEN S/N: 9790163)'])
+        self.assertTrue(all(csv_readings[column].dtype == numpy.float64 for column in csv_readings.columns[1:]))
+        self.assertEqual(csv_readings.iloc[0]['Date Time, GMT-10:00'], pandas.Timestamp('2017-02-03 16:00:00'))
+        self.assertEqual(csv_readings.iloc[0]['Temp, °F (LGR S/N: 9790163, SEN S/N: 9790163)'], 76.375)
+
+
+    def test_hash_csv_file_depends_only_on_contents(self):
+        with tempfile.TemporaryDirectory() as directory:
+            copied_csv_filename = directory + '/copied.csv'
+            shutil.copy(self.csv_filename, copied_csv_filename)
+            os.utime(copied_csv_filename, (0, 0))
+            # read in small blocks to check that the digest does not depend on the block size
+            self.assertEqual(extract_hobo.hash_csv_file(copied_csv_filename, block_size=1000), extract_hobo.hash_csv_file(self.csv_filename))
+            with open(copied_csv_filename, 'a') as file:
+                file.write('\n')
+            self.assertNotEqual(extract_hobo.hash_csv_file(copied_csv_filename), extract_hobo.hash_csv_file(self.csv_filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,37 +1,40 @@
-import egauge.script.orm_egauge as orm_egauge
-import configparser
+from sensors import daemon, db, orm
+import argparse
 import crontab
+import logging
 import numpy
-import sqlalchemy
 
 
 if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Schedule the scripts of active sensors in crontab')
+    parser.add_argument('--daemon', action='store_true',
+                        help='replace the per-script jobs with one job that keeps sensors/daemon.py running')
+    args = parser.parse_args()
+    # the maintenance steps log their exceptions to error.log in the project folder, like sensors/daemon.py
+    logging.basicConfig(filename='error.log', format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+
     #create a cron object; requires sudo if user running script is not lonoa
     cron = crontab.CronTab(user='lonoa')
 
     # get db connection
-    config_path = "config.txt"
-    with open(config_path, "r") as file:
-        # prepend '[DEFAULT]\n' since ConfigParser requires section headers in config files
-        config_string = '[DEFAULT]\n' + file.read()
-    config = configparser.ConfigParser()
-    config.read_string(config_string)
-    db_url = "postgresql:///" + config['DEFAULT']['db']
-    db = sqlalchemy.create_engine(db_url)
-    Session = sqlalchemy.orm.sessionmaker(db)
+    Session = db.get_sessionmaker()
     conn = Session()
 
     # get path of project for usage in crontab commands
-    project_path = conn.query(orm_egauge.Project.project_folder_path).first()[0]
+    project_path = conn.query(orm.Project.project_folder_path).first()[0]
 
     # create a list using a database query that selects each unique active script_folder that is not set to None
-    script_folders = [stype[0] for stype in conn.query(orm_egauge.SensorInfo.script_folder). \
-        filter(orm_egauge.SensorInfo.is_active == True).distinct() if stype[0]]
+    script_folders = [stype[0] for stype in conn.query(orm.SensorInfo.script_folder). \
+        filter(orm.SensorInfo.is_active == True).distinct() if stype[0]]
     print(__file__ + ': extracted active script folders', str(script_folders), 'from database')
 
     # create a list of the active script filenames to compare with commands in crontab
     # always include init_crontab.py, so it will schedule itself if missing
     database_active_scripts = ['init_crontab.py']
+    # the daemon reads the active script folders from the database itself, so it replaces the other jobs
+    if args.daemon:
+        database_active_scripts = ['sensors/daemon.py']
+        script_folders = []
     for script_folder in script_folders:
         # use ".value" to access value of script_folder enum
         script_folder = script_folder.value
@@ -66,8 +69,12 @@ if __name__=='__main__':
 
     # add jobs for all active scripts missing from crontab
     for script_name in scripts_missing_from_crontab:
-        # use if else statement since job is formatted differently if it is a sensor script vs. init_crontab.py
-        if script_name != 'init_crontab.py':
+        # use if else statement since job is formatted differently if it is a sensor script, the daemon or init_crontab.py
+        if script_name == 'sensors/daemon.py':
+            # the daemon exits immediately if it is already running, so the job restarts it if it stops
+            job = cron.new(command='cd ' + project_path + '/ && python3 ' + script_name + ' >> daemon.txt')
+            job.minute.every(5)
+        elif script_name != 'init_crontab.py':
             # sensor commands should cd to the appropriate */script directory, then run the script
             # and write outputs to crontab.txt in the */script directory
             script_folder = script_name.split('_')[1].split('.py')[0]
@@ -83,5 +90,18 @@ if __name__=='__main__':
         print(__file__ + ': attempting to write ' + script_name + ' job to crontab')
         cron.write()
 
+    # the maintenance steps of sensors/daemon.py; each logs its exceptions to error.log, so one failing step does not skip the others
+    # create the partitions of the reading and error_log tables for the next months; this job runs every five minutes in cron mode
+    daemon.ensure_partitions(Session)
+    # summarize the success rows of error_log older than a week; only days that are not summarized yet are compacted
+    daemon.compact_error_log(Session)
+    # create or replace the pivot views in sql_views/pivot whose purposes in sensor_info changed
+    daemon.refresh_pivot_views(Session)
+    # refresh the materialized views in sql_views whose sensors were updated
+    daemon.refresh_materialized_views(Session)
+    # write the gaps in the readings since the last run to reading_gap, then backfill a few of the open and failed ones
+    # that no other run claimed
+    daemon.detect_and_backfill_gaps(Session)
+
     # close database connection
     conn.close()
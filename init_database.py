@@ -1,4 +1,4 @@
-import egauge.script.orm_egauge
+from sensors import db, orm, partition
 import getpass #used to get username
 import os
 import sqlalchemy
@@ -39,29 +39,27 @@ if __name__ == '__main__':
             print(__file__ + ': database named ' + sys.argv[1] + ' already exists')
         conn.close()
 
-        # create all necessary tables in database
+        # create all necessary tables in database; the engine of sensors.db connects to the database named in config.txt
         print(__file__ + ': creating tables in database ' + db_name)
-        egauge.script.orm_egauge.setup()
+        orm.setup()
 
         # connect to the created database to add project_folder_path to Project table
-        db_url = "postgresql:///" + db_name
-        db = sqlalchemy.create_engine(db_url)
-        Session = sqlalchemy.orm.sessionmaker(db)
-        conn = Session()
+        conn = db.get_sessionmaker()()
         project_folder_path = os.getcwd()
         # check if project_folder_path exists already
         results = conn.execute('SELECT 1 FROM project WHERE project_folder_path = \'' + project_folder_path + '\'')
         if not results.first():
-            project_row = egauge.script.orm_egauge.Project(project_folder_path=project_folder_path)
+            project_row = orm.Project(project_folder_path=project_folder_path)
             conn.add(project_row)
         else:
             print(__file__ + ': project_folder_path ' + project_folder_path + ' already exists in project table')
         #cast timestamp fields to timestamp(6) to limit timestamp precision to the hundredth second
-        conn.execute('ALTER TABLE reading ALTER COLUMN datetime TYPE timestamp(6);')
+        # reading.datetime and error_log.datetime are created as timestamp(6), since they are partition keys and cannot be altered
         conn.execute('ALTER TABLE reading ALTER COLUMN upload_timestamp TYPE timestamp(6);')
         conn.execute('ALTER TABLE reading ALTER COLUMN upload_timestamp SET DEFAULT NOW();')
         conn.execute('ALTER TABLE sensor_info ALTER COLUMN last_updated_datetime TYPE timestamp(6);')
-        conn.execute('ALTER TABLE error_log ALTER COLUMN datetime TYPE timestamp(6);')
+        # create the monthly partitions of the reading and error_log tables for this month and the next months
+        print(__file__ + ': creating partitions ' + str(partition.ensure_all_partitions(conn)))
         conn.commit()
         conn.close()
 
@@ -0,0 +1,5 @@
+"""
+This package holds code shared by the egauge, webctrl and hobo scripts
+
+Scripts in */script add the project folder to sys.path so they can import it.
+"""
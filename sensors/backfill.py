@@ -0,0 +1,289 @@
+"""
+This module backfills egauge and webctrl readings over a long time range in fixed size chunks
+
+Usage (from the project folder):
+    python3 sensors/backfill.py (--purpose-id <purpose_id> | --query-string <query_string>) [--start <datetime>] [--end <datetime>]
+                                [--chunk-hours <hours>] [--max-workers <workers>]
+
+Instead of requesting everything since last_updated_datetime in one request and one transaction, the range is split into
+chunks of --chunk-hours (whole days for webctrl, since its api takes dates). Up to --max-workers chunks are requested at once,
+and chunks are inserted and committed in time order, each one moving last_updated_datetime forward.
+If the backfill stops (a request fails, the database goes down, the process is killed), running it again without --start
+resumes from last_updated_datetime, i.e. after the last committed chunk.
+
+--start and --end are HST datetimes like "2019-02-01" or "2019-02-01 06:00". Without --start the backfill starts after
+last_updated_datetime, like the regular scripts; without --end it ends now. With --start, readings older than
+last_updated_datetime can be inserted (e.g. to fill a hole); readings already in the reading table are skipped.
+last_updated_datetime does not move back, so the end of each chunk committed from --start is recorded in backfill_checkpoint,
+and running the backfill again with the same --start resumes after the last committed chunk.
+The checkpoint is deleted once every chunk was inserted.
+"""
+from pathlib import Path
+from sqlalchemy import text
+
+import argparse
+import collections
+import concurrent.futures
+import math
+import os
+import pendulum
+import sys
+
+sys.path.append(str(Path(os.path.dirname(os.path.realpath(__file__))).parent))
+from sensors import bulktrend, db, orm, scripts
+
+
+DEFAULT_CHUNK_HOURS = 24
+DEFAULT_MAX_WORKERS = 4
+# seconds to wait for an egauge to connect or send data
+TIMEOUT = 60
+
+# a sensor as passed to api_webctrl.insert_readings_into_database(), with last_updated_datetime set to the backfill watermark
+WebctrlSensor = collections.namedtuple('WebctrlSensor', ['purpose_id', 'query_string', 'last_updated_datetime', 'unit'])
+
+# the backfill resumes from the checkpoint only if every purpose has one
+SELECT_CHECKPOINT = """
+    SELECT count(*), min(backfilled_through) FROM backfill_checkpoint
+    WHERE purpose_id = ANY(CAST(:purpose_ids AS INTEGER[])) AND range_start = :range_start
+"""
+UPSERT_CHECKPOINT = """
+    INSERT INTO backfill_checkpoint (purpose_id, range_start, backfilled_through)
+    SELECT purpose_id, :range_start, :backfilled_through FROM unnest(CAST(:purpose_ids AS INTEGER[])) AS purpose_id
+    ON CONFLICT (purpose_id, range_start) DO UPDATE SET backfilled_through = excluded.backfilled_through
+"""
+DELETE_CHECKPOINT = """
+    DELETE FROM backfill_checkpoint WHERE purpose_id = ANY(CAST(:purpose_ids AS INTEGER[])) AND range_start = :range_start
+"""
+
+
+def get_chunks(start, end, chunk_seconds):
+    """
+    Split the time range from start to end (pendulum datetimes) into a list of (chunk_start, chunk_end) tuples
+    of at most chunk_seconds each
+    """
+    chunks = []
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(chunk_start.add(seconds=chunk_seconds), end)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end
+    return chunks
+
+
+def map_in_order(executor, function, items, max_pending):
+    """
+    Yield (item, future of function(item)) for each of items in order, submitting at most max_pending items ahead
+
+    Memory is bounded by max_pending results instead of the whole range. Unstarted items are cancelled if the caller stops early.
+    """
+    pending = collections.deque()
+    try:
+        for item in items:
+            pending.append((item, executor.submit(function, item)))
+            if len(pending) >= max_pending:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+    finally:
+        for item, future in pending:
+            future.cancel()
+
+
+def get_purposes(conn, purpose_id=None, query_string=None):
+    """
+    Return the active sensor_info rows for purpose_id, or for every purpose of query_string
+
+    raises a ValueError if there are none or if they do not all belong to the same egauge or webctrl script_folder
+    """
+    purposes = conn.query(orm.SensorInfo.purpose_id, orm.SensorInfo.query_string, orm.SensorInfo.data_sensor_info_mapping,
+                          orm.SensorInfo.last_updated_datetime, orm.SensorInfo.unit, orm.SensorInfo.script_folder).\
+        filter_by(is_active=True)
+    if purpose_id is not None:
+        purposes = purposes.filter_by(purpose_id=purpose_id)
+    else:
+        purposes = purposes.filter_by(query_string=query_string)
+    purposes = purposes.order_by(orm.SensorInfo.purpose_id).all()
+    if not purposes:
+        raise ValueError('No active sensor_info rows found')
+    script_folders = set(purpose.script_folder for purpose in purposes)
+    if len(script_folders) > 1 or purposes[0].script_folder not in (orm.SensorInfo.ScriptFolderEnum.egauge, orm.SensorInfo.ScriptFolderEnum.webctrl):
+        raise ValueError('Only egauge or webctrl sensors of one script_folder can be backfilled, not ' + str(script_folders))
+    return purposes
+
+
+def get_start(purposes):
+    """
+    Return the earliest last_updated_datetime of purposes as a pendulum datetime in HST
+    """
+    if not all(purpose.last_updated_datetime for purpose in purposes):
+        raise ValueError('No last_updated_datetime found; use --start')
+    return pendulum.instance(min(purpose.last_updated_datetime for purpose in purposes), 'Pacific/Honolulu')
+
+
+def get_checkpoint(conn, purposes, range_start):
+    """
+    Return the HST datetime through which the backfill of purposes from range_start (a pendulum datetime) was committed,
+    or range_start if it has no checkpoint
+    """
+    checkpoints, backfilled_through = conn.execute(text(SELECT_CHECKPOINT), {'purpose_ids': [purpose.purpose_id for purpose in purposes],
+                                                                             'range_start': range_start.naive()}).first()
+    conn.commit()
+    if checkpoints < len(purposes):
+        return range_start
+    return pendulum.instance(backfilled_through, 'Pacific/Honolulu')
+
+
+def save_checkpoint(conn, purposes, range_start, backfilled_through):
+    """
+    Record that the backfill of purposes from range_start was committed through backfilled_through (pendulum datetimes)
+    and commit it; does nothing if range_start is None, i.e. the backfill resumes from last_updated_datetime
+    """
+    if range_start is None:
+        return
+    conn.execute(text(UPSERT_CHECKPOINT), {'purpose_ids': [purpose.purpose_id for purpose in purposes], 'range_start': range_start.naive(),
+                                           'backfilled_through': backfilled_through.naive()})
+    conn.commit()
+
+
+def backfill_egauge(conn, purposes, start, end, chunk_seconds, max_workers, timeout=TIMEOUT, range_start=None):
+    """
+    Request the readings of one egauge chunk by chunk and insert each chunk with api_egauge.insert_readings_into_database()
+
+    The end of each committed chunk is saved as the checkpoint of the backfill from range_start, if it is given
+
+    Returns True if every chunk was inserted
+    """
+    api_egauge = scripts.load_script('egauge')
+    query_string = purposes[0].query_string
+    if not start:
+        # egauge api returns readings including the start time, so start after the reading at last_updated_datetime
+        start = get_start(purposes).add(seconds=60)
+    time_windows = [{'t': chunk_start.int_timestamp, 'f': chunk_end.int_timestamp} for chunk_start, chunk_end in get_chunks(start, end, chunk_seconds)]
+    print(str(len(time_windows)) + ' chunk(s) to request from egauge ' + query_string)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        request_chunk = lambda time_window: api_egauge.request_readings(query_string, time_window, timeout)
+        for time_window, future in map_in_order(executor, request_chunk, time_windows, max_workers):
+            current_time = pendulum.now('Pacific/Honolulu')
+            current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
+            try:
+                readings = future.result()
+            except Exception as exception:
+                api_egauge.log_failure_to_connect_to_api(conn, exception, query_string)
+                return False
+            api_egauge.log_success_to_connect_to_api(conn, purposes, current_time)
+            try:
+                api_egauge.insert_readings_into_database(conn, readings, purposes)
+            except Exception as exception:
+                api_egauge.log_failure_to_connect_to_database(conn, exception, purposes)
+                return False
+            save_checkpoint(conn, purposes, range_start, pendulum.from_timestamp(time_window['f'], 'Pacific/Honolulu'))
+            print('committed readings through ' + str(pendulum.from_timestamp(time_window['f'], 'Pacific/Honolulu')))
+    return True
+
+
+def backfill_webctrl(conn, purposes, start, end, chunk_seconds, max_workers, range_start=None):
+    """
+    Request the samples of webctrl sensors chunk by chunk and insert each chunk with api_webctrl.insert_readings_into_database()
+
+    The end of each committed chunk is saved as the checkpoint of the backfill from range_start, if it is given
+
+    Returns True if every chunk was inserted
+    """
+    api_webctrl = scripts.load_script('webctrl')
+    api_user = api_webctrl.get_api_user(conn)
+    # keep samples after start, or else after each sensor's own last_updated_datetime
+    if start:
+        # the watermark excludes samples at the watermark itself, and webctrl timestamps are whole seconds
+        sensors = [WebctrlSensor(purpose.purpose_id, purpose.query_string, start.subtract(seconds=1).naive(), purpose.unit) for purpose in purposes]
+    else:
+        start = get_start(purposes)
+        sensors = [WebctrlSensor(purpose.purpose_id, purpose.query_string, purpose.last_updated_datetime, purpose.unit) for purpose in purposes]
+    watermarks = {}
+    for sensor in sensors:
+        watermarks[sensor.query_string] = min(watermarks.get(sensor.query_string, float('inf')), api_webctrl.get_last_updated_timestamp(sensor))
+    # the webctrl api takes whole dates and includes the end date
+    chunk_days = max(int(math.ceil(chunk_seconds / 86400)), 1)
+    chunk_dates = [(chunk_start.to_date_string(), chunk_start.add(days=chunk_days - 1).to_date_string())
+                   for chunk_start, chunk_end in get_chunks(start.start_of('day'), end, chunk_days * 86400)]
+    print(str(len(chunk_dates)) + ' chunk(s) to request from webctrl for ' + str(len(watermarks)) + ' id(s)')
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        request_chunk = lambda dates: api_webctrl.request_trends(watermarks, dates[0], dates[1], api_user)
+        for (start_date, end_date), future in map_in_order(executor, request_chunk, chunk_dates, max_workers):
+            current_time = pendulum.now('Pacific/Honolulu')
+            current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
+            try:
+                trends = future.result()
+            except Exception as exception:
+                api_webctrl.log_failure_to_connect_to_api(conn, exception, sensors)
+                return False
+            api_webctrl.log_success_to_connect_to_api(conn, [sensor for sensor in sensors if sensor.query_string in trends], current_time)
+            for sensor in sensors:
+                try:
+                    trend = trends[sensor.query_string]
+                except KeyError as exception: #catch sensors whose id was missing from the api response
+                    api_webctrl.log_failure_to_connect_to_api(conn, exception, [sensor])
+                    return False
+                try:
+                    # drop samples after the end of the backfill, which may be within the last date
+                    in_range = trend.timestamps < end.int_timestamp
+                    trend = bulktrend.Trend(trend.id, trend.timestamps[in_range], trend.values[in_range], trend.skipped)
+                    api_webctrl.insert_readings_into_database(conn, trend, sensor)
+                except Exception as exception:
+                    api_webctrl.log_failure_to_connect_to_database(conn, exception, sensor)
+                    return False
+            # the chunk includes end_date, so it was committed through the start of the next day
+            save_checkpoint(conn, purposes, range_start, min(pendulum.parse(end_date, tz='Pacific/Honolulu').add(days=1), end))
+            print('committed readings from ' + start_date + ' through ' + end_date)
+    return True
+
+
+def backfill(Session, purpose_id=None, query_string=None, start=None, end=None, chunk_hours=DEFAULT_CHUNK_HOURS, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Backfill the readings of purpose_id or of every purpose of query_string from start (or last_updated_datetime) to end (or now)
+
+    A backfill from start resumes after the last chunk committed by a previous backfill from the same start.
+    Returns True if every chunk was inserted
+    """
+    conn = Session()
+    try:
+        purposes = get_purposes(conn, purpose_id, query_string)
+        end = end or pendulum.now('Pacific/Honolulu')
+        range_start = start
+        if range_start:
+            start = get_checkpoint(conn, purposes, range_start)
+            if start > range_start:
+                print('resuming the backfill from ' + str(range_start) + ' at ' + str(start))
+        if purposes[0].script_folder == orm.SensorInfo.ScriptFolderEnum.egauge:
+            was_success = backfill_egauge(conn, purposes, start, end, chunk_hours * 3600, max_workers, range_start=range_start)
+        else:
+            was_success = backfill_webctrl(conn, purposes, start, end, chunk_hours * 3600, max_workers, range_start=range_start)
+        if was_success and range_start:
+            conn.execute(text(DELETE_CHECKPOINT), {'purpose_ids': [purpose.purpose_id for purpose in purposes], 'range_start': range_start.naive()})
+            conn.commit()
+        return was_success
+    finally:
+        conn.close()
+
+
+def parse_datetime(datetime_string):
+    """
+    Parse a --start or --end argument as an HST datetime
+    """
+    return pendulum.parse(datetime_string, tz='Pacific/Honolulu')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backfill egauge or webctrl readings in chunks that are committed one at a time')
+    sensor_group = parser.add_mutually_exclusive_group(required=True)
+    sensor_group.add_argument('--purpose-id', type=int, help='purpose_id of the sensor to backfill')
+    sensor_group.add_argument('--query-string', help='backfill every active purpose with this query_string')
+    parser.add_argument('--start', type=parse_datetime, help='HST datetime to backfill from (default: last_updated_datetime)')
+    parser.add_argument('--end', type=parse_datetime, help='HST datetime to backfill to (default: now)')
+    parser.add_argument('--chunk-hours', type=float, default=DEFAULT_CHUNK_HOURS, help='hours of readings per request and transaction')
+    parser.add_argument('--max-workers', type=int, default=DEFAULT_MAX_WORKERS, help='maximum number of chunks requested at once')
+    args = parser.parse_args()
+    # the scripts are imported by this process, so they log to error.log in the project folder like under the daemon
+    os.chdir(db.PROJECT_PATH)
+    if not backfill(db.get_sessionmaker(), args.purpose_id, args.query_string, args.start, args.end, args.chunk_hours, args.max_workers):
+        print(__file__ + ': backfill stopped; see error_log, then run it again to resume')
+        sys.exit(1)
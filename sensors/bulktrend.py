@@ -0,0 +1,206 @@
+"""
+This module parses the csv response format of the webctrl BulkTrendServer api as a stream
+
+Each line of the response is one trend source: its id (escaped according to the rules of csv), followed by
+alternating timestamp (milliseconds) and value fields, e.g.
+
+    ABSPATH:1:#board_room/ht_stpt_tn,1282017600000,55.1,1282017900000,55
+
+The parser reads the response in chunks and converts fields to numpy arrays in fixed size blocks,
+so memory is bounded by the samples kept for one trend instead of the whole response.
+Samples at or before a per-id watermark are dropped as each block is converted: the raw bytes of the block are binary
+searched for the first timestamp after the watermark, so the dropped samples are never decoded.
+"""
+from sensors import lazy, reshape
+
+import collections
+
+numpy = lazy.lazy_import('numpy')
+
+
+# number of csv fields (timestamps plus values) converted to arrays at a time
+BLOCK_SIZE = 65536
+LINE_TERMINATORS = b'\r\n'
+
+Trend = collections.namedtuple('Trend', ['id', 'timestamps', 'values', 'skipped'])
+Trend.__doc__ = """
+One trend source from a BulkTrendServer response
+
+Columns:
+    id: the trend source id (sensor_info.query_string)
+    timestamps: int64 array of unix timestamps in seconds, in the order returned by the api
+    values: float64 array of readings; digital values are 1.0 (true) and 0.0 (false)
+    skipped: number of samples dropped because they were at or before the watermark
+"""
+
+
+class TrendCsvParser:
+    """
+    Incremental parser for the BulkTrendServer csv format
+
+    Call feed() with each chunk of the response (bytes, or str which is encoded as utf-8) and close() at the end
+    of the response; both return a list of the Trends completed by that chunk.
+    """
+
+    def __init__(self, watermarks=None, block_size=BLOCK_SIZE):
+        # watermarks maps trend id to the unix timestamp of the last sample that is already stored
+        self.watermarks = watermarks or {}
+        self.block_size = block_size
+        self.buffer = b''
+        self.trend_id = None
+        # the raw bytes of the complete fields of the current trend that are not converted yet, separated by commas
+        self.fields = bytearray()
+        self.field_count = 0
+        self.blocks = []
+        self.skipped = 0
+
+
+    def feed(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.buffer += data
+        trends = []
+        while True:
+            if self.trend_id is None and not self._read_id():
+                return trends
+            line_end = _find_line_end(self.buffer)
+            if line_end == -1:
+                # keep the last (possibly incomplete) field in the buffer
+                field_end = self.buffer.rfind(b',')
+                if field_end != -1:
+                    self._add_fields(self.buffer[:field_end])
+                    self.buffer = self.buffer[field_end + 1:]
+                return trends
+            self._add_fields(self.buffer[:line_end])
+            self.buffer = self.buffer[line_end:].lstrip(LINE_TERMINATORS)
+            trends.append(self._end_trend())
+
+
+    def close(self, data=b''):
+        # end the last line in case the response has no trailing line terminator
+        trends = self.feed(data) + self.feed(b'\n')
+        if self.buffer.strip(LINE_TERMINATORS):
+            raise ValueError('Incomplete trend id at end of webctrl csv response')
+        return trends
+
+
+    def _read_id(self):
+        """
+        Read the trend id at the start of the buffer; return False if the buffer does not hold the whole id yet
+        """
+        buffer = self.buffer.lstrip(LINE_TERMINATORS)
+        if buffer.startswith(b'"'):
+            # quoted ids end at a quote that is not followed by another quote
+            i = 1
+            while True:
+                i = buffer.find(b'"', i)
+                if i == -1 or i + 1 == len(buffer):
+                    return False
+                if buffer[i + 1:i + 2] != b'"':
+                    break
+                i += 2
+            trend_id = buffer[1:i].replace(b'""', b'"')
+            rest = buffer[i + 1:]
+        else:
+            i = min([j for j in (buffer.find(b','), _find_line_end(buffer)) if j != -1], default=-1)
+            if i == -1:
+                return False
+            trend_id = buffer[:i]
+            rest = buffer[i:]
+        if rest.startswith(b','):
+            rest = rest[1:]
+        self.trend_id = trend_id.decode('utf-8')
+        self.buffer = rest
+        return True
+
+
+    def _add_fields(self, data):
+        if data:
+            if self.field_count:
+                self.fields += b','
+            self.fields += data
+            self.field_count += data.count(b',') + 1
+        if self.field_count >= self.block_size:
+            # convert an even number of fields so timestamps and values stay paired
+            if self.field_count % 2:
+                block_end = self.fields.rfind(b',')
+                self._convert_block(bytes(self.fields[:block_end]))
+                self.fields = self.fields[block_end + 1:]
+                self.field_count = 1
+            else:
+                self._convert_block(bytes(self.fields))
+                self.fields = bytearray()
+                self.field_count = 0
+
+
+    def _convert_block(self, data):
+        watermark = self.watermarks.get(self.trend_id)
+        if watermark is not None:
+            data = self._drop_stored_samples(data, watermark)
+        if not data:
+            return
+        # only the samples after the watermark are decoded and split into fields
+        fields = data.decode('utf-8').split(',')
+        # slice off extra digits since webctrl timestamps are in milliseconds
+        timestamps = numpy.array(fields[0::2], dtype=numpy.int64) // 1000
+        self.blocks.append((timestamps, reshape.to_float(fields[1::2])))
+
+
+    def _drop_stored_samples(self, data, watermark):
+        """
+        Return the raw bytes of a block without its samples at or before watermark, and count them as skipped
+
+        Samples are sorted by time, so the first sample after the watermark is found by a binary search
+        that parses only the timestamp fields it compares.
+        """
+        commas = numpy.flatnonzero(numpy.frombuffer(data, dtype=numpy.uint8) == ord(','))
+        # sample i starts after comma 2i - 1, and its timestamp ends at comma 2i
+        sample_starts = numpy.concatenate(([0], commas[1::2] + 1))
+        low, high = 0, len(sample_starts)
+        while low < high:
+            middle = (low + high) // 2
+            if int(data[sample_starts[middle]:commas[2 * middle]]) // 1000 <= watermark:
+                low = middle + 1
+            else:
+                high = middle
+        self.skipped += low
+        return data[sample_starts[low]:] if low < len(sample_starts) else b''
+
+
+    def _end_trend(self):
+        if self.field_count % 2:
+            raise ValueError('Unpaired timestamp and value for webctrl trend ' + self.trend_id)
+        if self.field_count:
+            self._convert_block(bytes(self.fields))
+        if self.blocks:
+            timestamps = numpy.concatenate([block[0] for block in self.blocks])
+            values = numpy.concatenate([block[1] for block in self.blocks])
+        else:
+            timestamps = numpy.array([], dtype=numpy.int64)
+            values = numpy.array([], dtype=numpy.float64)
+        trend = Trend(self.trend_id, timestamps, values, self.skipped)
+        self.trend_id = None
+        self.fields = bytearray()
+        self.field_count = 0
+        self.blocks = []
+        self.skipped = 0
+        return trend
+
+
+def _find_line_end(data):
+    ends = [i for i in (data.find(b'\r'), data.find(b'\n')) if i != -1]
+    return min(ends) if ends else -1
+
+
+def iter_trends(chunks, watermarks=None, block_size=BLOCK_SIZE):
+    """
+    Parse an iterable of response chunks (bytes or str, e.g. from requests' iter_content) and yield a Trend per line
+
+    watermarks optionally maps trend id to a unix timestamp; samples at or before it are dropped while parsing.
+    """
+    parser = TrendCsvParser(watermarks, block_size)
+    for chunk in chunks:
+        for trend in parser.feed(chunk):
+            yield trend
+    for trend in parser.close():
+        yield trend
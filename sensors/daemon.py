@@ -0,0 +1,253 @@
+"""
+This module runs the egauge, webctrl and hobo scripts in one long-running process instead of one cron job per script
+
+Usage (from the project folder): python3 sensors/daemon.py [--interval <script_folder>=<seconds>] [--once]
+
+The scripts and their dependencies (pandas, sqlalchemy, pendulum, ...) are imported once and share one pooled
+database engine, so a run no longer pays for starting an interpreter, reading config.txt and connecting to the database.
+Each script folder is run on its own interval. The active script folders are read from sensor_info before every cycle,
+the same way init_crontab.py does, so sensors can be activated or deactivated without restarting the daemon.
+
+Only one daemon runs per project folder; a second one exits immediately, so cron can start it every few minutes as a watchdog
+(see init_crontab.py --daemon).
+"""
+from pathlib import Path
+
+import argparse
+import fcntl
+import logging
+import os
+import sys
+import time
+
+PROJECT_PATH = str(Path(os.path.dirname(os.path.realpath(__file__))).parent)
+sys.path.append(PROJECT_PATH)
+from sensors import db, errorlog, gaps, matview, orm, partition, pivot, profiling, schedule, scripts
+
+
+# seconds between runs of a script folder, the same as the previous cron jobs
+DEFAULT_INTERVAL = 300
+# longest time to sleep before reading the active script folders from sensor_info again
+RECONCILE_INTERVAL = 60
+LOCK_FILENAME = 'daemon.lock'
+# seconds between checks that the partitions of the reading and error_log tables for the next months exist
+PARTITION_INTERVAL = 86400
+# seconds between compactions of the error_log success rows older than errorlog.KEEP_DAYS into error_log_summary
+COMPACT_INTERVAL = 86400
+# seconds between checks that the pivot views in sql_views/pivot still match sensor_info
+PIVOT_INTERVAL = 300
+# seconds between refreshes of the materialized views in sql_views whose sensors were updated
+MATVIEW_INTERVAL = 300
+# seconds between runs of the gap detection and backfill of sensors/gaps.py
+GAP_INTERVAL = 3600
+
+
+def get_active_script_folders(Session):
+    """
+    Return the sorted values of each unique script_folder of active sensors in sensor_info
+    """
+    conn = Session()
+    try:
+        script_folders = conn.query(orm.SensorInfo.script_folder).filter(orm.SensorInfo.is_active == True).distinct()
+        return sorted(script_folder[0].value for script_folder in script_folders if script_folder[0])
+    finally:
+        conn.close()
+
+
+def run_script(script_folder, Session):
+    """
+    Run the script of script_folder once in its */script folder and return the seconds it took
+
+    Exceptions are logged so that one failing script does not stop the daemon.
+    The run is profiled if the SENSORS_PROFILE environment variable asks for it (see sensors/profiling.py);
+    __main__ checks that it is valid before the first run
+    """
+    start_time = time.perf_counter()
+    try:
+        script = scripts.load_script(script_folder)
+        # scripts use paths relative to their folder, e.g. hobo reads csv files from ./to-insert
+        os.chdir(PROJECT_PATH + '/' + script_folder + '/script')
+        with profiling.profile_run(script_folder):
+            script.run(Session)
+    except Exception:
+        logging.exception('run_script ' + script_folder)
+    finally:
+        os.chdir(PROJECT_PATH)
+    return time.perf_counter() - start_time
+
+
+def run_cycle(Session, next_run_times, intervals):
+    """
+    1. reconcile next_run_times (script_folder: time.monotonic() of next run) with the active script folders in sensor_info
+    2. run every script folder that is due and schedule its next run
+
+    Returns the seconds until the next script folder is due
+    """
+    try:
+        active_script_folders = [script_folder for script_folder in get_active_script_folders(Session) if script_folder in scripts.SCRIPT_MODULES]
+    except Exception:
+        # keep the previous schedule if the database cannot be reached
+        logging.exception('get_active_script_folders')
+        active_script_folders = list(next_run_times)
+    for script_folder in list(next_run_times):
+        if script_folder not in active_script_folders:
+            print(__file__ + ': no active sensors for ' + script_folder + ', removing it from the schedule')
+            del next_run_times[script_folder]
+    for script_folder in active_script_folders:
+        if script_folder not in next_run_times:
+            print(__file__ + ': adding ' + script_folder + ' to the schedule')
+            next_run_times[script_folder] = time.monotonic()
+    for script_folder in sorted(next_run_times, key=next_run_times.get):
+        if next_run_times[script_folder] <= time.monotonic():
+            # schedule from the start of the run, like cron, so a slow run does not shift later runs;
+            # jitter the interval so runs drift away from the same second of every minute
+            next_run_times[script_folder] = time.monotonic() + schedule.add_jitter(intervals.get(script_folder, DEFAULT_INTERVAL))
+            seconds = run_script(script_folder, Session)
+            print(__file__ + ': ran ' + script_folder + ' in {:.3f} s'.format(seconds))
+    if not next_run_times:
+        return RECONCILE_INTERVAL
+    return max(min(next_run_times.values()) - time.monotonic(), 0)
+
+
+def ensure_partitions(Session):
+    """
+    Create the missing partitions of the reading and error_log tables with sensors/partition.py
+
+    Exceptions are logged, since rows without a partition still go to the default partition
+    """
+    conn = Session()
+    try:
+        new_partitions = partition.ensure_all_partitions(conn)
+        conn.commit()
+        if new_partitions:
+            print(__file__ + ': created partitions ' + str(new_partitions))
+    except Exception:
+        logging.exception('ensure_partitions')
+    finally:
+        conn.close()
+
+
+def compact_error_log(Session):
+    """
+    Summarize the old success rows of error_log in error_log_summary with sensors/errorlog.py
+
+    Exceptions are logged; the days that were not compacted are compacted by the next run
+    """
+    conn = Session()
+    try:
+        days = errorlog.compact(conn)
+        if days:
+            print(__file__ + ': compacted error_log of ' + str(len(days)) + ' days')
+    except Exception:
+        logging.exception('compact_error_log')
+    finally:
+        conn.close()
+
+
+def refresh_pivot_views(Session):
+    """
+    Create or replace the pivot views whose purposes in sensor_info changed with sensors/pivot.py
+
+    Views that cannot be created are logged and keep their previous definition
+    """
+    conn = Session()
+    try:
+        replaced_views, failures = pivot.refresh_views(conn)
+        conn.commit()
+        if replaced_views:
+            print(__file__ + ': replaced views ' + str(replaced_views))
+        for spec_filename, exception in failures.items():
+            logging.error('refresh_pivot_views: ' + spec_filename + ': ' + str(exception))
+    except Exception:
+        logging.exception('refresh_pivot_views')
+    finally:
+        conn.close()
+
+
+def refresh_materialized_views(Session):
+    """
+    Refresh the materialized views in sql_views whose sensors were updated with sensors/matview.py
+
+    Exceptions are logged; the views keep their previous rows until the next refresh
+    """
+    conn = Session()
+    try:
+        refreshed_views = matview.refresh_views(conn, matview.read_sql_views())
+        if refreshed_views:
+            print(__file__ + ': refreshed views ' + str(refreshed_views))
+    except Exception:
+        logging.exception('refresh_materialized_views')
+    finally:
+        conn.close()
+
+
+def detect_and_backfill_gaps(Session):
+    """
+    Write the new gaps in the readings to reading_gap and backfill up to gaps.SCHEDULED_MAX_GAPS of them with sensors/gaps.py
+
+    Exceptions are logged; the gaps that were not detected or backfilled are left for the next run
+    """
+    try:
+        gaps.detect_all_gaps(Session)
+        gaps.backfill_gaps(Session, gaps.SCHEDULED_MAX_GAPS)
+    except Exception:
+        logging.exception('detect_and_backfill_gaps')
+
+
+def parse_interval(interval_string):
+    """
+    Parse an --interval argument like "egauge=60" into a (script_folder, seconds) tuple
+    """
+    script_folder, seconds = interval_string.split('=')
+    if script_folder not in scripts.SCRIPT_MODULES:
+        raise argparse.ArgumentTypeError('unknown script folder ' + script_folder)
+    return script_folder, float(seconds)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the sensor scripts of every active script folder in one process')
+    parser.add_argument('--interval', type=parse_interval, action='append', default=[], metavar='SCRIPT_FOLDER=SECONDS',
+                        help='seconds between runs of a script folder (default ' + str(DEFAULT_INTERVAL) + ')')
+    parser.add_argument('--once', action='store_true', help='run every active script folder once and exit')
+    args = parser.parse_args()
+    # an unknown SENSORS_PROFILE would make every run_script fail, so the daemon does not start with one
+    try:
+        profiling.get_profile_kinds()
+    except ValueError as exception:
+        parser.error(profiling.PROFILE_ENVIRONMENT_VARIABLE + ': ' + str(exception))
+    os.chdir(PROJECT_PATH)
+    logging.basicConfig(filename='error.log', format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+    # hold an exclusive lock for the life of the process so only one daemon runs
+    lock_file = open(LOCK_FILENAME, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        print(__file__ + ': another daemon is already running')
+        sys.exit(0)
+    Session = db.get_sessionmaker()
+    next_run_times = {}
+    next_partition_time = time.monotonic()
+    next_compact_time = time.monotonic()
+    next_pivot_time = time.monotonic()
+    next_matview_time = time.monotonic()
+    next_gap_time = time.monotonic()
+    while True:
+        if next_partition_time <= time.monotonic():
+            next_partition_time = time.monotonic() + PARTITION_INTERVAL
+            ensure_partitions(Session)
+        if next_compact_time <= time.monotonic():
+            next_compact_time = time.monotonic() + COMPACT_INTERVAL
+            compact_error_log(Session)
+        if next_pivot_time <= time.monotonic():
+            next_pivot_time = time.monotonic() + PIVOT_INTERVAL
+            refresh_pivot_views(Session)
+        if next_matview_time <= time.monotonic():
+            next_matview_time = time.monotonic() + MATVIEW_INTERVAL
+            refresh_materialized_views(Session)
+        if next_gap_time <= time.monotonic():
+            next_gap_time = time.monotonic() + GAP_INTERVAL
+            detect_and_backfill_gaps(Session)
+        seconds_until_next_run = run_cycle(Session, next_run_times, dict(args.interval))
+        if args.once:
+            break
+        time.sleep(min(seconds_until_next_run, RECONCILE_INTERVAL))
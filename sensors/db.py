@@ -0,0 +1,66 @@
+"""
+This module reads config.txt and holds the database engine shared by everything that runs in one process
+
+The database is named in config.txt in the project folder, e.g. "db = sensors", which init_database.py writes.
+get_engine() creates the engine on its first call and returns the same engine afterwards, so the scripts, sensors/daemon.py
+and the sensors modules they import share one pool of connections instead of each connecting on its own.
+Connections are checked before use, since the daemon may hold them across database restarts.
+"""
+from pathlib import Path
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import configparser
+import os
+
+
+PROJECT_PATH = str(Path(os.path.dirname(os.path.realpath(__file__))).parent)
+CONFIG_PATH = PROJECT_PATH + '/config.txt'
+DEFAULT_POOL_SIZE = 5
+
+# the engine of this process, created by get_engine()
+engine = None
+
+
+def read_config(config_path=CONFIG_PATH):
+    """
+    Return the settings in config_path as a dictionary-like ConfigParser section
+    """
+    with open(config_path, "r") as file:
+        # prepend '[DEFAULT]\n' since ConfigParser requires section headers in config files
+        config_string = '[DEFAULT]\n' + file.read()
+    config = configparser.ConfigParser()
+    config.read_string(config_string)
+    return config['DEFAULT']
+
+
+def get_db_url():
+    """
+    Return the url of the database named in config.txt
+    """
+    return "postgresql:///" + read_config()['db']
+
+
+def get_engine(pool_size=DEFAULT_POOL_SIZE):
+    """
+    Return the engine of this process for the database named in config.txt, creating it with up to pool_size pooled
+    connections on the first call
+    """
+    global engine
+    if engine is None:
+        engine = create_engine(get_db_url(), pool_size=pool_size, pool_pre_ping=True)
+    return engine
+
+
+def get_sessionmaker(pool_size=DEFAULT_POOL_SIZE):
+    """
+    Return a sessionmaker bound to the engine of this process
+    """
+    return sessionmaker(get_engine(pool_size))
+
+
+def get_db_handler():
+    """
+    Return a new session (a database "connection") from the engine of this process
+    """
+    return get_sessionmaker()()
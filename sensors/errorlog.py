@@ -0,0 +1,223 @@
+"""
+This module keeps the error_log table from growing with every run of the scripts
+
+Usage (from the project folder):
+    python3 sensors/errorlog.py compact [--keep-days <days>]
+    python3 sensors/errorlog.py migrate [--months-ahead <months>]
+    python3 sensors/errorlog.py drop --before <YYYY-MM>
+
+Each script run adds an error_log row per purpose and pipeline_stage, nearly all of them successes that are not read
+after a few days. compact summarizes the rows of each day older than --keep-days (default 7) in error_log_summary,
+one row per purpose, day and pipeline_stage with the number of successes and failures, the failures of each error_type
+and the first and last datetime, then deletes the success rows and their error_log_details. Failures are kept.
+Rows whose was_success is NULL (readings that were already inserted, see hobo/script/extract_hobo.py) are not failures,
+so they are counted and deleted with the successes.
+Each day is committed on its own, so a stopped compaction resumes at the day it stopped. It is run daily by
+sensors/daemon.py and by init_crontab.py.
+
+migrate converts an error_log table created before it was partitioned into a table partitioned by month like reading
+(see sensors/partition.py), in one transaction that blocks inserts into error_log while the rows are copied.
+Rows without a datetime are not copied. The foreign keys that reference error_log.log_id are dropped, since log_id
+is not unique on its own in a partitioned table. error_log_unpartitioned is kept; drop it once the migrated table has been checked.
+
+drop drops the monthly partitions of error_log before --before and their error_log_details; error_log_summary is kept.
+Dropping a partition only changes the catalog, so it takes no time however many rows the month has.
+"""
+from pathlib import Path
+from sqlalchemy import text
+
+import argparse
+import os
+import pendulum
+import sys
+
+sys.path.append(str(Path(os.path.dirname(os.path.realpath(__file__))).parent))
+from sensors import db, indexes, orm, partition
+
+
+TABLE = 'error_log'
+MIGRATION_TABLE = TABLE + partition.MIGRATION_SUFFIX
+UNPARTITIONED_TABLE = 'error_log_unpartitioned'
+# days of success rows kept in error_log before they are compacted
+KEEP_DAYS = 7
+
+# the day after the last summarized day, or the day of the first error_log row
+SELECT_FIRST_DAY = """
+    SELECT coalesce((SELECT max(day) + 1 FROM error_log_summary), (SELECT CAST(min(datetime) AS DATE) FROM error_log))
+"""
+# 1. delete the success rows of the day, and the rows whose was_success is NULL, and their error_log_details
+# 2. count the deleted successes and the kept failures of each purpose and pipeline_stage, and the failures of each error_type
+# 3. add the counts to error_log_summary; failures are counted again from error_log, so compacting a day twice does not count them twice
+COMPACT_DAY = """
+    WITH compacted AS (
+        DELETE FROM error_log
+        WHERE datetime >= :day_start AND datetime < :day_end AND was_success IS NOT FALSE
+            AND purpose_id IS NOT NULL AND pipeline_stage IS NOT NULL
+        RETURNING log_id, purpose_id, pipeline_stage, datetime
+    ), compacted_details AS (
+        DELETE FROM error_log_details WHERE log_id IN (SELECT log_id FROM compacted)
+    ), successes AS (
+        SELECT purpose_id, pipeline_stage, count(*) AS success_count, min(datetime) AS first_datetime, max(datetime) AS last_datetime
+        FROM compacted GROUP BY purpose_id, pipeline_stage
+    ), error_types AS (
+        SELECT purpose_id, pipeline_stage, coalesce(error_type, 'unknown') AS error_type, count(*) AS failure_count,
+            min(datetime) AS first_datetime, max(datetime) AS last_datetime
+        FROM error_log
+        WHERE datetime >= :day_start AND datetime < :day_end AND was_success = false
+            AND purpose_id IS NOT NULL AND pipeline_stage IS NOT NULL
+        GROUP BY purpose_id, pipeline_stage, coalesce(error_type, 'unknown')
+    ), failures AS (
+        SELECT purpose_id, pipeline_stage, sum(failure_count) AS failure_count, jsonb_object_agg(error_type, failure_count) AS error_type_counts,
+            min(first_datetime) AS first_datetime, max(last_datetime) AS last_datetime
+        FROM error_types GROUP BY purpose_id, pipeline_stage
+    ), summarized AS (
+        INSERT INTO error_log_summary (purpose_id, day, pipeline_stage, success_count, failure_count, error_type_counts,
+                                       first_datetime, last_datetime)
+        SELECT purpose_id, CAST(:day_start AS DATE), pipeline_stage, coalesce(successes.success_count, 0),
+            coalesce(failures.failure_count, 0), coalesce(failures.error_type_counts, '{}'),
+            least(successes.first_datetime, failures.first_datetime), greatest(successes.last_datetime, failures.last_datetime)
+        FROM successes FULL JOIN failures USING (purpose_id, pipeline_stage)
+        ON CONFLICT (purpose_id, day, pipeline_stage) DO UPDATE SET
+            success_count = error_log_summary.success_count + excluded.success_count,
+            failure_count = excluded.failure_count,
+            error_type_counts = excluded.error_type_counts,
+            first_datetime = least(error_log_summary.first_datetime, excluded.first_datetime),
+            last_datetime = greatest(error_log_summary.last_datetime, excluded.last_datetime)
+        RETURNING 1
+    )
+    SELECT (SELECT count(*) FROM compacted), (SELECT count(*) FROM summarized)
+"""
+SELECT_MONTHS = """
+    SELECT DISTINCT date_trunc('month', datetime) FROM {table} WHERE datetime IS NOT NULL
+"""
+COPY_ROWS = """
+    INSERT INTO {migration_table} SELECT * FROM {table} WHERE datetime IS NOT NULL
+"""
+# foreign keys of other tables that reference the table, e.g. reading.log_id of a database created before error_log was partitioned
+SELECT_REFERENCING_CONSTRAINTS = """
+    SELECT conrelid::regclass::text, conname FROM pg_constraint
+    WHERE confrelid = to_regclass(:table) AND contype = 'f' AND conparentid = 0
+"""
+DELETE_PARTITION_DETAILS = """
+    DELETE FROM error_log_details WHERE log_id IN (SELECT log_id FROM {partition})
+"""
+
+
+def get_cutoff(keep_days=KEEP_DAYS, current_time=None):
+    """
+    Return the first day (a naive pendulum datetime) whose success rows are kept, keep_days before the current day
+    """
+    return (current_time or pendulum.now('Pacific/Honolulu')).naive().start_of('day').subtract(days=keep_days)
+
+
+def get_days(first_day, cutoff):
+    """
+    Return each day from first_day (a date or datetime) through the day before cutoff as naive pendulum datetimes
+    """
+    day = pendulum.datetime(first_day.year, first_day.month, first_day.day).naive()
+    days = []
+    while day < cutoff:
+        days.append(day)
+        day = day.add(days=1)
+    return days
+
+
+def compact(conn, keep_days=KEEP_DAYS, current_time=None):
+    """
+    Summarize the error_log rows of each day before keep_days ago that is not summarized yet in error_log_summary
+    and delete its success rows, committing after each day
+
+    Returns the compacted days
+    """
+    first_day = conn.execute(text(SELECT_FIRST_DAY)).scalar()
+    conn.commit()
+    if first_day is None:
+        return []
+    days = get_days(first_day, get_cutoff(keep_days, current_time))
+    for day in days:
+        compacted_rows, summary_rows = conn.execute(text(COMPACT_DAY), {'day_start': day, 'day_end': day.add(days=1)}).first()
+        conn.commit()
+        print(__file__ + ': compacted ' + str(compacted_rows) + ' success rows of ' + day.to_date_string()
+              + ' into ' + str(summary_rows) + ' summary rows')
+    return days
+
+
+def migrate(conn, months_ahead=partition.MONTHS_AHEAD):
+    """
+    1. lock TABLE against inserts and create MIGRATION_TABLE partitioned by month with the columns of TABLE,
+       a partition for every month with rows in TABLE and for the next months_ahead months, and the default partition
+    2. copy the rows of TABLE into MIGRATION_TABLE and drop the foreign keys that reference TABLE
+    3. rename TABLE to UNPARTITIONED_TABLE and MIGRATION_TABLE to TABLE, replace the views that select from TABLE,
+       and create the indexes of orm.ErrorLog
+
+    Nothing is committed. Returns False if TABLE is already partitioned
+    """
+    if partition.is_partitioned(conn, TABLE):
+        print(__file__ + ': ' + TABLE + ' is already partitioned')
+        return False
+    conn.execute(text('LOCK TABLE ' + TABLE + ' IN EXCLUSIVE MODE'))
+    conn.execute(text(partition.CREATE_MIGRATION_TABLE.format(migration_table=MIGRATION_TABLE, table=TABLE)))
+    conn.execute(text('ALTER TABLE ' + MIGRATION_TABLE + ' ADD PRIMARY KEY (log_id, datetime)'))
+    conn.execute(text('CREATE TABLE ' + partition.get_default_partition(MIGRATION_TABLE) + ' PARTITION OF ' + MIGRATION_TABLE + ' DEFAULT'))
+    months = [pendulum.instance(row[0]).naive() for row in conn.execute(text(SELECT_MONTHS.format(table=TABLE)))]
+    for month in sorted(months):
+        partition.create_partition(conn, month, MIGRATION_TABLE)
+    partition.ensure_partitions(conn, months_ahead, MIGRATION_TABLE)
+    rows = conn.execute(text(COPY_ROWS.format(migration_table=MIGRATION_TABLE, table=TABLE))).rowcount
+    print(__file__ + ': copied ' + str(rows) + ' rows into ' + MIGRATION_TABLE)
+    for table, constraint_name in conn.execute(text(SELECT_REFERENCING_CONSTRAINTS), {'table': TABLE}).fetchall():
+        conn.execute(text('ALTER TABLE ' + table + ' DROP CONSTRAINT ' + constraint_name))
+        print(__file__ + ': dropped foreign key ' + constraint_name + ' of ' + table)
+    # the log_id sequence is dropped with the table that owns it, so it moves to the new table
+    sequence = conn.execute(text('SELECT pg_get_serial_sequence(:table, \'log_id\')'), {'table': TABLE}).scalar()
+    if sequence:
+        conn.execute(text('ALTER SEQUENCE ' + sequence + ' OWNED BY ' + MIGRATION_TABLE + '.log_id'))
+    views = partition.get_dependent_views(conn, TABLE)
+    partition.rename_table(conn, TABLE, UNPARTITIONED_TABLE)
+    partition.rename_table(conn, MIGRATION_TABLE, TABLE)
+    partition.replace_views(conn, views)
+    print(__file__ + ': created indexes ' + str(indexes.create_indexes(conn, [orm.ErrorLog.__table__])))
+    return True
+
+
+def drop_partitions(conn, before):
+    """
+    Drop the partitions of error_log of every month before the month of before (a pendulum datetime)
+    with the error_log_details of their rows
+
+    Nothing is committed. Returns the names of the dropped partitions
+    """
+    dropped_partitions = []
+    for partition_name in partition.get_partition_names(conn, TABLE):
+        partition_match = partition.PARTITION_NAME_PATTERN.fullmatch(partition_name)
+        if partition_match and partition_match.group(1) == TABLE and partition_name < partition.get_partition_name(before, TABLE):
+            conn.execute(text(DELETE_PARTITION_DETAILS.format(partition=partition_name)))
+            conn.execute(text('DROP TABLE ' + partition_name))
+            dropped_partitions.append(partition_name)
+    return dropped_partitions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compact, partition and drop old rows of the error_log table')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    compact_parser = subparsers.add_parser('compact', help='summarize the old success rows of error_log in error_log_summary')
+    compact_parser.add_argument('--keep-days', type=int, default=KEEP_DAYS, help='days of success rows kept in error_log')
+    migrate_parser = subparsers.add_parser('migrate', help='convert an unpartitioned error_log table')
+    migrate_parser.add_argument('--months-ahead', type=int, default=partition.MONTHS_AHEAD, help='months of partitions after the current month')
+    drop_parser = subparsers.add_parser('drop', help='drop the partitions of old months')
+    drop_parser.add_argument('--before', type=partition.parse_month, required=True, help='drop the months before this YYYY-MM month')
+    args = parser.parse_args()
+
+    conn = db.get_sessionmaker()()
+    if args.command == 'compact':
+        compact(conn, args.keep_days)
+    elif args.command == 'migrate':
+        if migrate(conn, args.months_ahead):
+            conn.commit()
+            print(__file__ + ': ' + TABLE + ' is partitioned; drop ' + UNPARTITIONED_TABLE + ' once it has been checked')
+    else:
+        partitions = drop_partitions(conn, args.before)
+        conn.commit()
+        print(__file__ + ': dropped partitions ' + str(partitions))
+    conn.close()
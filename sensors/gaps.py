@@ -0,0 +1,193 @@
+"""
+This module finds gaps in the readings of each purpose and backfills them
+
+Usage (from the project folder):
+    python3 sensors/gaps.py detect [--purpose-id <purpose_id>]
+    python3 sensors/gaps.py backfill [--max-gaps <gaps>]
+
+detect compares the spacing of consecutive readings (lead(datetime) over one purpose's readings) with the purpose's
+expected spacing, which is its sample_resolution, or the median spacing of its readings if sample_resolution is not set.
+Readings further apart than GAP_FACTOR times the expected spacing are written to the reading_gap table.
+Only readings from the purpose's gap_checkpoint onwards are scanned, so each run only reads the new part of the reading table.
+Readings inserted before the checkpoint later on (e.g. by a backfill) are not scanned again.
+
+backfill requests the readings of open and failed egauge and webctrl gaps again with sensors/backfill.py
+and marks each gap as backfilled or failed. Each run first claims its gaps (reading_gap.claimed_datetime), so runs of
+the daemon and of init_crontab.py that overlap do not backfill the same gaps; the claim of a run that stopped
+before recording the outcome of a gap expires after CLAIM_SECONDS.
+
+Both are run hourly by sensors/daemon.py and on each run of init_crontab.py, which backfill at most SCHEDULED_MAX_GAPS
+gaps per run, so a run does not hold up the scripts for long; the remaining gaps are backfilled by the next runs.
+"""
+from pathlib import Path
+from sqlalchemy import text
+
+import argparse
+import logging
+import os
+import pendulum
+import sys
+
+sys.path.append(str(Path(os.path.dirname(os.path.realpath(__file__))).parent))
+from sensors import backfill, db, orm, schedule
+
+
+# readings further apart than this many expected spacings are a gap, i.e. at least one reading is missing
+GAP_FACTOR = 1.5
+# gaps are retried by the planner until they were backfilled this many times
+MAX_ATTEMPTS = 3
+DEFAULT_MAX_GAPS = 100
+# gaps backfilled by each run of sensors/daemon.py and init_crontab.py
+SCHEDULED_MAX_GAPS = 10
+# seconds after which the gaps claimed by a run that did not record their outcome can be claimed again
+CLAIM_SECONDS = 21600
+# the checkpoint of a purpose that was never checked, before any reading
+FIRST_CHECKPOINT = pendulum.datetime(1970, 1, 1).naive()
+
+# uses the reading primary key (datetime, purpose_id) to read only the readings after the checkpoint
+SELECT_CADENCE = """
+    SELECT max(datetime), percentile_cont(0.5) WITHIN GROUP (ORDER BY seconds) FROM (
+        SELECT datetime, extract(epoch FROM lead(datetime) OVER (ORDER BY datetime) - datetime) AS seconds
+        FROM reading WHERE purpose_id = :purpose_id AND datetime >= :checked_through
+    ) spacing
+"""
+INSERT_GAPS = """
+    INSERT INTO reading_gap (purpose_id, gap_start, gap_end, expected_seconds, status, attempts, detected_datetime)
+    SELECT :purpose_id, datetime, next_datetime, :expected_seconds, 'open', 0, :current_time FROM (
+        SELECT datetime, lead(datetime) OVER (ORDER BY datetime) AS next_datetime
+        FROM reading WHERE purpose_id = :purpose_id AND datetime >= :checked_through
+    ) spacing
+    WHERE next_datetime > datetime + :gap_seconds * interval '1 second'
+    ON CONFLICT (purpose_id, gap_start) DO NOTHING
+"""
+UPSERT_CHECKPOINT = """
+    INSERT INTO gap_checkpoint (purpose_id, checked_through_datetime, cadence_seconds)
+    VALUES (:purpose_id, :checked_through, :cadence_seconds)
+    ON CONFLICT (purpose_id) DO UPDATE SET checked_through_datetime = excluded.checked_through_datetime,
+        cadence_seconds = coalesce(excluded.cadence_seconds, gap_checkpoint.cadence_seconds)
+"""
+# gaps locked by another run that is claiming gaps are skipped instead of waited for
+CLAIM_GAPS = """
+    UPDATE reading_gap SET claimed_datetime = :current_time
+    WHERE (purpose_id, gap_start) IN (
+        SELECT reading_gap.purpose_id, gap_start FROM reading_gap
+        JOIN sensor_info ON sensor_info.purpose_id = reading_gap.purpose_id
+        WHERE sensor_info.is_active AND sensor_info.script_folder IN ('egauge', 'webctrl')
+            AND (status = 'open' OR (status = 'failed' AND attempts < :max_attempts))
+            AND (claimed_datetime IS NULL OR claimed_datetime < :current_time - :claim_seconds * interval '1 second')
+        ORDER BY gap_start LIMIT :max_gaps
+        FOR UPDATE OF reading_gap SKIP LOCKED
+    )
+    RETURNING purpose_id, gap_start, gap_end
+"""
+UPDATE_GAP = """
+    UPDATE reading_gap SET status = :status, attempts = attempts + 1, last_attempt_datetime = :current_time, claimed_datetime = NULL
+    WHERE purpose_id = :purpose_id AND gap_start = :gap_start
+"""
+
+
+def get_expected_seconds(sample_resolution, cadence_seconds):
+    """
+    Return the expected seconds between readings of a purpose: its sample_resolution, or else cadence_seconds,
+    the median spacing of its readings. Returns None if neither is known
+    """
+    return schedule.parse_sample_resolution(sample_resolution) or cadence_seconds
+
+
+def detect_gaps(conn, purpose_id, sample_resolution, current_time):
+    """
+    Write the gaps in the readings of purpose_id after its gap_checkpoint to reading_gap and move the checkpoint
+    to its latest reading
+
+    Returns the number of new gaps. Nothing is committed.
+    """
+    checked_through = conn.execute(text('SELECT checked_through_datetime FROM gap_checkpoint WHERE purpose_id = :purpose_id'),
+                                   {'purpose_id': purpose_id}).scalar()
+    # datetime is never null, so this scans every reading of a purpose without a checkpoint
+    checked_through = checked_through or FIRST_CHECKPOINT
+    parameters = {'purpose_id': purpose_id, 'checked_through': checked_through}
+    latest_datetime, cadence_seconds = conn.execute(text(SELECT_CADENCE), parameters).first()
+    if latest_datetime is None:
+        return 0
+    expected_seconds = get_expected_seconds(sample_resolution, cadence_seconds)
+    if cadence_seconds and expected_seconds and abs(cadence_seconds - expected_seconds) > expected_seconds * (GAP_FACTOR - 1):
+        print('purpose_id ' + str(purpose_id) + ': readings are ' + str(cadence_seconds) + ' s apart, but sample_resolution is '
+              + str(sample_resolution))
+    gaps = 0
+    if expected_seconds:
+        gaps = conn.execute(text(INSERT_GAPS), dict(parameters, expected_seconds=expected_seconds, current_time=current_time,
+                                                    gap_seconds=expected_seconds * GAP_FACTOR)).rowcount
+    conn.execute(text(UPSERT_CHECKPOINT), dict(parameters, checked_through=latest_datetime, cadence_seconds=cadence_seconds))
+    return gaps
+
+
+def detect_all_gaps(Session, purpose_id=None):
+    """
+    Run detect_gaps() for purpose_id or every active purpose, committing after each purpose
+    """
+    conn = Session()
+    current_time = pendulum.now('Pacific/Honolulu')
+    current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
+    purposes = conn.query(orm.SensorInfo.purpose_id, orm.SensorInfo.sample_resolution).filter_by(is_active=True)
+    if purpose_id is not None:
+        purposes = purposes.filter_by(purpose_id=purpose_id)
+    for purpose in purposes.order_by(orm.SensorInfo.purpose_id).all():
+        gaps = detect_gaps(conn, purpose.purpose_id, purpose.sample_resolution, current_time)
+        conn.commit()
+        print('purpose_id ' + str(purpose.purpose_id) + ': ' + str(gaps) + ' new gap(s)')
+    conn.close()
+
+
+def backfill_gaps(Session, max_gaps=DEFAULT_MAX_GAPS, max_workers=backfill.DEFAULT_MAX_WORKERS):
+    """
+    Claim up to max_gaps open or failed egauge and webctrl gaps that no other run claimed, backfill them oldest first
+    and record the outcome of each in reading_gap
+
+    Returns the number of gaps that failed
+    """
+    conn = Session()
+    current_time = pendulum.now('Pacific/Honolulu')
+    current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
+    gaps = conn.execute(text(CLAIM_GAPS), {'max_attempts': MAX_ATTEMPTS, 'max_gaps': max_gaps, 'current_time': current_time,
+                                           'claim_seconds': CLAIM_SECONDS}).fetchall()
+    # commit the claim before the first request, so other runs skip these gaps
+    conn.commit()
+    gaps.sort(key=lambda gap: gap.gap_start)
+    print(str(len(gaps)) + ' gap(s) to backfill')
+    failed_gaps = 0
+    for purpose_id, gap_start, gap_end in gaps:
+        current_time = pendulum.now('Pacific/Honolulu')
+        current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
+        try:
+            # readings at gap_start and gap_end are already in the reading table and are skipped
+            was_success = backfill.backfill(Session, purpose_id=purpose_id, start=pendulum.instance(gap_start, 'Pacific/Honolulu'),
+                                            end=pendulum.instance(gap_end, 'Pacific/Honolulu'), max_workers=max_workers)
+        except Exception:
+            logging.exception('backfill_gaps: purpose_id ' + str(purpose_id) + ' gap from ' + str(gap_start) + ' to ' + str(gap_end))
+            was_success = False
+        status = 'backfilled' if was_success else 'failed'
+        failed_gaps += not was_success
+        conn.execute(text(UPDATE_GAP), {'status': status, 'current_time': current_time, 'purpose_id': purpose_id, 'gap_start': gap_start})
+        conn.commit()
+        print('purpose_id ' + str(purpose_id) + ': gap from ' + str(gap_start) + ' to ' + str(gap_end) + ' ' + status)
+    conn.close()
+    return failed_gaps
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find gaps in the reading table and backfill them')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    detect_parser = subparsers.add_parser('detect', help='write gaps after each purpose\'s checkpoint to reading_gap')
+    detect_parser.add_argument('--purpose-id', type=int, help='only check this purpose_id')
+    backfill_parser = subparsers.add_parser('backfill', help='request the readings of egauge and webctrl gaps again')
+    backfill_parser.add_argument('--max-gaps', type=int, default=DEFAULT_MAX_GAPS, help='maximum number of gaps to backfill')
+    backfill_parser.add_argument('--max-workers', type=int, default=backfill.DEFAULT_MAX_WORKERS, help='maximum number of chunks of a gap requested at once')
+    args = parser.parse_args()
+    # the scripts are imported by this process, so they log to error.log in the project folder like under the daemon
+    os.chdir(db.PROJECT_PATH)
+    Session = db.get_sessionmaker()
+    if args.command == 'detect':
+        detect_all_gaps(Session, args.purpose_id)
+    elif backfill_gaps(Session, args.max_gaps, args.max_workers):
+        sys.exit(1)
@@ -0,0 +1,164 @@
+"""
+This module creates the indexes defined in sensors.orm on an existing database and reports how the views in sql_views use them
+
+Usage (from the project folder):
+    python3 sensors/indexes.py create
+    python3 sensors/indexes.py explain [<sql file> ...]
+
+orm.setup() creates the indexes of new tables. create adds the missing indexes of reading and error_log
+to a database set up before they were defined. CREATE INDEX blocks inserts into the table while it runs,
+so run it when the scripts are stopped or between their runs.
+
+explain runs EXPLAIN (ANALYZE, BUFFERS) on the select of every file in sql_views (or of the given files) and prints,
+for each view, its execution time, the tables it scans sequentially with the rows and buffers they cost,
+and the indexes it uses, followed by the number of views that use each index.
+A sequential scan of a large table such as reading is a candidate for an index; an index no view uses does not pay off.
+Views that select from other views are explained after the views they select from are created.
+Everything runs in one transaction that is rolled back, so views are not created or changed.
+"""
+from pathlib import Path
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex
+
+import argparse
+import collections
+import glob
+import json
+import os
+import sys
+
+sys.path.append(str(Path(os.path.dirname(os.path.realpath(__file__))).parent))
+from sensors import db, matview, orm
+
+
+INDEX_NODE_TYPES = ('Index Scan', 'Index Only Scan', 'Bitmap Index Scan')
+
+# a sequential scan of relation_name, with the rows it returned over all its loops and the buffers it read
+SequentialScan = collections.namedtuple('SequentialScan', ['relation_name', 'rows', 'rows_removed', 'buffers'])
+ViewPlan = collections.namedtuple('ViewPlan', ['view_name', 'execution_milliseconds', 'sequential_scans', 'index_names'])
+
+
+def create_indexes(conn, tables=(orm.Reading.__table__, orm.ErrorLog.__table__)):
+    """
+    Create the indexes of tables that do not exist in the database yet
+
+    Nothing is committed. Returns the names of the new indexes
+    """
+    new_index_names = []
+    for table in tables:
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if not conn.execute(text('SELECT to_regclass(:index_name)'), {'index_name': index.name}).scalar():
+                conn.execute(CreateIndex(index))
+                new_index_names.append(index.name)
+    return new_index_names
+
+
+def get_plan_nodes(plan):
+    """
+    Yield plan and every node below it in an EXPLAIN (FORMAT JSON) plan
+    """
+    yield plan
+    for child_plan in plan.get('Plans', []):
+        yield from get_plan_nodes(child_plan)
+
+
+def summarize_plan(view_name, explain_output):
+    """
+    Return a ViewPlan of the sequential scans and indexes in explain_output, the result of EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)
+    """
+    sequential_scans = []
+    index_names = set()
+    for node in get_plan_nodes(explain_output[0]['Plan']):
+        if node['Node Type'] == 'Seq Scan':
+            loops = node.get('Actual Loops', 1)
+            sequential_scans.append(SequentialScan(node['Relation Name'], node.get('Actual Rows', 0) * loops,
+                                                   node.get('Rows Removed by Filter', 0) * loops,
+                                                   node.get('Shared Hit Blocks', 0) + node.get('Shared Read Blocks', 0)))
+        elif node['Node Type'] in INDEX_NODE_TYPES:
+            index_names.add(node['Index Name'])
+    sequential_scans.sort(key=lambda sequential_scan: sequential_scan.buffers, reverse=True)
+    return ViewPlan(view_name, explain_output[0].get('Execution Time'), sequential_scans, sorted(index_names))
+
+
+def explain_view(conn, view_name, select):
+    """
+    Create view_name from select if it does not exist, so views that select from it can be explained,
+    and return the ViewPlan of select
+
+    Runs in a savepoint, which is rolled back if the view cannot be created or explained
+    """
+    savepoint = conn.begin_nested()
+    try:
+        if not conn.execute(text('SELECT to_regclass(:view_name)'), {'view_name': view_name}).scalar():
+            if '.' in view_name:
+                conn.execute(text('CREATE SCHEMA IF NOT EXISTS ' + view_name.split('.')[0]))
+            conn.execute(text('CREATE VIEW ' + view_name + ' AS ' + select.replace(':', '\\:')))
+        explain_output = conn.execute(text('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + select.replace(':', '\\:'))).scalar()
+    except Exception:
+        savepoint.rollback()
+        raise
+    savepoint.commit()
+    if isinstance(explain_output, str):
+        explain_output = json.loads(explain_output)
+    return summarize_plan(view_name, explain_output)
+
+
+def explain_views(conn, sql_filenames):
+    """
+    Explain the view of each of sql_filenames, repeating the views that failed until no more views can be explained
+
+    Nothing is committed. Returns a list of ViewPlans and a dictionary of sql filename: exception of the views that failed
+    """
+    view_plans = []
+    failures = {}
+    pending_filenames = sorted(sql_filenames)
+    while pending_filenames:
+        failures = {}
+        for sql_filename in pending_filenames:
+            try:
+                view_plans.append(explain_view(conn, *matview.read_view(sql_filename)))
+            except Exception as exception:
+                failures[sql_filename] = exception
+        # a pass that explained no view will not explain any on the next pass either
+        if len(failures) == len(pending_filenames):
+            break
+        pending_filenames = sorted(failures)
+    return view_plans, failures
+
+
+def print_report(view_plans, failures):
+    """
+    Print the sequential scans and indexes of each view plan, the number of views using each index, and the failures
+    """
+    index_views = collections.Counter()
+    for view_plan in sorted(view_plans, key=lambda view_plan: view_plan.execution_milliseconds or 0, reverse=True):
+        print('{}: {:.1f} ms'.format(view_plan.view_name, view_plan.execution_milliseconds or 0))
+        for sequential_scan in view_plan.sequential_scans:
+            print('    seq scan of {}: {} rows returned, {} rows removed by filter, {} buffers'.format(*sequential_scan))
+        if view_plan.index_names:
+            print('    indexes: ' + ', '.join(view_plan.index_names))
+        index_views.update(view_plan.index_names)
+    print()
+    print('views using each index:')
+    for index_name, views in index_views.most_common():
+        print('    {}: {}'.format(index_name, views))
+    for sql_filename, exception in sorted(failures.items()):
+        print(sql_filename + ' could not be explained: ' + str(exception).strip().splitlines()[0])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create the indexes of reading and error_log, or explain the views in sql_views')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    subparsers.add_parser('create', help='create the indexes defined in sensors.orm that are missing from the database')
+    explain_parser = subparsers.add_parser('explain', help='report the sequential scans and indexes of each view')
+    explain_parser.add_argument('sql_filenames', nargs='*', help='sql files to explain (default: every file in sql_views)')
+    args = parser.parse_args()
+    conn = db.get_sessionmaker()()
+    if args.command == 'create':
+        print(__file__ + ': created indexes ' + str(create_indexes(conn)))
+        conn.commit()
+    else:
+        print_report(*explain_views(conn, args.sql_filenames or glob.glob(matview.SQL_VIEWS_PATH + '/*.sql')))
+        conn.rollback()
+    conn.close()
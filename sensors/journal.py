@@ -0,0 +1,78 @@
+"""
+This module collects the error_log and error_log_details rows of a script run in memory and writes them in one statement each
+
+Adding an orm.ErrorLog per sensor and flushing (and refreshing) it to get its log_id costs a round trip per row,
+plus one per error_log_details row. A Journal instead keeps the rows of a stage until flush(), which inserts every
+error_log row with one INSERT ... RETURNING log_id and every error_log_details row with one more INSERT.
+
+flush() does not commit, so the rows belong to the transaction of the stage, as the orm rows did:
+rows flushed with readings are rolled back with them if the insertion fails, and the failure rows are then
+recorded in a new Journal, flushed and committed after the rollback.
+"""
+from sqlalchemy import text
+
+
+# rows are inserted in the order they were recorded; log_id is a serial, so the log_ids are increasing in that order
+INSERT_ERROR_LOG = """
+    INSERT INTO error_log (purpose_id, datetime, was_success, error_type, pipeline_stage)
+    SELECT purpose_id, datetime, was_success, error_type, pipeline_stage
+    FROM unnest(CAST(:purpose_ids AS INTEGER[]), CAST(:datetimes AS TIMESTAMP[]), CAST(:was_successes AS BOOLEAN[]),
+                CAST(:error_types AS VARCHAR[]), CAST(:pipeline_stages AS pipelinestageenum[])) WITH ORDINALITY
+        AS journal_row (purpose_id, datetime, was_success, error_type, pipeline_stage, row_number)
+    ORDER BY row_number
+    RETURNING log_id
+"""
+INSERT_ERROR_LOG_DETAILS = """
+    INSERT INTO error_log_details (log_id, information_type, information_value)
+    SELECT * FROM unnest(CAST(:log_ids AS INTEGER[]), CAST(:information_types AS VARCHAR[]), CAST(:information_values AS VARCHAR[]))
+"""
+
+
+class Journal:
+    """
+    The error_log rows recorded by a script run that are not flushed to the database yet
+
+    Each row is a dict of the error_log columns and the dict of its error_log_details information_type: information_value.
+    """
+
+    def __init__(self):
+        self.rows = []
+
+
+    def record(self, purpose_id, datetime, pipeline_stage, was_success=None, error_type=None, details=None):
+        """
+        Add an error_log row with its error_log_details and return the row, whose log_id is set by flush()
+
+        pipeline_stage is an orm.ErrorLog.PipelineStageEnum. Detail values are stored as strings.
+        """
+        row = {'purpose_id': purpose_id, 'datetime': datetime, 'was_success': was_success, 'error_type': error_type,
+               'pipeline_stage': pipeline_stage.name, 'details': details or {}, 'log_id': None}
+        self.rows.append(row)
+        return row
+
+
+    def flush(self, conn):
+        """
+        Insert the recorded rows into error_log and error_log_details and forget them
+
+        Nothing is committed. Returns the log_ids of the rows in the order they were recorded
+        """
+        rows, self.rows = self.rows, []
+        if not rows:
+            return []
+        log_ids = sorted(log_id for log_id, in conn.execute(text(INSERT_ERROR_LOG), {
+            'purpose_ids': [row['purpose_id'] for row in rows],
+            'datetimes': [row['datetime'] for row in rows],
+            'was_successes': [row['was_success'] for row in rows],
+            'error_types': [row['error_type'] for row in rows],
+            'pipeline_stages': [row['pipeline_stage'] for row in rows]}))
+        details = {'log_ids': [], 'information_types': [], 'information_values': []}
+        for row, log_id in zip(rows, log_ids):
+            row['log_id'] = log_id
+            for information_type, information_value in row['details'].items():
+                details['log_ids'].append(log_id)
+                details['information_types'].append(information_type)
+                details['information_values'].append(None if information_value is None else str(information_value))
+        if details['log_ids']:
+            conn.execute(text(INSERT_ERROR_LOG_DETAILS), details)
+        return log_ids
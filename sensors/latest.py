@@ -0,0 +1,120 @@
+"""
+This module maintains the reading_latest table of the latest reading of each purpose
+
+Usage (from the project folder):
+    python3 sensors/latest.py rebuild
+    python3 sensors/latest.py show [--building <building>] [--room <room>]
+
+sensors/loader.py calls update_latest() with the range of datetimes it inserted for each purpose, in the same transaction
+as the readings, so reading_latest is current as soon as the readings are committed. A purpose's row is only replaced
+by a later reading, so backfilled readings older than the latest reading do not change it.
+
+get_latest() returns the latest reading of every purpose of a building or room by primary key lookups in reading_latest,
+so a dashboard of current conditions refreshing every few seconds never reads the reading table.
+
+rebuild fills reading_latest with the latest reading of every purpose in sensor_info. Use it to fill reading_latest
+for readings inserted before it existed. show prints the rows of get_latest().
+"""
+from pathlib import Path
+from sqlalchemy import text
+
+import argparse
+import os
+import sys
+
+sys.path.append(str(Path(os.path.dirname(os.path.realpath(__file__))).parent))
+from sensors import db
+
+
+UPSERT_LATEST = """
+    INSERT INTO reading_latest (purpose_id, datetime, reading, units, upload_timestamp)
+    {select}
+    ON CONFLICT (purpose_id) DO UPDATE SET datetime = excluded.datetime, reading = excluded.reading,
+        units = excluded.units, upload_timestamp = excluded.upload_timestamp
+    WHERE reading_latest.datetime <= excluded.datetime
+"""
+# uses the reading index on (purpose_id, datetime) to read the last readings of each inserted range backwards
+SELECT_FROM_INSERTED_RANGES = """
+    SELECT inserted_range.purpose_id, latest_reading.datetime, latest_reading.reading, latest_reading.units, latest_reading.upload_timestamp
+    FROM unnest(CAST(:purpose_ids AS BIGINT[]), CAST(:first_datetimes AS TIMESTAMP[]), CAST(:last_datetimes AS TIMESTAMP[]))
+        AS inserted_range (purpose_id, first_datetime, last_datetime)
+    CROSS JOIN LATERAL (
+        SELECT datetime, reading, units, upload_timestamp FROM reading
+        WHERE reading.purpose_id = inserted_range.purpose_id
+            AND reading.datetime >= inserted_range.first_datetime AND reading.datetime <= inserted_range.last_datetime
+            AND reading.reading <> 'NaN'
+        ORDER BY reading.datetime DESC LIMIT 1
+    ) latest_reading
+"""
+SELECT_FROM_READING = """
+    SELECT sensor_info.purpose_id, latest_reading.datetime, latest_reading.reading, latest_reading.units, latest_reading.upload_timestamp
+    FROM sensor_info
+    CROSS JOIN LATERAL (
+        SELECT datetime, reading, units, upload_timestamp FROM reading
+        WHERE reading.purpose_id = sensor_info.purpose_id AND reading.reading <> 'NaN'
+        ORDER BY reading.datetime DESC LIMIT 1
+    ) latest_reading
+"""
+# a NULL building or room matches every building or room
+SELECT_LATEST = """
+    SELECT sensor_info.purpose_id, sensor_info.building, sensor_info.room, sensor_info.variable_name, sensor_info.type,
+        reading_latest.datetime, reading_latest.reading, reading_latest.units, reading_latest.upload_timestamp
+    FROM sensor_info JOIN reading_latest ON reading_latest.purpose_id = sensor_info.purpose_id
+    WHERE (CAST(:building AS VARCHAR) IS NULL OR sensor_info.building = :building)
+        AND (CAST(:room AS VARCHAR) IS NULL OR sensor_info.room = :room)
+    ORDER BY sensor_info.purpose_id
+"""
+
+
+def update_latest(conn, inserted_ranges):
+    """
+    Replace the latest reading of each purpose with the last reading inserted between its first and last datetime, if it is later
+
+    inserted_ranges is a dict of purpose_id: (first datetime, last datetime) with naive datetimes like reading.datetime.
+    Nothing is committed. Returns the number of reading_latest rows written
+    """
+    if not inserted_ranges:
+        return 0
+    purpose_ids = sorted(inserted_ranges)
+    return conn.execute(text(UPSERT_LATEST.format(select=SELECT_FROM_INSERTED_RANGES)), {
+        'purpose_ids': purpose_ids,
+        'first_datetimes': [inserted_ranges[purpose_id][0] for purpose_id in purpose_ids],
+        'last_datetimes': [inserted_ranges[purpose_id][1] for purpose_id in purpose_ids]}).rowcount
+
+
+def rebuild_latest(conn):
+    """
+    Write the latest reading of every purpose in sensor_info from the reading table
+
+    Nothing is committed. Returns the number of reading_latest rows written
+    """
+    return conn.execute(text(UPSERT_LATEST.format(select=SELECT_FROM_READING))).rowcount
+
+
+def get_latest(conn, building=None, room=None):
+    """
+    Return the latest reading of every purpose of building and room (or of every building or room if they are None) as rows of
+    (purpose_id, building, room, variable_name, type, datetime, reading, units, upload_timestamp) sorted by purpose_id
+    """
+    return conn.execute(text(SELECT_LATEST), {'building': building, 'room': room}).fetchall()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintain and show the latest reading of each purpose')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    subparsers.add_parser('rebuild', help='fill reading_latest from the reading table')
+    show_parser = subparsers.add_parser('show', help='print the latest readings of a building or room')
+    show_parser.add_argument('--building', help='only show the purposes of this building')
+    show_parser.add_argument('--room', help='only show the purposes of this room')
+    args = parser.parse_args()
+
+    conn = db.get_sessionmaker()()
+    if args.command == 'rebuild':
+        rows = rebuild_latest(conn)
+        conn.commit()
+        print(__file__ + ': wrote ' + str(rows) + ' latest readings')
+    else:
+        for row in get_latest(conn, args.building, args.room):
+            print('\t'.join('' if value is None else str(value) for value in row))
+    conn.close()
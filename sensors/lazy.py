@@ -0,0 +1,48 @@
+"""
+This module imports heavy modules like pandas lazily, so scripts only pay for importing them when they use them
+
+    pandas = lazy.lazy_import('pandas')
+
+returns a module object right away; pandas is imported the first time one of its attributes is used.
+A cron run that finds no sensors due or no new csv files, or that only prints --help, never imports pandas.
+
+The first use may happen in several worker threads at once (e.g. the egauge requests), so the import is done under a lock
+and the attributes are only set once it has finished. importlib.util.LazyLoader is not used since before Python 3.12
+a thread using a module while another thread imports it sees the module without its attributes.
+"""
+import importlib
+import importlib.util
+import sys
+import threading
+import types
+
+
+# one lock for every lazy module, since importing one module may use another lazy module
+import_lock = threading.RLock()
+
+
+class LazyModule(types.ModuleType):
+    """
+    A module that imports the module it is named after the first time one of its attributes is used, from any thread
+    """
+
+    def __getattr__(self, name):
+        # only called for attributes that are not set, i.e. until the module is imported
+        with import_lock:
+            module = importlib.import_module(self.__name__)
+            # copy the attributes of the imported module, so later uses are plain attribute lookups
+            self.__dict__.update(module.__dict__)
+        return getattr(module, name)
+
+
+def lazy_import(module_name):
+    """
+    Return module_name, which is only imported when one of its attributes is first used
+
+    A module that was already imported is returned as is
+    """
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    if importlib.util.find_spec(module_name) is None:
+        raise ModuleNotFoundError('No module named ' + module_name, name=module_name)
+    return LazyModule(module_name)
@@ -0,0 +1,116 @@
+"""
+This module bulk loads reading frames (see sensors.reshape) into the reading table
+
+Rows are streamed into a temporary staging table with COPY FROM STDIN and then merged into reading with
+INSERT ... ON CONFLICT (datetime, purpose_id) DO NOTHING, so readings that are already in the table
+(e.g. from overlapping request windows) are skipped instead of aborting the whole transaction.
+Each row is written with its error_log log_id, so callers insert their error_log rows first instead of
+updating log_id on the reading table afterwards.
+The rollup buckets (see sensors.rollup), the latest reading (see sensors.latest) and the count of inserted readings
+in reading_insert_count (see sensors.matview) of each purpose are updated in the same transaction.
+"""
+from io import StringIO
+from sensors import latest, lazy, rollup
+from sqlalchemy import text
+
+import collections.abc
+
+pandas = lazy.lazy_import('pandas')
+
+
+STAGING_TABLE = 'reading_staging'
+# number of reading frame rows sent with each COPY
+BATCH_SIZE = 100000
+# COPY reads this unquoted string as NULL; the default (an empty string) is ambiguous with NaN handling below
+COPY_NULL = '\\N'
+
+# datetimes are staged as timestamptz so timezone-aware datetimes are converted to the session time zone
+# the same way the database driver converts them when inserting rows one by one
+CREATE_STAGING_TABLE = """
+    CREATE TEMPORARY TABLE IF NOT EXISTS {staging_table} (
+        datetime TIMESTAMPTZ,
+        purpose_id BIGINT,
+        units VARCHAR(255),
+        reading DOUBLE PRECISION,
+        log_id INTEGER
+    ) ON COMMIT DROP
+"""
+COPY_TO_STAGING_TABLE = """
+    COPY {staging_table} (datetime, purpose_id, units, reading, log_id) FROM STDIN WITH (FORMAT csv, NULL '{null}')
+"""
+# returns the number and datetime range of the readings inserted for each purpose
+MERGE_STAGING_TABLE = """
+    WITH inserted AS (
+        INSERT INTO reading (datetime, purpose_id, units, reading, upload_timestamp, log_id)
+        SELECT datetime, purpose_id, units, reading, %(upload_timestamp)s, log_id FROM {staging_table}
+        ON CONFLICT (datetime, purpose_id) DO NOTHING
+        RETURNING purpose_id, datetime
+    )
+    SELECT purpose_id, count(*), min(datetime), max(datetime) FROM inserted GROUP BY purpose_id
+"""
+# purposes are locked in order of purpose_id, so two loads of the same purposes cannot deadlock
+UPSERT_INSERT_COUNTS = """
+    INSERT INTO reading_insert_count (purpose_id, inserted_rows)
+    SELECT * FROM unnest(CAST(:purpose_ids AS BIGINT[]), CAST(:inserted_rows AS BIGINT[])) ORDER BY 1
+    ON CONFLICT (purpose_id) DO UPDATE SET inserted_rows = reading_insert_count.inserted_rows + excluded.inserted_rows
+"""
+
+
+def copy_readings(conn, reading_frame, upload_timestamp, log_ids=None, batch_size=BATCH_SIZE):
+    """
+    Insert the rows of reading_frame into the reading table within the current transaction of session conn
+
+    Every row gets the same upload_timestamp.
+    log_ids is either one log_id for every row, or a mapping of purpose_id to the log_id of its rows.
+    Rows whose (datetime, purpose_id) is already in the reading table are skipped.
+    The rollups of the inserted rows are updated with sensors.rollup.update_rollups(),
+    the latest reading of their purposes with sensors.latest.update_latest(), and their counts in reading_insert_count.
+    Nothing is committed; the caller commits or rolls back the session as before.
+
+    Returns a dict of the number of rows inserted for each purpose_id with inserted rows
+    """
+    if reading_frame.empty:
+        return {}
+    # use the session's own connection so the load is part of the session's transaction
+    cursor = conn.connection().connection.cursor()
+    rows_inserted = {}
+    # purpose_id: (first datetime, last datetime) of the inserted rows
+    inserted_ranges = {}
+    try:
+        cursor.execute(CREATE_STAGING_TABLE.format(staging_table=STAGING_TABLE))
+        for start in range(0, reading_frame.shape[0], batch_size):
+            batch = reading_frame.iloc[start:start + batch_size]
+            if isinstance(log_ids, collections.abc.Mapping):
+                batch_log_ids = batch['purpose_id'].map(log_ids)
+                if batch_log_ids.isna().any():
+                    raise ValueError('No log_id for purpose_id(s) ' + str(sorted(set(batch.loc[batch_log_ids.isna(), 'purpose_id']))))
+                batch_log_ids = batch_log_ids.astype('int64')
+            else:
+                batch_log_ids = COPY_NULL if log_ids is None else int(log_ids)
+            copy_frame = pandas.DataFrame({'datetime': batch['datetime'],
+                                           'purpose_id': batch['purpose_id'],
+                                           'units': batch['units'].fillna(COPY_NULL),
+                                           'reading': batch['reading'],
+                                           'log_id': batch_log_ids})
+            buffer = StringIO()
+            # write missing readings as NaN, which is how they were inserted before
+            copy_frame.to_csv(buffer, header=False, index=False, na_rep='NaN')
+            buffer.seek(0)
+            cursor.copy_expert(COPY_TO_STAGING_TABLE.format(staging_table=STAGING_TABLE, null=COPY_NULL), buffer)
+            cursor.execute(MERGE_STAGING_TABLE.format(staging_table=STAGING_TABLE), {'upload_timestamp': upload_timestamp})
+            for purpose_id, rows, first_datetime, last_datetime in cursor.fetchall():
+                rows_inserted[purpose_id] = rows_inserted.get(purpose_id, 0) + rows
+                if purpose_id in inserted_ranges:
+                    first_datetime = min(first_datetime, inserted_ranges[purpose_id][0])
+                    last_datetime = max(last_datetime, inserted_ranges[purpose_id][1])
+                inserted_ranges[purpose_id] = (first_datetime, last_datetime)
+            cursor.execute('TRUNCATE ' + STAGING_TABLE)
+    finally:
+        cursor.close()
+    rollup.update_rollups(conn, inserted_ranges)
+    latest.update_latest(conn, inserted_ranges)
+    if rows_inserted:
+        purpose_ids = sorted(rows_inserted)
+        conn.execute(text(UPSERT_INSERT_COUNTS), {'purpose_ids': purpose_ids,
+                                                  'inserted_rows': [rows_inserted[purpose_id] for purpose_id in purpose_ids]})
+    return rows_inserted
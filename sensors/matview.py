@@ -0,0 +1,397 @@
+"""
+This module reads the dependencies between the views in sql_views and keeps the views marked as materialized up to date
+
+Usage (from the project folder):
+    python3 sensors/matview.py check
+    python3 sensors/matview.py materialize
+    python3 sensors/matview.py refresh [--force]
+
+A view is marked as materialized by a comment in its sql file, next to its [used by ...] comment:
+    -- [materialized unique (datetime_5min, purpose_id, units)]
+The unique columns identify each row of the view; a unique index on them lets the view be refreshed CONCURRENTLY,
+so dashboards keep reading the previous rows during a refresh. A view marked without unique columns is locked while it refreshes.
+
+The dependencies are the views each view selects from (FROM or JOIN), read from its sql rather than from its [used by ...]
+comments, which are written by hand. check prints every view after the views it selects from (topological order)
+and the [used by ...] comments that do not match the sql.
+
+materialize makes the database match the markers: it replaces each marked plain view with a materialized view and each
+unmarked materialized view with a plain view. Views that select from a replaced view are dropped and created again
+from their sql files, with their privileges, in topological order. Everything runs in one transaction.
+
+refresh refreshes the materialized views in topological order, so a view is refreshed after the views it selects from.
+A view is only refreshed if readings of the sensors it reads were inserted since its last refresh, or if a view
+it selects from was refreshed. sensors.loader counts the readings inserted for each sensor in reading_insert_count,
+including backfilled readings older than its last_updated_datetime; the count a view was refreshed through
+is recorded in the comment of the view. It is run by init_crontab.py
+and sensors/daemon.py. --force refreshes every materialized view.
+
+The sensors a view reads are the purpose_ids its sql and the sql of the views it selects from filter the reading tables on,
+e.g. WHERE reading.purpose_id = ANY (ARRAY[84, 85]). A reading table read without such a filter before the next FROM,
+or a view that reads neither a reading table nor another view, makes the view depend on every sensor.
+"""
+from pathlib import Path
+from sqlalchemy import text
+
+import argparse
+import collections
+import glob
+import os
+import re
+import sys
+
+sys.path.append(str(Path(os.path.dirname(os.path.realpath(__file__))).parent))
+from sensors import db
+
+
+SQL_VIEWS_PATH = str(Path(os.path.dirname(os.path.realpath(__file__))).parent) + '/sql_views'
+# matches the name and select of a sql_views file, e.g. CREATE VIEW kat."dashboard-hvac" AS SELECT ...
+CREATE_VIEW_PATTERN = re.compile(r'CREATE\s+(?:OR\s+REPLACE\s+)?VIEW\s+((?:\w+\.)?(?:"[^"]+"|\w+))\s+AS\s+(.*?);?\s*$',
+                                 re.IGNORECASE | re.DOTALL)
+USED_BY_PATTERN = re.compile(r'\[used by\s+([^\]]*)\]', re.IGNORECASE)
+MATERIALIZED_PATTERN = re.compile(r'\[materialized(?:\s+unique\s*\(([^)]*)\))?\]', re.IGNORECASE)
+# a table or view a select reads, e.g. FROM kat."dashboard-readings-neg" or JOIN reading
+RELATION_PATTERN = re.compile(r'\b(?:FROM|JOIN)\s+((?:\w+\.)?(?:"[^"]+"|\w+))', re.IGNORECASE)
+# a filter on literal purpose_ids, e.g. reading.purpose_id = ANY (ARRAY[84::bigint, 85::bigint]), purpose_id IN (84, 85) or purpose_id = 84
+PURPOSE_ID_FILTER_PATTERN = re.compile(r'\bpurpose_id\s*(?:=\s*ANY\s*\(\s*ARRAY\s*\[([^\]]*)\]|IN\s*\(([^)]*)\)|=\s*(\d+)\b)', re.IGNORECASE)
+FROM_PATTERN = re.compile(r'\bFROM\b', re.IGNORECASE)
+# the tables whose rows are readings of a purpose
+READING_TABLES = {('public', 'reading'), ('public', 'reading_rollup'), ('public', 'reading_latest')}
+# the comment of a materialized view, which records the count of inserted readings of its sensors it was refreshed through
+COMMENT_PREFIX = 'refreshed through '
+
+# the number of readings inserted for purpose_ids, or for every sensor if purpose_ids is NULL
+SELECT_WATERMARK = """
+    SELECT coalesce(sum(inserted_rows), 0) FROM reading_insert_count
+    WHERE CAST(:purpose_ids AS INTEGER[]) IS NULL OR purpose_id = ANY(CAST(:purpose_ids AS INTEGER[]))
+"""
+SELECT_RELKIND = """
+    SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)
+"""
+SELECT_COMMENT = """
+    SELECT obj_description(to_regclass(:name), 'pg_class')
+"""
+SELECT_HAS_UNIQUE_INDEX = """
+    SELECT EXISTS (SELECT FROM pg_index WHERE indrelid = to_regclass(:name) AND indisunique)
+"""
+# the privileges granted on a view to roles other than its owner
+SELECT_PRIVILEGES = """
+    SELECT privilege.privilege_type, CASE WHEN privilege.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(privilege.grantee)) END
+    FROM pg_class, aclexplode(pg_class.relacl) privilege
+    WHERE pg_class.oid = to_regclass(:name) AND privilege.grantee <> pg_class.relowner
+"""
+
+# a view of sql_views; used_by is the list of names in its [used by ...] comment, unique_columns is None if it is not materialized
+SqlView = collections.namedtuple('SqlView', ['name', 'select', 'sql_filename', 'used_by', 'unique_columns'])
+
+
+def read_view(sql_filename):
+    """
+    Return the (view name, select) of the CREATE VIEW statement in sql_filename, without its comments
+
+    raises a ValueError if the file does not contain a CREATE VIEW statement
+    """
+    with open(sql_filename, 'r') as file:
+        sql = '\n'.join(line for line in file.read().splitlines() if not line.lstrip().startswith('--'))
+    match = CREATE_VIEW_PATTERN.search(sql)
+    if not match:
+        raise ValueError('No CREATE VIEW statement found in ' + sql_filename)
+    return match.group(1), match.group(2).strip()
+
+
+def read_sql_view(sql_filename):
+    """
+    Return the SqlView of sql_filename, with the [used by ...] and [materialized ...] comments of its header
+    """
+    with open(sql_filename, 'r') as file:
+        # a [used by ...] comment can continue on the next comment lines
+        comments = ' '.join(line.lstrip()[2:].strip() for line in file.read().splitlines() if line.lstrip().startswith('--'))
+    used_by = []
+    used_by_match = USED_BY_PATTERN.search(comments)
+    if used_by_match and used_by_match.group(1).strip() != 'NA':
+        used_by = [name.strip() for name in re.split(r',|\band\b', used_by_match.group(1)) if name.strip()]
+    unique_columns = None
+    materialized_match = MATERIALIZED_PATTERN.search(comments)
+    if materialized_match:
+        unique_columns = [column.strip() for column in (materialized_match.group(1) or '').split(',') if column.strip()]
+    return SqlView(*read_view(sql_filename), sql_filename, used_by, unique_columns)
+
+
+def get_key(name):
+    """
+    Return the (schema, name) of a view name as written in sql, e.g. ('kat', 'dashboard-hvac') for kat."dashboard-hvac"
+
+    Unquoted names are folded to lower case and unqualified names are in the public schema, like in PostgreSQL
+    """
+    match = re.fullmatch(r'(?:(\w+)\.)?(?:"([^"]+)"|(\w+))', name.strip())
+    if not match:
+        raise ValueError('Not a view name: ' + name)
+    schema, quoted_name, unquoted_name = match.groups()
+    return (schema or 'public').lower(), quoted_name if quoted_name is not None else unquoted_name.lower()
+
+
+def build_dag(sql_views):
+    """
+    Return a dictionary of the key of each of sql_views: set of the keys of the views in sql_views that it selects from
+    """
+    keys = {get_key(sql_view.name) for sql_view in sql_views}
+    upstream = {}
+    for sql_view in sql_views:
+        key = get_key(sql_view.name)
+        upstream[key] = {get_key(relation) for relation in RELATION_PATTERN.findall(sql_view.select)} & keys - {key}
+    return upstream
+
+
+def get_purpose_ids(select):
+    """
+    Return the set of purpose_ids select reads from the reading tables, an empty set if it reads no reading table,
+    or None if it reads a reading table without a filter on literal purpose_ids
+
+    The filter of a reading table is looked for between it and the next FROM, e.g. in its JOIN and WHERE clauses
+    """
+    purpose_ids = set()
+    for relation_match in RELATION_PATTERN.finditer(select):
+        if get_key(relation_match.group(1)) not in READING_TABLES:
+            continue
+        next_from_match = FROM_PATTERN.search(select, relation_match.end())
+        clauses = select[relation_match.end():next_from_match.start() if next_from_match else len(select)]
+        filters = PURPOSE_ID_FILTER_PATTERN.findall(clauses)
+        if not filters:
+            return None
+        for purpose_id_list in filters:
+            purpose_ids.update(int(purpose_id) for purpose_id in re.findall(r'\b\d+\b', ''.join(purpose_id_list)))
+    return purpose_ids
+
+
+def get_view_purpose_ids(sql_views, upstream):
+    """
+    Return a dictionary of the key of each of sql_views: set of the purpose_ids it reads, directly or through the views
+    it selects from, or None if it depends on every sensor
+    """
+    view_purpose_ids = {}
+    for key in get_topological_order(upstream):
+        purpose_ids = get_purpose_ids(sql_views[key].select)
+        if purpose_ids == set() and not upstream[key]:
+            # reads neither readings nor other views, so nothing tells which sensors it depends on
+            purpose_ids = None
+        for upstream_key in upstream[key]:
+            if purpose_ids is None or view_purpose_ids[upstream_key] is None:
+                purpose_ids = None
+            else:
+                purpose_ids |= view_purpose_ids[upstream_key]
+        view_purpose_ids[key] = purpose_ids
+    return view_purpose_ids
+
+
+def get_watermark(conn, purpose_ids):
+    """
+    Return the number of readings inserted for purpose_ids, or for every sensor if purpose_ids is None
+    """
+    return conn.execute(text(SELECT_WATERMARK), {'purpose_ids': None if purpose_ids is None else sorted(purpose_ids)}).scalar()
+
+
+def get_topological_order(upstream):
+    """
+    Return the keys of upstream with every key after the keys it selects from, in alphabetical order otherwise
+
+    raises a ValueError if views select from each other in a cycle
+    """
+    order = []
+    remaining = {key: set(upstream_keys) for key, upstream_keys in upstream.items()}
+    while remaining:
+        ready = sorted(key for key, upstream_keys in remaining.items() if not upstream_keys)
+        if not ready:
+            raise ValueError('views select from each other in a cycle: ' + str(sorted(remaining)))
+        order.extend(ready)
+        for key in ready:
+            del remaining[key]
+        for upstream_keys in remaining.values():
+            upstream_keys.difference_update(ready)
+    return order
+
+
+def get_downstream(upstream, keys):
+    """
+    Return the keys of every view that selects from any of keys, directly or through other views
+    """
+    downstream = set()
+    pending = set(keys)
+    while pending:
+        pending = {key for key, upstream_keys in upstream.items() if upstream_keys & pending} - downstream
+        downstream.update(pending)
+    return downstream
+
+
+def check_used_by(sql_views, upstream):
+    """
+    Return a message for every view whose [used by ...] comment differs from the views that select from it in sql_views
+
+    Names in comments are compared without their schema, since most comments leave it out
+    """
+    messages = []
+    for sql_view in sorted(sql_views, key=lambda sql_view: get_key(sql_view.name)):
+        key = get_key(sql_view.name)
+        selected_by = {downstream_key[1] for downstream_key, upstream_keys in upstream.items() if key in upstream_keys}
+        commented = {name.split('.')[-1].strip('"') for name in sql_view.used_by}
+        if selected_by - commented:
+            messages.append(sql_view.name + ' is used by ' + str(sorted(selected_by - commented)) + ', missing from its [used by] comment')
+        if commented - selected_by:
+            messages.append(sql_view.name + ' is not used by ' + str(sorted(commented - selected_by)) + ' in sql_views')
+    return messages
+
+
+def read_sql_views(sql_filenames=None):
+    """
+    Return the SqlView of each of sql_filenames (default: every file in sql_views) by key
+    """
+    sql_views = [read_sql_view(sql_filename) for sql_filename in sorted(sql_filenames or glob.glob(SQL_VIEWS_PATH + '/*.sql'))]
+    return {get_key(sql_view.name): sql_view for sql_view in sql_views}
+
+
+def get_relkind(conn, name):
+    """
+    Return 'v' if name is a view, 'm' if it is a materialized view, another pg_class.relkind or None if it does not exist
+    """
+    return conn.execute(text(SELECT_RELKIND), {'name': name}).scalar()
+
+
+def create_view(conn, sql_view, watermark):
+    """
+    Create sql_view as a materialized view, with a unique index on its unique columns, if it is marked as materialized,
+    or else as a plain view
+    """
+    if sql_view.unique_columns is None:
+        conn.execute(text('CREATE VIEW ' + sql_view.name + ' AS ' + sql_view.select.replace(':', '\\:')))
+        return
+    conn.execute(text('CREATE MATERIALIZED VIEW ' + sql_view.name + ' AS ' + sql_view.select.replace(':', '\\:')))
+    if sql_view.unique_columns:
+        index_name = '"' + get_key(sql_view.name)[1][:52] + '_unique_idx"'
+        conn.execute(text('CREATE UNIQUE INDEX ' + index_name + ' ON ' + sql_view.name + ' (' + ', '.join(sql_view.unique_columns) + ')'))
+    set_watermark(conn, sql_view.name, watermark)
+
+
+def set_watermark(conn, name, watermark):
+    """
+    Record in the comment of the materialized view name that it was refreshed through watermark
+    """
+    conn.execute(text('COMMENT ON MATERIALIZED VIEW ' + name + ' IS \'' + COMMENT_PREFIX + str(watermark) + '\''))
+
+
+def materialize_views(conn, sql_views):
+    """
+    Replace the plain views of the sql_views marked as materialized with materialized views, and the unmarked materialized
+    views with plain views, dropping and creating again the views that select from them
+
+    Nothing is committed. Returns the names of the replaced views and the names of the views created again
+    """
+    upstream = build_dag(list(sql_views.values()))
+    replaced_keys = set()
+    relkinds = {}
+    for key, sql_view in sql_views.items():
+        relkinds[key] = get_relkind(conn, sql_view.name)
+        if relkinds[key] in ('v', 'm') and (relkinds[key] == 'm') != (sql_view.unique_columns is not None):
+            replaced_keys.add(key)
+    # views that do not exist in the database are left out; a view outside sql_views that selects from a replaced view stops the drop
+    recreated_keys = {key for key in get_downstream(upstream, replaced_keys) if relkinds[key] in ('v', 'm')} - replaced_keys
+    order = [key for key in get_topological_order(upstream) if key in replaced_keys | recreated_keys]
+    view_purpose_ids = get_view_purpose_ids(sql_views, upstream)
+    privileges = {key: conn.execute(text(SELECT_PRIVILEGES), {'name': sql_views[key].name}).fetchall() for key in order}
+    for key in reversed(order):
+        conn.execute(text('DROP ' + ('MATERIALIZED VIEW ' if relkinds[key] == 'm' else 'VIEW ') + sql_views[key].name))
+    for key in order:
+        create_view(conn, sql_views[key], get_watermark(conn, view_purpose_ids[key]))
+        for privilege_type, grantee in privileges[key]:
+            conn.execute(text('GRANT ' + privilege_type + ' ON ' + sql_views[key].name + ' TO ' + grantee))
+    return ([sql_views[key].name for key in order if key in replaced_keys],
+            [sql_views[key].name for key in order if key in recreated_keys])
+
+
+def get_stored_watermark(conn, name):
+    """
+    Return the count of inserted readings the materialized view name was refreshed through, as recorded in its comment, or None
+    """
+    comment = conn.execute(text(SELECT_COMMENT), {'name': name}).scalar()
+    if not comment or not comment.startswith(COMMENT_PREFIX):
+        return None
+    return comment[len(COMMENT_PREFIX):]
+
+
+def refresh_views(conn, sql_views, force=False):
+    """
+    Refresh the materialized views of sql_views in topological order if readings of the sensors they read were inserted
+    since their last refresh, if a view they select from was refreshed, or if force is set
+
+    Views marked as materialized that are plain views in the database are left for materialize_views().
+    Each refresh is committed. Returns the names of the refreshed views
+    """
+    upstream = build_dag(list(sql_views.values()))
+    view_purpose_ids = get_view_purpose_ids(sql_views, upstream)
+    # the watermarks are read before any refresh, so readings inserted during a refresh are picked up by the next one
+    watermarks = {key: get_watermark(conn, view_purpose_ids[key]) for key, sql_view in sql_views.items() if sql_view.unique_columns is not None}
+    conn.commit()
+    refreshed_keys = set()
+    refreshed_views = []
+    for key in get_topological_order(upstream):
+        sql_view = sql_views[key]
+        # plain views between two materialized views pass on that the view they select from was refreshed
+        upstream_refreshed = bool(upstream[key] & refreshed_keys)
+        if get_relkind(conn, sql_view.name) != 'm':
+            if upstream_refreshed:
+                refreshed_keys.add(key)
+            continue
+        # a materialized view that is no longer marked is left for materialize_views(), and refreshed through every sensor until then
+        watermark = watermarks[key] if key in watermarks else get_watermark(conn, view_purpose_ids[key])
+        if not (force or upstream_refreshed or get_stored_watermark(conn, sql_view.name) != str(watermark)):
+            continue
+        # CONCURRENTLY needs a unique index
+        if conn.execute(text(SELECT_HAS_UNIQUE_INDEX), {'name': sql_view.name}).scalar():
+            conn.execute(text('REFRESH MATERIALIZED VIEW CONCURRENTLY ' + sql_view.name))
+        else:
+            conn.execute(text('REFRESH MATERIALIZED VIEW ' + sql_view.name))
+        set_watermark(conn, sql_view.name, watermark)
+        conn.commit()
+        refreshed_keys.add(key)
+        refreshed_views.append(sql_view.name)
+    return refreshed_views
+
+
+def print_dag(sql_views):
+    """
+    Print every view of sql_views after the views it selects from, and the [used by ...] comments that do not match the sql
+    """
+    upstream = build_dag(list(sql_views.values()))
+    for key in get_topological_order(upstream):
+        sql_view = sql_views[key]
+        line = sql_view.name
+        if sql_view.unique_columns is not None:
+            line += ' (materialized)'
+        if upstream[key]:
+            line += ' <- ' + ', '.join(sql_views[upstream_key].name for upstream_key in sorted(upstream[key]))
+        print(line)
+    print()
+    for message in check_used_by(list(sql_views.values()), upstream):
+        print(message)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the dependencies of the views in sql_views and refresh the materialized ones')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    subparsers.add_parser('check', help='print the views in topological order and the [used by] comments that do not match the sql')
+    subparsers.add_parser('materialize', help='create the views marked as materialized as materialized views')
+    refresh_parser = subparsers.add_parser('refresh', help='refresh the materialized views whose sensors were updated')
+    refresh_parser.add_argument('--force', action='store_true', help='refresh every materialized view')
+    args = parser.parse_args()
+    sql_views = read_sql_views()
+    if args.command == 'check':
+        print_dag(sql_views)
+        sys.exit(0)
+
+    conn = db.get_sessionmaker()()
+    if args.command == 'materialize':
+        replaced_views, recreated_views = materialize_views(conn, sql_views)
+        conn.commit()
+        print(__file__ + ': replaced views ' + str(replaced_views) + ', created again ' + str(recreated_views))
+    else:
+        print(__file__ + ': refreshed views ' + str(refresh_views(conn, sql_views, args.force)))
+    conn.close()
@@ -0,0 +1,219 @@
+"""
+This module records how long each pipeline stage of a script run takes and how many rows and bytes it moves
+
+    run_metrics = metrics.start_run('egauge')
+    with metrics.stage('request'):
+        readings = request_readings(...)
+    metrics.add('request', rows=readings.shape[0], bytes=len(response.content))
+    ...
+    metrics.finish_run(Session)
+
+start_run() sets the metrics of the run in progress in this process, which stage() and add() add to from any thread,
+so functions deep in a script record their stages without being passed the metrics. Outside a run (e.g. in a backfill
+or a test) stage() and add() do nothing. Seconds are summed over the calls of a stage, so a stage run in several threads
+at once, like the egauge requests, can add up to more seconds than the run.
+
+finish_run() inserts a row per stage, plus a "run" row with the seconds of the whole run, into the run_metrics table,
+and writes the stages to <script_folder>.prom in metrics_textfile_dir of config.txt (default the metrics folder of
+the project folder) in the Prometheus text format, for the textfile collector of node_exporter.
+The textfile is replaced by each run, so Prometheus trends the latest run of each script folder.
+"""
+from sqlalchemy import text
+from sensors import db
+
+import collections
+import contextlib
+import logging
+import os
+import pendulum
+import threading
+import time
+import uuid
+
+
+DEFAULT_TEXTFILE_DIR = db.PROJECT_PATH + '/metrics'
+# stage name of the row with the seconds of the whole run
+RUN_STAGE = 'run'
+# (metric name, help, StageMetrics field) of each Prometheus metric written for each stage
+PROMETHEUS_METRICS = (
+    ('sensors_stage_seconds', 'Seconds spent in the stage by the last run, summed over its calls', 'seconds'),
+    ('sensors_stage_calls', 'Number of times the last run entered the stage', 'calls'),
+    ('sensors_stage_rows', 'Rows moved by the stage in the last run', 'rows'),
+    ('sensors_stage_bytes', 'Bytes moved by the stage in the last run', 'bytes'),
+)
+
+INSERT_RUN_METRICS = """
+    INSERT INTO run_metrics (run_id, stage, script_folder, run_datetime, seconds, calls, rows, bytes)
+    SELECT :run_id, stage, :script_folder, :run_datetime, seconds, calls, rows, bytes
+    FROM unnest(CAST(:stages AS VARCHAR[]), CAST(:seconds AS DOUBLE PRECISION[]), CAST(:calls AS INTEGER[]),
+                CAST(:rows AS BIGINT[]), CAST(:bytes AS BIGINT[])) AS stage_metrics (stage, seconds, calls, rows, bytes)
+"""
+
+StageMetrics = collections.namedtuple('StageMetrics', ['seconds', 'calls', 'rows', 'bytes'])
+
+# the metrics of the run in progress in this process, set by start_run()
+run_metrics = None
+# the metrics of the last run finished in this process, whose run_id names its profile (see sensors.profiling)
+last_run_metrics = None
+
+
+class RunMetrics:
+    """
+    The stage timings and counters of one run of the script of script_folder
+
+    run_id identifies the run in run_metrics; run_datetime is when it started, in the same time as error_log.datetime,
+    and run_timestamp the same time as a unix timestamp.
+    """
+
+    def __init__(self, script_folder):
+        self.script_folder = script_folder
+        self.run_id = uuid.uuid4().hex
+        current_time = pendulum.now('Pacific/Honolulu')
+        self.run_timestamp = current_time.timestamp()
+        self.run_datetime = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000)).naive()
+        self.start_time = time.perf_counter()
+        self.seconds = None
+        # stage: StageMetrics, in the order the stages were first recorded
+        self.stages = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+
+    def add(self, stage, seconds=0, calls=0, rows=0, bytes=0):
+        """
+        Add seconds, calls, rows and bytes to stage
+        """
+        with self.lock:
+            stage_metrics = self.stages.get(stage, StageMetrics(0, 0, 0, 0))
+            self.stages[stage] = StageMetrics(stage_metrics.seconds + seconds, stage_metrics.calls + calls,
+                                              stage_metrics.rows + rows, stage_metrics.bytes + bytes)
+
+
+    def finish(self):
+        """
+        Record the seconds of the whole run as the RUN_STAGE stage and return the stages
+        """
+        self.seconds = time.perf_counter() - self.start_time
+        self.add(RUN_STAGE, seconds=self.seconds, calls=1)
+        return self.stages
+
+
+    def write(self, conn):
+        """
+        Insert a row per stage into run_metrics. Nothing is committed
+        """
+        stages = list(self.stages)
+        conn.execute(text(INSERT_RUN_METRICS), {
+            'run_id': self.run_id, 'script_folder': self.script_folder, 'run_datetime': self.run_datetime,
+            'stages': stages,
+            'seconds': [self.stages[stage].seconds for stage in stages],
+            'calls': [self.stages[stage].calls for stage in stages],
+            'rows': [self.stages[stage].rows for stage in stages],
+            'bytes': [self.stages[stage].bytes for stage in stages]})
+
+
+    def format_textfile(self):
+        """
+        Return the stages in the Prometheus text format, labelled with the script folder and stage
+        """
+        lines = []
+        for metric_name, metric_help, field in PROMETHEUS_METRICS:
+            lines.append('# HELP ' + metric_name + ' ' + metric_help)
+            lines.append('# TYPE ' + metric_name + ' gauge')
+            for stage, stage_metrics in self.stages.items():
+                lines.append('{}{{script_folder="{}",stage="{}"}} {}'.format(metric_name, self.script_folder, stage,
+                                                                             repr(float(getattr(stage_metrics, field)))))
+        lines.append('# HELP sensors_run_timestamp_seconds Unix time the last run started')
+        lines.append('# TYPE sensors_run_timestamp_seconds gauge')
+        lines.append('sensors_run_timestamp_seconds{{script_folder="{}"}} {}'.format(self.script_folder, repr(self.run_timestamp)))
+        return '\n'.join(lines) + '\n'
+
+
+    def write_textfile(self, textfile_dir):
+        """
+        Write the stages to <script_folder>.prom in textfile_dir, replacing the file of the previous run at once,
+        so the collector never reads a partly written file
+        """
+        os.makedirs(textfile_dir, exist_ok=True)
+        textfile_path = textfile_dir + '/' + self.script_folder + '.prom'
+        with open(textfile_path + '.tmp', 'w') as file:
+            file.write(self.format_textfile())
+        os.replace(textfile_path + '.tmp', textfile_path)
+
+
+def start_run(script_folder):
+    """
+    Start recording the metrics of a run of the script of script_folder in this process and return them
+    """
+    global run_metrics
+    run_metrics = RunMetrics(script_folder)
+    return run_metrics
+
+
+@contextlib.contextmanager
+def stage(stage_name):
+    """
+    Add the seconds spent in the with block, and one call, to stage_name of the run in progress, even if the block raises
+    """
+    current_run_metrics = run_metrics
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        if current_run_metrics:
+            current_run_metrics.add(stage_name, seconds=time.perf_counter() - start_time, calls=1)
+
+
+def add(stage_name, seconds=0, calls=0, rows=0, bytes=0):
+    """
+    Add seconds, calls, rows and bytes to stage_name of the run in progress, if there is one
+    """
+    current_run_metrics = run_metrics
+    if current_run_metrics:
+        current_run_metrics.add(stage_name, seconds, calls, rows, bytes)
+
+
+def count_bytes(stage_name, chunks):
+    """
+    Yield each of chunks (e.g. from requests' iter_content) and add its length to the bytes of stage_name
+    """
+    for chunk in chunks:
+        add(stage_name, bytes=len(chunk))
+        yield chunk
+
+
+def get_textfile_dir():
+    """
+    Return metrics_textfile_dir of config.txt, or DEFAULT_TEXTFILE_DIR if it is not set
+    """
+    try:
+        return db.read_config().get('metrics_textfile_dir', DEFAULT_TEXTFILE_DIR)
+    except OSError:
+        return DEFAULT_TEXTFILE_DIR
+
+
+def finish_run(Session):
+    """
+    Finish the run in progress, insert its metrics into run_metrics with a session created with Session,
+    and write its Prometheus textfile
+
+    Exceptions are logged, since the readings of the run are already committed. Returns the metrics of the run
+    """
+    global run_metrics, last_run_metrics
+    finished_run_metrics, run_metrics = run_metrics, None
+    if not finished_run_metrics:
+        return None
+    last_run_metrics = finished_run_metrics
+    finished_run_metrics.finish()
+    conn = Session()
+    try:
+        finished_run_metrics.write(conn)
+        conn.commit()
+    except Exception:
+        logging.exception('finish_run: run_metrics')
+    finally:
+        conn.close()
+    try:
+        finished_run_metrics.write_textfile(get_textfile_dir())
+    except Exception:
+        logging.exception('finish_run: textfile')
+    return finished_run_metrics
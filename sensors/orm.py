@@ -0,0 +1,494 @@
+"""
+This module defines classes for the postgresql tables that store database insertion success and readings
+and functions relating to those tables
+
+The egauge, webctrl and hobo scripts, init_database.py, init_crontab.py and the sensors modules all use these classes.
+"""
+from sqlalchemy import event
+from sqlalchemy import DDL
+from sqlalchemy import BigInteger, Boolean, Column, Date, Index, Integer, String
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION, JSONB, TIMESTAMP
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.sql import func, text
+from sqlalchemy.schema import ForeignKey
+from sqlalchemy.types import Enum
+from sensors import db
+
+import enum
+
+
+# needs to be in the same scope as all ORM table classes because they are subclasses of declarative_base class
+BASE = declarative_base()
+
+
+class Project(BASE):
+    """
+    This class represents the project table
+
+    Columns:
+        project_folder_path: the full path of the folder where a project's files and folders are stored
+    """
+    __tablename__ = 'project'
+
+    project_folder_path = Column(String, primary_key=True)
+
+
+class Reading(BASE):
+    """
+    This class represents the readings table
+
+    The table contains data read by the sensor for given units of time (usually minutes)
+
+    Columns:
+        datetime: the reading's datetime
+        purpose_id: unique id representing a purpose
+        value: the numerical value of a reading
+
+    The table is partitioned by month of datetime (see sensors/partition.py), so queries that filter on datetime
+    only read the partitions of the months they need. Readings without a monthly partition go to reading_default.
+    """
+    __tablename__ = 'reading'
+    __table_args__ = (
+        # readings are inserted in about datetime order, so a brin index of each block range's datetimes
+        # finds a time range with an index a fraction of the size of a b-tree
+        Index('reading_datetime_brin', 'datetime', postgresql_using='brin'),
+        # views select the readings of a few purpose_ids over a time range
+        Index('reading_purpose_id_datetime_idx', 'purpose_id', 'datetime'),
+        {'postgresql_partition_by': 'RANGE (datetime)'},
+    )
+
+    # postgres cannot alter the type of a partition key column, so the timestamp(6) that init_database.py casts the other
+    # timestamp columns to is declared here, before reading and its monthly partitions exist
+    datetime = Column(TIMESTAMP(precision=6), primary_key=True)
+    purpose_id = Column(BigInteger, ForeignKey('sensor_info.purpose_id'), primary_key=True)
+    units = Column(String(length=255), nullable=False)
+    reading = Column(DOUBLE_PRECISION, nullable=False)
+    upload_timestamp = Column(TIMESTAMP, default=func.now(), nullable=False)
+    # not a foreign key: log_id is not unique in the partitioned error_log on its own,
+    # and the success rows readings were inserted with are deleted once they are summarized in error_log_summary
+    log_id = Column(Integer)
+
+
+# a partitioned table stores no rows itself, so create the partition for readings outside every monthly partition with it
+event.listen(Reading.__table__, 'after_create', DDL('CREATE TABLE reading_default PARTITION OF reading DEFAULT'))
+
+
+class SensorInfo(BASE):
+    """
+    Sources of readings
+
+    Columns:
+        purpose_id: uniquely identifies a purpose
+        query_string: string used in egauge and webctrl API requests; hobo sensor serial number; one query_string may have multiple purposes (egauge)
+        data_sensor_info_mapping: matches full column name in raw data (egauge api data, hobo csv's, etc)
+        type: string that represents one column name in data from a sensor if one row of data has multiple readings
+        script_folder: string representing source of readings; e.g. egauge, webctrl, hobo
+        is_active: boolean representing if script can request data from a sensor
+        last_updated_datetime: used to keep track of datetime of last successfully inserted reading
+        unit: unit of readings
+    """
+    __tablename__ = 'sensor_info'
+
+    class ScriptFolderEnum(enum.Enum):
+        """
+        This class defines strings that could be inserted into sensor_info.sensor_type
+        """
+        egauge = "egauge"
+        hobo = "hobo"
+        webctrl = "webctrl"
+
+    purpose_id = Column(Integer, primary_key=True)
+    building = Column(String(length=50))
+    variable_name = Column(String(length=50))
+    unit = Column(String(length=20))
+    type = Column(String(length=50))
+    appliance = Column(String(length=30))
+    room = Column(String(length=30))
+    surface = Column(String(length=50))
+    sample_resolution = Column(String(length=20))
+    query_string = Column(String(length=255))
+    note = Column(String(length=255))
+    data_sensor_info_mapping = Column(String)
+    script_folder = Column(Enum(ScriptFolderEnum))
+    is_active = Column(Boolean)
+    last_updated_datetime = Column(TIMESTAMP)
+
+
+class ErrorLog(BASE):
+    """
+    This class represents the error_log table
+
+    This table is the "historian" of the database and should help the entire team troubleshoot problem.
+    While it is not an oracle of all errors, it should help narrow down the problem space.
+
+    2 new rows will be added to this table for each purpose every time the script runs.
+    Success rows older than a week are compacted into error_log_summary by sensors/errorlog.py; failures are kept.
+
+    Columns:
+        log_id: uniquely identifies a row
+        purpose_id: unique id representing a purpose
+        datetime: when an api request or a reading insertion was attempted
+        was_success: boolean representing if api script ran successfully or not
+        error_type: name of python exception caught; should remain empty if no exception was caught
+        pipeline_stage: the stage of the api script execution when an error_log row was inserted
+
+    The table is partitioned by month of datetime like reading (see sensors/partition.py), so the rows of old months
+    can be dropped with their partition (see sensors/errorlog.py drop). Rows without a monthly partition go to error_log_default.
+    """
+    __tablename__ = 'error_log'
+    __table_args__ = (
+        # finds the latest row of a purpose and pipeline_stage, e.g. when a sensor's readings were last inserted
+        Index('error_log_purpose_id_pipeline_stage_datetime_idx', 'purpose_id', 'pipeline_stage', 'datetime'),
+        # rows are inserted in datetime order, so a brin index finds the rows of a day to compact
+        Index('error_log_datetime_brin', 'datetime', postgresql_using='brin'),
+        # troubleshooting reads the failures of a purpose, which are a small part of the table
+        Index('error_log_failure_purpose_id_datetime_idx', 'purpose_id', 'datetime',
+              postgresql_where=text('was_success IS NOT TRUE')),
+        {'postgresql_partition_by': 'RANGE (datetime)'},
+    )
+
+    class PipelineStageEnum(enum.Enum):
+        """
+        This class defines strings that could be inserted into error_log.pipeline_stage
+
+        Each string represents at what stage of the api script execution an error_log row was inserted
+            data_acquisition: obtaining readings from source
+            database_insertion: inserting new rows into readings table
+        """
+        data_acquisition = "data_acquisition"
+        database_insertion = "database_insertion"
+
+    # the primary key of a partitioned table must include the partition key, datetime;
+    # log_id is still a serial, so it is unique on its own
+    log_id = Column(Integer, primary_key=True, autoincrement=True)
+    purpose_id = Column(Integer)
+    datetime = Column(TIMESTAMP(precision=6), primary_key=True)
+    was_success = Column(Boolean)
+    error_type = Column(String)
+    pipeline_stage = Column(Enum(PipelineStageEnum))
+
+    # def __repr__(self):
+    #     return "<ErrorLog(id='%s', timestamp='%s, is_success='%s')>" % (
+    #                          self.id, self.timestamp, self.is_success)
+
+
+# a partitioned table stores no rows itself, so create the partition for rows outside every monthly partition with it
+event.listen(ErrorLog.__table__, 'after_create', DDL('CREATE TABLE error_log_default PARTITION OF error_log DEFAULT'))
+
+
+class ErrorLogSummary(BASE):
+    """
+    This class represents the error_log_summary table written by sensors/errorlog.py
+
+    Each row summarizes the error_log rows of a purpose and pipeline_stage on one day, so the success rows of the day
+    can be deleted. Failures stay in error_log until their month is dropped.
+
+    Columns:
+        purpose_id: unique id representing a purpose
+        day: the day of the error_log rows, in the same time as error_log.datetime
+        pipeline_stage: the stage of the api script execution the rows were inserted at
+        success_count: number of success rows and rows whose was_success is NULL, which are deleted from error_log
+        failure_count: number of failure rows, which are kept in error_log
+        error_type_counts: number of failure rows of each error_type, e.g. {"ConnectionError": 3}
+        first_datetime: datetime of the first row of the day
+        last_datetime: datetime of the last row of the day
+    """
+    __tablename__ = 'error_log_summary'
+
+    purpose_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    pipeline_stage = Column(Enum(ErrorLog.PipelineStageEnum), primary_key=True)
+    success_count = Column(Integer, default=0, nullable=False)
+    failure_count = Column(Integer, default=0, nullable=False)
+    error_type_counts = Column(JSONB, nullable=False)
+    first_datetime = Column(TIMESTAMP)
+    last_datetime = Column(TIMESTAMP)
+
+
+class ErrorLogDetails(BASE):
+    """
+    This class represents the error_log_details table that houses any extra info needed to troubleshoot script problems.
+
+    error_log_details is a long-form table.
+    It is currently used with hobo scripts to store fields like filename, first and last reading timestamps,
+    as one hobo has multiple files, with potentially repeated names.
+    """
+    __tablename__ = 'error_log_details'
+
+    log_id = Column(Integer, primary_key=True)
+    information_type = Column(String, primary_key=True)
+    information_value = Column(String)
+
+
+class CsvFileManifest(BASE):
+    """
+    This class represents the csv_file_manifest table
+
+    The table records each hobo csv file that was processed, so files that are already processed can be skipped
+    without being parsed again.
+
+    Columns:
+        content_hash: sha256 hex digest of the file contents
+        file_size: size of the file in bytes
+        modified_datetime: modification time of the file
+        csv_filename: path of the file when it was processed
+        outcome: result of processing the file
+        query_string: hobo sensor serial number found in the file
+        earliest_reading_datetime: datetime of the earliest reading in the file
+        latest_reading_datetime: datetime of the latest reading in the file
+        rows_inserted: number of rows inserted into the reading table from the file
+        processed_datetime: when the file was processed
+    """
+    __tablename__ = 'csv_file_manifest'
+
+    class OutcomeEnum(enum.Enum):
+        """
+        This class defines strings that could be inserted into csv_file_manifest.outcome
+
+            inserted: readings from the file were inserted
+            already_inserted: readings from the file were already in the reading table
+            failed: the file could not be read or inserted; it is processed again by the next run
+        """
+        inserted = "inserted"
+        already_inserted = "already_inserted"
+        failed = "failed"
+
+    content_hash = Column(String(length=64), primary_key=True)
+    file_size = Column(BigInteger, primary_key=True)
+    modified_datetime = Column(TIMESTAMP, primary_key=True)
+    csv_filename = Column(String)
+    outcome = Column(Enum(OutcomeEnum))
+    query_string = Column(String(length=255))
+    earliest_reading_datetime = Column(TIMESTAMP)
+    latest_reading_datetime = Column(TIMESTAMP)
+    rows_inserted = Column(Integer)
+    processed_datetime = Column(TIMESTAMP)
+
+
+class PollSchedule(BASE):
+    """
+    This class represents the poll_schedule table used by sensors/schedule.py
+
+    The table contains when each sensor is next due to be polled by its script
+
+    Columns:
+        purpose_id: unique id representing a purpose
+        last_poll_datetime: when the sensor was last polled
+        next_poll_datetime: the sensor is skipped by its script until this datetime
+        empty_polls: number of consecutive polls that returned no new readings or failed
+    """
+    __tablename__ = 'poll_schedule'
+
+    purpose_id = Column(Integer, ForeignKey('sensor_info.purpose_id'), primary_key=True)
+    last_poll_datetime = Column(TIMESTAMP)
+    next_poll_datetime = Column(TIMESTAMP)
+    empty_polls = Column(Integer, default=0, nullable=False)
+
+
+class ReadingGap(BASE):
+    """
+    This class represents the reading_gap table written by sensors/gaps.py
+
+    The table contains intervals where the readings of a purpose are further apart than its expected sample resolution
+
+    Columns:
+        purpose_id: unique id representing a purpose
+        gap_start: datetime of the last reading before the gap
+        gap_end: datetime of the first reading after the gap
+        expected_seconds: expected seconds between readings, from sample_resolution or the observed cadence
+        status: whether the gap still needs to be backfilled
+        attempts: number of times the gap was backfilled
+        detected_datetime: when the gap was found
+        last_attempt_datetime: when the gap was last backfilled
+        claimed_datetime: when a run of sensors/gaps.py started backfilling the gap; null once the outcome is recorded
+    """
+    __tablename__ = 'reading_gap'
+
+    class GapStatusEnum(enum.Enum):
+        """
+        This class defines strings that could be inserted into reading_gap.status
+
+            open: the gap has not been backfilled yet
+            backfilled: readings in the gap were requested again and inserted (the source may still have had none)
+            failed: the last backfill of the gap failed; it is retried by the planner
+        """
+        open = "open"
+        backfilled = "backfilled"
+        failed = "failed"
+
+    purpose_id = Column(Integer, ForeignKey('sensor_info.purpose_id'), primary_key=True)
+    gap_start = Column(TIMESTAMP, primary_key=True)
+    gap_end = Column(TIMESTAMP, nullable=False)
+    expected_seconds = Column(DOUBLE_PRECISION)
+    status = Column(Enum(GapStatusEnum), nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    detected_datetime = Column(TIMESTAMP)
+    last_attempt_datetime = Column(TIMESTAMP)
+    claimed_datetime = Column(TIMESTAMP)
+
+
+class GapCheckpoint(BASE):
+    """
+    This class represents the gap_checkpoint table written by sensors/gaps.py
+
+    Columns:
+        purpose_id: unique id representing a purpose
+        checked_through_datetime: datetime of the latest reading already checked for gaps
+        cadence_seconds: median seconds between the readings checked by the last run
+    """
+    __tablename__ = 'gap_checkpoint'
+
+    purpose_id = Column(Integer, ForeignKey('sensor_info.purpose_id'), primary_key=True)
+    checked_through_datetime = Column(TIMESTAMP)
+    cadence_seconds = Column(DOUBLE_PRECISION)
+
+
+class ReadingRollup(BASE):
+    """
+    This class represents the reading_rollup table maintained by sensors/rollup.py
+
+    Each row aggregates the readings of a purpose over one bucket of 5 minutes, an hour or a day,
+    so dashboards can read a row per bucket instead of every reading. Missing readings (NaN) are not counted.
+
+    Columns:
+        purpose_id: unique id representing a purpose
+        bucket_seconds: length of the bucket in seconds (300, 3600 or 86400)
+        bucket: datetime the bucket starts at
+        reading_count: number of readings in the bucket
+        reading_sum, reading_min, reading_max: sum, minimum and maximum of the readings in the bucket
+        first_datetime, first_reading: datetime and value of the first reading in the bucket
+        last_datetime, last_reading: datetime and value of the last reading in the bucket
+    """
+    __tablename__ = 'reading_rollup'
+
+    purpose_id = Column(BigInteger, ForeignKey('sensor_info.purpose_id'), primary_key=True)
+    bucket_seconds = Column(Integer, primary_key=True)
+    bucket = Column(TIMESTAMP, primary_key=True)
+    reading_count = Column(Integer, nullable=False)
+    reading_sum = Column(DOUBLE_PRECISION, nullable=False)
+    reading_min = Column(DOUBLE_PRECISION, nullable=False)
+    reading_max = Column(DOUBLE_PRECISION, nullable=False)
+    first_datetime = Column(TIMESTAMP, nullable=False)
+    first_reading = Column(DOUBLE_PRECISION, nullable=False)
+    last_datetime = Column(TIMESTAMP, nullable=False)
+    last_reading = Column(DOUBLE_PRECISION, nullable=False)
+
+
+class ReadingLatest(BASE):
+    """
+    This class represents the reading_latest table maintained by sensors/latest.py
+
+    The table contains the latest reading of each purpose, so dashboards showing current conditions read one row
+    per purpose instead of finding max(datetime) in the reading table. Missing readings (NaN) are not kept.
+
+    Columns:
+        purpose_id: unique id representing a purpose
+        datetime: datetime of the latest reading
+        reading: the numerical value of the latest reading
+        units: units of the latest reading
+        upload_timestamp: when the latest reading was inserted
+    """
+    __tablename__ = 'reading_latest'
+
+    purpose_id = Column(BigInteger, ForeignKey('sensor_info.purpose_id'), primary_key=True)
+    datetime = Column(TIMESTAMP(precision=6), nullable=False)
+    reading = Column(DOUBLE_PRECISION, nullable=False)
+    units = Column(String(length=255))
+    upload_timestamp = Column(TIMESTAMP(precision=6))
+
+
+class BackfillCheckpoint(BASE):
+    """
+    This class represents the backfill_checkpoint table written by sensors/backfill.py
+
+    The table records how far a backfill from a given start was committed, so a backfill that stopped resumes after
+    its last committed chunk instead of at its start. Rows are deleted once their backfill is complete.
+
+    Columns:
+        purpose_id: unique id representing a purpose
+        range_start: HST datetime the backfill started from
+        backfilled_through: HST datetime every chunk before which was committed
+    """
+    __tablename__ = 'backfill_checkpoint'
+
+    purpose_id = Column(Integer, ForeignKey('sensor_info.purpose_id'), primary_key=True)
+    range_start = Column(TIMESTAMP, primary_key=True)
+    backfilled_through = Column(TIMESTAMP, nullable=False)
+
+
+class ReadingInsertCount(BASE):
+    """
+    This class represents the reading_insert_count table maintained by sensors/loader.py
+
+    The table counts the readings inserted for each purpose, including readings older than its latest reading
+    (e.g. from a backfill), so sensors/matview.py can tell which materialized views read sensors with new readings.
+
+    Columns:
+        purpose_id: unique id representing a purpose
+        inserted_rows: number of readings of the purpose inserted by sensors.loader.copy_readings()
+    """
+    __tablename__ = 'reading_insert_count'
+
+    purpose_id = Column(BigInteger, ForeignKey('sensor_info.purpose_id'), primary_key=True)
+    inserted_rows = Column(BigInteger, nullable=False)
+
+
+class RunMetric(BASE):
+    """
+    This class represents the run_metrics table written by sensors/metrics.py
+
+    Each row contains the time spent in one pipeline stage of a script run and the rows and bytes the stage moved,
+    so the latency and throughput of each script folder can be trended. The "run" stage has the seconds of the whole run.
+
+    Columns:
+        run_id: uniquely identifies a script run
+        stage: name of the pipeline stage, e.g. request, reshape, copy
+        script_folder: the script folder of the script that ran
+        run_datetime: when the run started
+        seconds: seconds spent in the stage, summed over its calls
+        calls: number of times the run entered the stage
+        rows: number of rows the stage read or wrote
+        bytes: number of bytes the stage read
+    """
+    __tablename__ = 'run_metrics'
+    __table_args__ = (
+        # trends read the runs of a script folder over a time range
+        Index('run_metrics_script_folder_run_datetime_idx', 'script_folder', 'run_datetime'),
+    )
+
+    run_id = Column(String(length=32), primary_key=True)
+    stage = Column(String(length=50), primary_key=True)
+    script_folder = Column(Enum(SensorInfo.ScriptFolderEnum), nullable=False)
+    run_datetime = Column(TIMESTAMP, nullable=False)
+    seconds = Column(DOUBLE_PRECISION, nullable=False)
+    calls = Column(Integer, nullable=False)
+    rows = Column(BigInteger, nullable=False)
+    bytes = Column(BigInteger, nullable=False)
+
+
+class ApiAuthentication(BASE):
+    """
+    User info for authentication
+
+    Used when connecting to api's like webctrl
+    """
+    __tablename__ = 'api_authentication'
+
+    user_id = Column(Integer, primary_key=True)
+    script_folder = Column(Enum(SensorInfo.ScriptFolderEnum))
+    username = Column(String)
+    password = Column(String)
+
+
+def setup():
+    """
+    Use defined classes to create tables in the database named in config file
+    """
+    BASE.metadata.create_all(db.get_engine())
+
+
+def teardown():
+    """
+    Drop all tables in the database named in config file
+    """
+    BASE.metadata.drop_all(db.get_engine())
@@ -0,0 +1,448 @@
+"""
+This module manages the monthly partitions of the reading and error_log tables
+
+Usage (from the project folder):
+    python3 sensors/partition.py ensure [--months-ahead <months>]
+    python3 sensors/partition.py migrate [--batch-days <days>] [--months-ahead <months>]
+    python3 sensors/partition.py archive --before <YYYY-MM> [--schema <schema>] [--table <table>]
+
+orm.setup() creates reading partitioned by range of datetime, with a reading_default partition for readings
+outside every monthly partition. Each month is stored in its own partition named reading_y<year>m<month>
+(e.g. reading_y2019m02), so a query that filters on datetime, like most views in sql_views, only reads the partitions
+of the months it needs (partition pruning).
+
+ensure creates the partitions of the current month and the next --months-ahead months, and of any month that has readings
+in reading_default, moving those readings into their new partition. It is run by init_database.py, init_crontab.py
+and sensors/daemon.py, so the partitions of new readings exist before the readings arrive.
+error_log is partitioned the same way, with partitions named error_log_y<year>m<month> and error_log_default,
+once it is partitioned by orm.setup() or by sensors/errorlog.py migrate; ensure creates its partitions too.
+
+migrate converts a reading table created before partitioning, while the scripts keep inserting readings:
+    1. create reading_partitioned with the columns, primary key, foreign keys and indexes of reading, and a partition for every month
+       that has readings, and a trigger that writes the key of every reading inserted into reading from then on to reading_migration_delta
+    2. copy reading into reading_partitioned --batch-days of readings at a time, committing after each batch.
+       If the migration stops, running it again resumes after the last copied readings
+    3. copy the readings in reading_migration_delta, i.e. those inserted since the migration started
+    4. lock reading against inserts (selects still run), copy the few readings inserted since step 3 the same way,
+       rename reading to reading_unpartitioned and reading_partitioned to reading, and point the views that select
+       from reading at the new table. Views keep their owner, privileges and dependent views
+reading_unpartitioned is kept; drop it once the migrated table has been checked.
+
+archive detaches the partitions of every month before --before from reading (or --table) and moves them to --schema (default archive).
+Detaching only changes the catalog, so it does not read or rewrite any readings. An archived partition can be dumped
+with pg_dump -t, dropped, or attached again with
+    ALTER TABLE reading ATTACH PARTITION archive.reading_y2019m02 FOR VALUES FROM ('2019-02-01') TO ('2019-03-01')
+"""
+from pathlib import Path
+from sqlalchemy import text
+
+import argparse
+import os
+import pendulum
+import re
+import sys
+
+sys.path.append(str(Path(os.path.dirname(os.path.realpath(__file__))).parent))
+from sensors import db
+
+
+TABLE = 'reading'
+# the tables partitioned by month of datetime, whose partitions ensure creates
+PARTITIONED_TABLES = ('reading', 'error_log')
+DEFAULT_PARTITION_SUFFIX = '_default'
+# a table being migrated is named <table>_partitioned, and its partitions are named after <table>
+MIGRATION_SUFFIX = '_partitioned'
+MIGRATION_TABLE = TABLE + MIGRATION_SUFFIX
+UNPARTITIONED_TABLE = 'reading_unpartitioned'
+# the keys of the readings inserted into TABLE during a migration, written by the trigger DELTA_TRIGGER
+DELTA_TABLE = TABLE + '_migration_delta'
+DELTA_TRIGGER = TABLE + '_migration_capture'
+ARCHIVE_SCHEMA = 'archive'
+# months of partitions created ahead of the current month
+MONTHS_AHEAD = 3
+DEFAULT_BATCH_DAYS = 7
+PARTITION_NAME_PATTERN = re.compile(r'(\w+)_y(\d{4})m(\d{2})')
+
+SELECT_RELKIND = """
+    SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)
+"""
+SELECT_PARTITIONS = """
+    SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE pg_inherits.inhparent = to_regclass(:table)
+"""
+SELECT_DEFAULT_MONTHS = """
+    SELECT DISTINCT date_trunc('month', datetime) FROM {default_partition}
+"""
+CREATE_PARTITION = """
+    CREATE TABLE {partition} (LIKE {table} INCLUDING DEFAULTS)
+"""
+# readings of the month inserted while it had no partition are in the default partition,
+# which must not have any of them when the partition is attached
+MOVE_FROM_DEFAULT_PARTITION = """
+    WITH moved AS (DELETE FROM {default_partition} WHERE datetime >= :month_start AND datetime < :month_end RETURNING *)
+    INSERT INTO {partition} SELECT * FROM moved
+"""
+ATTACH_PARTITION = """
+    ALTER TABLE {table} ATTACH PARTITION {partition} FOR VALUES FROM ('{month_start}') TO ('{month_end}')
+"""
+CREATE_MIGRATION_TABLE = """
+    CREATE TABLE {migration_table} (LIKE {table} INCLUDING DEFAULTS) PARTITION BY RANGE (datetime)
+"""
+# the months that have readings, found with one primary key lookup per month instead of reading the whole table
+SELECT_MONTHS = """
+    WITH RECURSIVE months (month) AS (
+        SELECT date_trunc('month', min(datetime)) FROM {table}
+        UNION ALL
+        SELECT (SELECT date_trunc('month', min(datetime)) FROM {table} WHERE datetime >= month + interval '1 month')
+        FROM months WHERE month IS NOT NULL
+    )
+    SELECT month FROM months WHERE month IS NOT NULL
+"""
+SELECT_CONSTRAINTS = """
+    SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+    WHERE conrelid = to_regclass(:table) AND contype IN ('p', 'f') ORDER BY contype DESC, conname
+"""
+# the indexes that do not belong to a primary key or other constraint
+SELECT_INDEXES = """
+    SELECT index_class.relname, pg_index.indisunique, pg_get_indexdef(pg_index.indexrelid) FROM pg_index
+    JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid
+    WHERE pg_index.indrelid = to_regclass(:table)
+        AND NOT EXISTS (SELECT FROM pg_constraint WHERE conrelid = pg_index.indrelid AND conindid = pg_index.indexrelid)
+    ORDER BY index_class.relname
+"""
+# views (and rules) whose definition selects from the table directly
+SELECT_DEPENDENT_VIEWS = """
+    SELECT DISTINCT view.oid::regclass::text, view.relkind, pg_get_viewdef(view.oid)
+    FROM pg_depend JOIN pg_rewrite ON pg_rewrite.oid = pg_depend.objid JOIN pg_class view ON view.oid = pg_rewrite.ev_class
+    WHERE pg_depend.classid = 'pg_rewrite'::regclass AND pg_depend.refobjid = to_regclass(:table) AND view.oid <> to_regclass(:table)
+"""
+COPY_BATCH = """
+    INSERT INTO {migration_table} SELECT * FROM {table} WHERE datetime >= :batch_start AND datetime < :batch_end
+    ON CONFLICT (datetime, purpose_id) DO NOTHING
+"""
+CREATE_DELTA_TABLE = """
+    CREATE TABLE {delta_table} AS SELECT datetime, purpose_id FROM {table} WITH NO DATA
+"""
+# one insert per statement, so a COPY of many readings costs one insert of their keys
+CREATE_DELTA_FUNCTION = """
+    CREATE FUNCTION {trigger}() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO {delta_table} (datetime, purpose_id) SELECT datetime, purpose_id FROM inserted;
+        RETURN NULL;
+    END
+    $$
+"""
+CREATE_DELTA_TRIGGER = """
+    CREATE TRIGGER {trigger} AFTER INSERT ON {table} REFERENCING NEW TABLE AS inserted
+    FOR EACH STATEMENT EXECUTE PROCEDURE {trigger}()
+"""
+# looks up each captured reading by the primary key of TABLE instead of scanning it; a reading inserted during a batch
+# is captured and also copied by the batch, so conflicts are skipped
+COPY_DELTA = """
+    WITH delta AS (DELETE FROM {delta_table} RETURNING datetime, purpose_id)
+    INSERT INTO {migration_table} SELECT {table}.* FROM {table} JOIN (SELECT DISTINCT datetime, purpose_id FROM delta) delta_keys USING (datetime, purpose_id)
+    ON CONFLICT (datetime, purpose_id) DO NOTHING
+"""
+
+
+def get_new_name(name, table, new_table):
+    """
+    Return name (of a constraint or index of table) with table replaced by new_table, e.g. reading_pkey -> reading_partitioned_pkey
+    """
+    if name.startswith(table + '_'):
+        return new_table + name[len(table):]
+    return new_table + '_' + name
+
+
+def get_base_name(table):
+    """
+    Return the name table has once it is migrated, e.g. reading for reading_partitioned, which its partitions are named after
+    """
+    if table.endswith(MIGRATION_SUFFIX):
+        return table[:-len(MIGRATION_SUFFIX)]
+    return table
+
+
+def get_partition_name(month, table=TABLE):
+    """
+    Return the name of the partition of table for the month of month (a pendulum datetime), e.g. reading_y2019m02
+    """
+    return '{}_y{:04d}m{:02d}'.format(get_base_name(table), month.year, month.month)
+
+
+def get_default_partition(table=TABLE):
+    """
+    Return the name of the partition of table for rows outside every monthly partition, e.g. reading_default
+    """
+    return get_base_name(table) + DEFAULT_PARTITION_SUFFIX
+
+
+def is_partitioned(conn, table=TABLE):
+    """
+    Return True if table is a partitioned table
+    """
+    return conn.execute(text(SELECT_RELKIND), {'table': table}).scalar() == 'p'
+
+
+def get_partition_names(conn, table=TABLE):
+    """
+    Return the sorted names of the partitions attached to table, including the default partition
+    """
+    return sorted(row[0] for row in conn.execute(text(SELECT_PARTITIONS), {'table': table}))
+
+
+def create_partition(conn, month, table=TABLE):
+    """
+    Create the partition of the month of month (a pendulum datetime) and attach it to table
+
+    Rows of the month in the default partition are moved to the new partition. Nothing is committed.
+    Returns the name of the partition
+    """
+    partition = get_partition_name(month, table)
+    default_partition = get_default_partition(table)
+    month_start = month.start_of('month').naive()
+    month_end = month_start.add(months=1)
+    # the partition is filled before it is attached, so its rows are never visible twice or not at all
+    conn.execute(text(CREATE_PARTITION.format(partition=partition, table=table)))
+    if default_partition in get_partition_names(conn, table):
+        conn.execute(text(MOVE_FROM_DEFAULT_PARTITION.format(default_partition=default_partition, partition=partition)),
+                     {'month_start': month_start, 'month_end': month_end})
+    conn.execute(text(ATTACH_PARTITION.format(table=table, partition=partition, month_start=month_start.to_date_string(),
+                                              month_end=month_end.to_date_string())))
+    return partition
+
+
+def ensure_partitions(conn, months_ahead=MONTHS_AHEAD, table=TABLE, current_time=None):
+    """
+    Create the missing partitions of table for the current month, the next months_ahead months,
+    and every month with rows in the default partition
+
+    Does nothing if table is not partitioned. Nothing is committed. Returns the names of the new partitions
+    """
+    if not is_partitioned(conn, table):
+        return []
+    current_month = (current_time or pendulum.now('Pacific/Honolulu')).naive().start_of('month')
+    months = [current_month.add(months=months) for months in range(months_ahead + 1)]
+    partition_names = get_partition_names(conn, table)
+    if get_default_partition(table) in partition_names:
+        default_months = conn.execute(text(SELECT_DEFAULT_MONTHS.format(default_partition=get_default_partition(table))))
+        months += [pendulum.instance(row[0]).naive() for row in default_months]
+    new_partitions = []
+    for month in sorted(months):
+        if get_partition_name(month, table) not in partition_names + new_partitions:
+            new_partitions.append(create_partition(conn, month, table))
+    return new_partitions
+
+
+def ensure_all_partitions(conn, months_ahead=MONTHS_AHEAD, current_time=None):
+    """
+    Create the missing partitions of each of PARTITIONED_TABLES that is partitioned with ensure_partitions()
+
+    Nothing is committed. Returns the names of the new partitions
+    """
+    new_partitions = []
+    for table in PARTITIONED_TABLES:
+        new_partitions += ensure_partitions(conn, months_ahead, table, current_time)
+    return new_partitions
+
+
+def archive_partitions(conn, before, schema=ARCHIVE_SCHEMA, table=TABLE):
+    """
+    Detach the partitions of every month before the month of before (a pendulum datetime) from table and move them to schema
+
+    Nothing is committed. Returns the names of the archived partitions
+    """
+    archived_partitions = []
+    for partition in get_partition_names(conn, table):
+        partition_match = PARTITION_NAME_PATTERN.fullmatch(partition)
+        if partition_match and partition_match.group(1) == table and partition < get_partition_name(before, table):
+            conn.execute(text('CREATE SCHEMA IF NOT EXISTS ' + schema))
+            conn.execute(text('ALTER TABLE ' + table + ' DETACH PARTITION ' + partition))
+            conn.execute(text('ALTER TABLE ' + partition + ' SET SCHEMA ' + schema))
+            archived_partitions.append(partition)
+    return archived_partitions
+
+
+def create_migration_table(conn, months_ahead=MONTHS_AHEAD):
+    """
+    Create MIGRATION_TABLE partitioned by month with the columns, primary key, foreign keys and indexes of the unpartitioned TABLE,
+    a partition for every month with readings in TABLE and for the next months_ahead months, and the default partition
+
+    DELTA_TRIGGER writes the key of every reading inserted into TABLE from the commit on to DELTA_TABLE. Nothing is committed.
+    """
+    conn.execute(text(CREATE_MIGRATION_TABLE.format(migration_table=MIGRATION_TABLE, table=TABLE)))
+    conn.execute(text(CREATE_DELTA_TABLE.format(delta_table=DELTA_TABLE, table=TABLE)))
+    conn.execute(text(CREATE_DELTA_FUNCTION.format(trigger=DELTA_TRIGGER, delta_table=DELTA_TABLE)))
+    conn.execute(text(CREATE_DELTA_TRIGGER.format(trigger=DELTA_TRIGGER, table=TABLE)))
+    for constraint_name, constraint_definition in conn.execute(text(SELECT_CONSTRAINTS), {'table': TABLE}).fetchall():
+        conn.execute(text('ALTER TABLE ' + MIGRATION_TABLE + ' ADD ' + constraint_definition))
+    for index_name, is_unique, index_definition in conn.execute(text(SELECT_INDEXES), {'table': TABLE}).fetchall():
+        # e.g. CREATE INDEX reading_datetime_brin ON public.reading USING brin (datetime)
+        conn.execute(text('CREATE ' + ('UNIQUE ' if is_unique else '') + 'INDEX ' + get_new_name(index_name, TABLE, MIGRATION_TABLE)
+                          + ' ON ' + MIGRATION_TABLE + ' USING ' + index_definition.split(' USING ', 1)[1]))
+    conn.execute(text('CREATE TABLE ' + get_default_partition(MIGRATION_TABLE) + ' PARTITION OF ' + MIGRATION_TABLE + ' DEFAULT'))
+    months = [pendulum.instance(row[0]).naive() for row in conn.execute(text(SELECT_MONTHS.format(table=TABLE)))]
+    for month in months:
+        create_partition(conn, month, MIGRATION_TABLE)
+    # the partitions of this month and the next months, which are empty unless TABLE has readings in the future
+    ensure_partitions(conn, months_ahead, MIGRATION_TABLE)
+
+
+def copy_batches(conn, batch_days=DEFAULT_BATCH_DAYS):
+    """
+    Copy the readings of TABLE from the latest reading in MIGRATION_TABLE onwards into MIGRATION_TABLE,
+    batch_days at a time, committing after each batch
+
+    Returns the datetime before which every reading of TABLE was copied, or None if TABLE has no readings to copy
+    """
+    copied_through = conn.execute(text('SELECT max(datetime) FROM ' + MIGRATION_TABLE)).scalar()
+    batch_start = conn.execute(text('SELECT min(datetime) FROM ' + TABLE + ' WHERE datetime >= coalesce(:copied_through, \'-infinity\'::timestamp)'),
+                               {'copied_through': copied_through}).scalar()
+    last_datetime = conn.execute(text('SELECT max(datetime) FROM ' + TABLE)).scalar()
+    conn.commit()
+    while batch_start is not None and batch_start <= last_datetime:
+        copied_through = pendulum.instance(batch_start).naive().add(days=batch_days)
+        rows = conn.execute(text(COPY_BATCH.format(migration_table=MIGRATION_TABLE, table=TABLE)),
+                            {'batch_start': batch_start, 'batch_end': copied_through}).rowcount
+        conn.commit()
+        print(__file__ + ': copied ' + str(rows) + ' readings from ' + str(batch_start) + ' to ' + str(copied_through))
+        # skip the batches without readings
+        batch_start = conn.execute(text('SELECT min(datetime) FROM ' + TABLE + ' WHERE datetime >= :copied_through'),
+                                   {'copied_through': copied_through}).scalar()
+    return copied_through
+
+
+def copy_delta(conn):
+    """
+    Copy the readings whose keys are in DELTA_TABLE from TABLE into MIGRATION_TABLE and remove the keys
+
+    Nothing is committed. Returns the number of readings copied
+    """
+    return conn.execute(text(COPY_DELTA.format(delta_table=DELTA_TABLE, migration_table=MIGRATION_TABLE, table=TABLE))).rowcount
+
+
+def get_dependent_views(conn, table):
+    """
+    Return (view name, relkind, definition) of each view that selects from table
+
+    Read the definitions before table is renamed, while they still name table.
+    raises a ValueError if a materialized view selects from table, since it cannot be replaced in place
+    """
+    views = conn.execute(text(SELECT_DEPENDENT_VIEWS), {'table': table}).fetchall()
+    materialized_views = [view_name for view_name, relkind, view_definition in views if relkind == 'm']
+    if materialized_views:
+        raise ValueError('Drop the materialized views ' + str(materialized_views) + ' and create them again after the migration')
+    return views
+
+
+def rename_table(conn, table, new_table):
+    """
+    Rename table to new_table, with the constraints and indexes whose names start with the table name
+
+    Constraint and index names start with the table name, and index names must be unique in the schema,
+    so the names are moved with the table. Nothing is committed.
+    """
+    for constraint_name, constraint_definition in conn.execute(text(SELECT_CONSTRAINTS), {'table': table}).fetchall():
+        if constraint_name.startswith(table + '_'):
+            conn.execute(text('ALTER TABLE ' + table + ' RENAME CONSTRAINT ' + constraint_name + ' TO '
+                              + get_new_name(constraint_name, table, new_table)))
+    for index_name, is_unique, index_definition in conn.execute(text(SELECT_INDEXES), {'table': table}).fetchall():
+        if index_name.startswith(table + '_'):
+            conn.execute(text('ALTER INDEX ' + index_name + ' RENAME TO ' + get_new_name(index_name, table, new_table)))
+    conn.execute(text('ALTER TABLE ' + table + ' RENAME TO ' + new_table))
+
+
+def replace_views(conn, views):
+    """
+    Replace each of views, as returned by get_dependent_views(), with its definition, which selects from the table
+    that now has the name the view selected from. Views keep their owner, privileges and dependent views
+    """
+    for view_name, relkind, view_definition in views:
+        conn.execute(text('CREATE OR REPLACE VIEW ' + view_name + ' AS ' + view_definition.replace(':', '\\:')))
+        print(__file__ + ': replaced view ' + view_name)
+
+
+def swap_tables(conn):
+    """
+    1. lock TABLE against inserts, copy the readings whose keys are still in DELTA_TABLE into MIGRATION_TABLE,
+    and drop DELTA_TRIGGER and DELTA_TABLE
+    2. rename TABLE to UNPARTITIONED_TABLE and MIGRATION_TABLE to TABLE, with their constraints and indexes
+    3. replace the views that select from UNPARTITIONED_TABLE with the same definition, which now selects from TABLE
+
+    raises a ValueError if a materialized view selects from TABLE, since it cannot be replaced in place. Nothing is committed.
+    """
+    conn.execute(text('LOCK TABLE ' + TABLE + ' IN EXCLUSIVE MODE'))
+    rows = copy_delta(conn)
+    print(__file__ + ': copied ' + str(rows) + ' readings inserted while the table was locked')
+    conn.execute(text('DROP TRIGGER ' + DELTA_TRIGGER + ' ON ' + TABLE))
+    conn.execute(text('DROP FUNCTION ' + DELTA_TRIGGER + '()'))
+    conn.execute(text('DROP TABLE ' + DELTA_TABLE))
+    views = get_dependent_views(conn, TABLE)
+    rename_table(conn, TABLE, UNPARTITIONED_TABLE)
+    rename_table(conn, MIGRATION_TABLE, TABLE)
+    replace_views(conn, views)
+
+
+def migrate(Session, batch_days=DEFAULT_BATCH_DAYS, months_ahead=MONTHS_AHEAD):
+    """
+    Convert the unpartitioned TABLE into a partitioned table, resuming a migration that stopped
+
+    Returns False if TABLE is already partitioned
+    """
+    conn = Session()
+    try:
+        if is_partitioned(conn, TABLE):
+            print(__file__ + ': ' + TABLE + ' is already partitioned')
+            return False
+        if not conn.execute(text('SELECT to_regclass(:table)'), {'table': MIGRATION_TABLE}).scalar():
+            create_migration_table(conn, months_ahead)
+            conn.commit()
+            print(__file__ + ': created ' + MIGRATION_TABLE + ' with partitions ' + str(get_partition_names(conn, MIGRATION_TABLE)))
+        copy_batches(conn, batch_days)
+        # most readings inserted during the migration are copied before TABLE is locked
+        rows = copy_delta(conn)
+        conn.commit()
+        print(__file__ + ': copied ' + str(rows) + ' readings inserted during the migration')
+        swap_tables(conn)
+        conn.commit()
+        print(__file__ + ': ' + TABLE + ' is partitioned; drop ' + UNPARTITIONED_TABLE + ' once it has been checked')
+        return True
+    finally:
+        conn.close()
+
+
+def parse_month(month_string):
+    """
+    Parse a --before argument like "2019-02" as the first day of the month
+    """
+    return pendulum.parse(month_string + '-01').naive()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage the monthly partitions of the reading and error_log tables')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    ensure_parser = subparsers.add_parser('ensure', help='create the partitions of this month and the next months of each table')
+    ensure_parser.add_argument('--months-ahead', type=int, default=MONTHS_AHEAD, help='months of partitions after the current month')
+    migrate_parser = subparsers.add_parser('migrate', help='convert an unpartitioned reading table while the scripts keep running')
+    migrate_parser.add_argument('--batch-days', type=float, default=DEFAULT_BATCH_DAYS, help='days of readings copied per transaction')
+    migrate_parser.add_argument('--months-ahead', type=int, default=MONTHS_AHEAD, help='months of partitions after the current month')
+    archive_parser = subparsers.add_parser('archive', help='detach the partitions of old months')
+    archive_parser.add_argument('--before', type=parse_month, required=True, help='archive the months before this YYYY-MM month')
+    archive_parser.add_argument('--schema', default=ARCHIVE_SCHEMA, help='schema the detached partitions are moved to')
+    archive_parser.add_argument('--table', choices=PARTITIONED_TABLES, default=TABLE, help='table whose partitions are archived')
+    args = parser.parse_args()
+
+    Session = db.get_sessionmaker()
+    if args.command == 'migrate':
+        migrate(Session, args.batch_days, args.months_ahead)
+    else:
+        conn = Session()
+        if args.command == 'ensure':
+            partitions = ensure_all_partitions(conn, args.months_ahead)
+            print(__file__ + ': created partitions ' + str(partitions))
+        else:
+            partitions = archive_partitions(conn, args.before, args.schema, args.table)
+            print(__file__ + ': moved partitions ' + str(partitions) + ' to schema ' + args.schema)
+        conn.commit()
+        conn.close()
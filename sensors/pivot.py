@@ -0,0 +1,229 @@
+"""
+This module generates the views in sql_views/pivot, which show the readings of several purposes as columns of one row,
+from the purposes in sensor_info
+
+Usage (from the project folder):
+    python3 sensors/pivot.py refresh [--force] [<spec file> ...]
+    python3 sensors/pivot.py print [<spec file> ...]
+
+Each json file in sql_views/pivot describes one view in place of a hand-written max(CASE WHEN sensor_info.type ...) view
+in sql_views (e.g. sql_views/pivot/view-data-comfort-analysis.json for sql_views/view-data-comfort-analysis.sql):
+    view: name of the view
+    description: comment written at the top of the printed view
+    select: columns of reading or sensor_info before the pivoted columns; the readings are grouped by these columns
+    columns: the pivoted columns, each a dictionary of
+        name: name of the column
+        match: dictionary of sensor_info column: value of the purposes shown in the column.
+               A value containing % is matched like LIKE, other values must be equal.
+               A list of dictionaries adds up the columns of each dictionary, e.g. air handler plus chiller power
+        units: optional reading.units the readings must have
+        expression: optional expression of reading.reading shown in the column (default reading.reading)
+    where: optional condition on reading and sensor_info
+    exclude_purpose_ids: optional purpose_ids left out of every column
+    buildings: optional list of buildings; the view has one select per building, with {building} in match values
+               replaced by the building and a building column in front
+    order_by: optional ORDER BY of the view
+
+The match of each column is resolved to the list of its purpose_ids when the view is generated, so the view selects
+max(reading.reading) FILTER (WHERE reading.purpose_id = ANY (...)) instead of comparing sensor_info strings for every reading
+and every column, and reads only the readings of those purposes with the reading index on (purpose_id, datetime).
+Rows whose pivoted columns would all be NULL are left out.
+
+refresh generates each view and creates or replaces it if its sql changed since it was last created, which is recorded in
+the comment of the view. It is run by init_crontab.py and sensors/daemon.py, so views follow purposes added to or changed
+in sensor_info. --force replaces every view. print prints the sql of each view without changing the database.
+"""
+from pathlib import Path
+from sqlalchemy import text
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+
+sys.path.append(str(Path(os.path.dirname(os.path.realpath(__file__))).parent))
+from sensors import db
+
+
+PIVOT_PATH = str(Path(os.path.dirname(os.path.realpath(__file__))).parent) + '/sql_views/pivot'
+# the comment of a generated view, which records the sql it was created from
+COMMENT_PREFIX = 'generated by sensors/pivot.py from sql with md5 '
+
+SELECT_SENSOR_INFO = """
+    SELECT * FROM sensor_info ORDER BY purpose_id
+"""
+SELECT_COMMENT = """
+    SELECT obj_description(to_regclass(:view_name), 'pg_class')
+"""
+
+
+def read_spec(spec_filename):
+    """
+    Return the dictionary describing a view in the json file spec_filename
+    """
+    with open(spec_filename, 'r') as file:
+        return json.load(file)
+
+
+def match_value(value, pattern):
+    """
+    Return True if the sensor_info value matches pattern, using LIKE if pattern contains %
+    """
+    if value is None:
+        return False
+    if '%' not in pattern:
+        return str(value) == pattern
+    regex = ''.join('.*' if character == '%' else '.' if character == '_' else re.escape(character) for character in pattern)
+    return re.fullmatch(regex, str(value), re.DOTALL) is not None
+
+
+def resolve_purpose_ids(sensor_info_rows, match, building=None, exclude_purpose_ids=()):
+    """
+    Return the sorted purpose_ids of the sensor_info_rows (dictionaries of column: value) matching every column of match
+
+    {building} in match values is replaced by building.
+    raises a ValueError if match refers to a column sensor_info does not have
+    """
+    purpose_ids = []
+    for sensor_info_row in sensor_info_rows:
+        for column, pattern in match.items():
+            if column not in sensor_info_row:
+                raise ValueError('sensor_info has no column ' + column)
+            if not match_value(sensor_info_row[column], pattern.replace('{building}', building or '')):
+                break
+        else:
+            if sensor_info_row['purpose_id'] not in exclude_purpose_ids:
+                purpose_ids.append(sensor_info_row['purpose_id'])
+    return sorted(purpose_ids)
+
+
+def format_purpose_ids(purpose_ids):
+    """
+    Return an sql array of purpose_ids, e.g. '{1,2}'::bigint[]
+    """
+    return "'{" + ','.join(str(purpose_id) for purpose_id in purpose_ids) + "}'::bigint[]"
+
+
+def quote(identifier):
+    """
+    Return identifier as a quoted sql identifier
+    """
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def build_select(spec, sensor_info_rows, building=None):
+    """
+    Return the select of the pivoted readings of spec for building (or for the spec without buildings)
+    """
+    exclude_purpose_ids = set(spec.get('exclude_purpose_ids', []))
+    select_columns = list(spec['select'])
+    if building is not None:
+        select_columns.insert(0, "'" + building.replace("'", "''") + "'::text AS building")
+    all_purpose_ids = set()
+    for column in spec['columns']:
+        matches = column['match'] if isinstance(column['match'], list) else [column['match']]
+        aggregates = []
+        for match in matches:
+            purpose_ids = resolve_purpose_ids(sensor_info_rows, match, building, exclude_purpose_ids)
+            all_purpose_ids.update(purpose_ids)
+            condition = 'reading.purpose_id = ANY (' + format_purpose_ids(purpose_ids) + ')'
+            if 'units' in column:
+                condition += " AND reading.units::text = '" + column['units'].replace("'", "''") + "'::text"
+            aggregates.append('max(' + column.get('expression', 'reading.reading') + ') FILTER (WHERE ' + condition + ')')
+        select_columns.append(' + '.join(aggregates) + ' AS ' + quote(column['name']))
+    where = 'reading.purpose_id = ANY (' + format_purpose_ids(sorted(all_purpose_ids)) + ')'
+    if spec.get('where'):
+        where += ' AND (' + spec['where'] + ')'
+    select = ' SELECT ' + ',\n    '.join(select_columns) + '\n   FROM reading\n'
+    # sensor_info is only joined for the select and where columns that come from it
+    if 'sensor_info.' in ' '.join(spec['select']) + (spec.get('where') or ''):
+        select += '     JOIN sensor_info ON reading.purpose_id = sensor_info.purpose_id\n'
+    return select + '  WHERE ' + where + '\n  GROUP BY ' + ', '.join(spec['select'])
+
+
+def build_view(spec, sensor_info_rows):
+    """
+    Return the select of the view described by spec, with the purpose_ids of its columns taken from sensor_info_rows
+    """
+    if spec.get('buildings'):
+        select = '\nUNION ALL\n'.join(build_select(spec, sensor_info_rows, building) for building in spec['buildings'])
+    else:
+        select = build_select(spec, sensor_info_rows)
+    if spec.get('order_by'):
+        select += '\n  ORDER BY ' + spec['order_by']
+    return select
+
+
+def get_sensor_info_rows(conn):
+    """
+    Return every row of sensor_info as a dictionary of column: value
+    """
+    return [dict(row) for row in conn.execute(text(SELECT_SENSOR_INFO))]
+
+
+def refresh_views(conn, spec_filenames=None, force=False):
+    """
+    Generate the view of each of spec_filenames (default: every file in sql_views/pivot) from sensor_info and create
+    or replace the views whose sql changed since they were created, or every view if force is set
+
+    Each view is created in a savepoint, so a view that fails does not stop the others.
+    Nothing is committed. Returns the names of the replaced views and a dictionary of spec filename: exception of the views that failed
+    """
+    sensor_info_rows = get_sensor_info_rows(conn)
+    replaced_views = []
+    failures = {}
+    for spec_filename in sorted(spec_filenames or glob.glob(PIVOT_PATH + '/*.json')):
+        savepoint = conn.begin_nested()
+        try:
+            spec = read_spec(spec_filename)
+            select = build_view(spec, sensor_info_rows)
+            comment = COMMENT_PREFIX + hashlib.md5(select.encode()).hexdigest()
+            if force or conn.execute(text(SELECT_COMMENT), {'view_name': spec['view']}).scalar() != comment:
+                conn.execute(text('CREATE OR REPLACE VIEW ' + spec['view'] + ' AS\n' + select.replace(':', '\\:')))
+                conn.execute(text('COMMENT ON VIEW ' + spec['view'] + " IS '" + comment + "'"))
+                replaced_views.append(spec['view'])
+        except Exception as exception:
+            savepoint.rollback()
+            failures[spec_filename] = exception
+            continue
+        savepoint.commit()
+    return replaced_views, failures
+
+
+def print_views(conn, spec_filenames=None):
+    """
+    Print the CREATE VIEW statement of each of spec_filenames (default: every file in sql_views/pivot), as generated from sensor_info
+    """
+    sensor_info_rows = get_sensor_info_rows(conn)
+    for spec_filename in sorted(spec_filenames or glob.glob(PIVOT_PATH + '/*.json')):
+        spec = read_spec(spec_filename)
+        print('-- ' + spec.get('description', ''))
+        print('-- generated by sensors/pivot.py from ' + os.path.basename(spec_filename))
+        print('CREATE OR REPLACE VIEW ' + spec['view'] + ' AS\n')
+        print(build_view(spec, sensor_info_rows) + ';\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate the pivot views in sql_views/pivot from sensor_info')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    refresh_parser = subparsers.add_parser('refresh', help='create or replace the views whose purposes in sensor_info changed')
+    refresh_parser.add_argument('--force', action='store_true', help='replace every view, even if it did not change')
+    refresh_parser.add_argument('spec_filenames', nargs='*', help='json files of the views (default: every file in sql_views/pivot)')
+    print_parser = subparsers.add_parser('print', help='print the sql of each view')
+    print_parser.add_argument('spec_filenames', nargs='*', help='json files of the views (default: every file in sql_views/pivot)')
+    args = parser.parse_args()
+
+    conn = db.get_sessionmaker()()
+    if args.command == 'refresh':
+        replaced_views, failures = refresh_views(conn, args.spec_filenames, args.force)
+        conn.commit()
+        print(__file__ + ': replaced views ' + str(replaced_views))
+        for spec_filename, exception in sorted(failures.items()):
+            print(spec_filename + ' could not be created: ' + str(exception).strip().splitlines()[0])
+    else:
+        print_views(conn, args.spec_filenames)
+    conn.close()
@@ -0,0 +1,194 @@
+"""
+This module profiles a run of the egauge, webctrl or hobo script on demand with cProfile and tracemalloc
+
+Usage (from the project folder):
+    python3 egauge/script/api_egauge.py --profile cpu|memory|all (and the same for api_webctrl.py and extract_hobo.py)
+    SENSORS_PROFILE=cpu|memory|all python3 sensors/daemon.py
+    python3 sensors/profiling.py diff <before .pstats file> <after .pstats file> [--top <functions>] [--sort tottime|cumtime]
+
+profile_run() wraps a run of a script. cpu profiles the run with cProfile and dumps a pstats file
+(read it with python3 -m pstats <file>); memory traces allocations with tracemalloc and writes a report of the lines
+with the largest growth in allocated memory over the run, with the peak. Both are written next to the error.log the run
+logs to (see get_log_dir()), named <script_folder>-<run_id>[-<query_strings>], where run_id is the run_id
+of the run in run_metrics (see sensors.metrics) and the query_strings are those the scripts passed to tag().
+cProfile only profiles the thread that started it, so the egauge requests made in worker threads
+and the hobo csv files parsed in worker processes are not in the pstats file.
+
+diff prints the functions whose time changed most between two pstats files, e.g. of a run before and after a change.
+"""
+from pathlib import Path
+
+import argparse
+import contextlib
+import cProfile
+import logging
+import os
+import pstats
+import re
+import sys
+import tracemalloc
+import uuid
+
+sys.path.append(str(Path(os.path.dirname(os.path.realpath(__file__))).parent))
+from sensors import metrics
+
+
+PROFILE_ENVIRONMENT_VARIABLE = 'SENSORS_PROFILE'
+PROFILE_KINDS = ('cpu', 'memory')
+# lines of the allocation report
+TOP_ALLOCATIONS = 25
+# frames of the traceback kept for each allocation; more frames cost more time and memory while tracing
+TRACEMALLOC_FRAMES = 1
+# query_strings put into a file name; the others are counted
+MAX_TAGS_IN_NAME = 3
+
+# the query_strings tagged during the profiled run in progress in this process, or None if no run is profiled
+run_tags = None
+
+
+def get_profile_kinds(profile_argument=None):
+    """
+    Return the kinds of profile ('cpu', 'memory') to run, from profile_argument or else the SENSORS_PROFILE environment variable
+
+    Both are comma separated lists like "cpu,memory"; "all" means every kind. Unknown kinds raise a ValueError
+    """
+    if profile_argument is None:
+        profile_argument = os.environ.get(PROFILE_ENVIRONMENT_VARIABLE, '')
+    kinds = set()
+    for kind in profile_argument.split(','):
+        kind = kind.strip().lower()
+        if kind == 'all':
+            kinds.update(PROFILE_KINDS)
+        elif kind in PROFILE_KINDS:
+            kinds.add(kind)
+        elif kind:
+            raise ValueError('unknown profile ' + kind + '; use ' + ', '.join(PROFILE_KINDS) + ' or all')
+    return kinds
+
+
+def get_log_dir():
+    """
+    Return the folder of the file the root logger writes to, e.g. the project folder under sensors/daemon.py
+    or the */script folder under cron, or the working directory if it does not write to a file
+    """
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.FileHandler):
+            return os.path.dirname(handler.baseFilename)
+    return '.'
+
+
+def get_profile_stem(script_folder, run_id, query_strings):
+    """
+    Return the name of the profile files of a run without their extension, e.g. egauge-<run_id>-<query_string>
+
+    Characters of query_strings that do not belong in a file name are replaced with "-"
+    """
+    stem = script_folder + '-' + run_id
+    tags = [re.sub(r'[^\w.-]', '-', query_string) for query_string in sorted(set(query_strings))]
+    if tags:
+        stem += '-' + '_'.join(tags[:MAX_TAGS_IN_NAME])
+        if len(tags) > MAX_TAGS_IN_NAME:
+            stem += '_and_' + str(len(tags) - MAX_TAGS_IN_NAME) + '_more'
+    return stem
+
+
+def tag(query_string):
+    """
+    Add query_string to the name of the profile files of the profiled run in progress, if there is one
+    """
+    if run_tags is not None and query_string is not None:
+        run_tags.add(str(query_string))
+
+
+def format_allocation_report(script_folder, run_id, query_strings, start_snapshot, end_snapshot, peak_bytes, top=TOP_ALLOCATIONS):
+    """
+    Return the lines of end_snapshot whose allocated memory grew most since start_snapshot, with a header for the run
+    """
+    lines = ['# ' + script_folder + ' run ' + run_id + ' query_strings: ' + ', '.join(sorted(query_strings)),
+             '# peak traced memory: {:.1f} KiB'.format(peak_bytes / 1024)]
+    statistics = end_snapshot.compare_to(start_snapshot, 'lineno')
+    for statistic in statistics[:top]:
+        lines.append(str(statistic))
+    return '\n'.join(lines) + '\n'
+
+
+@contextlib.contextmanager
+def profile_run(script_folder, profile_argument=None, output_dir=None, top=TOP_ALLOCATIONS):
+    """
+    Profile the with block, a run of the script of script_folder, with the kinds of get_profile_kinds(profile_argument)
+    and write the pstats file and allocation report to output_dir (by default get_log_dir()), even if the block raises
+
+    Does nothing if no kind of profile is asked for
+    """
+    global run_tags
+    kinds = get_profile_kinds(profile_argument)
+    if not kinds:
+        yield
+        return
+    run_tags = set()
+    # the metrics of a run started before this one must not name the files of this run
+    metrics.last_run_metrics = None
+    if 'memory' in kinds:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        start_snapshot = tracemalloc.take_snapshot()
+    if 'cpu' in kinds:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if 'cpu' in kinds:
+            profiler.disable()
+        query_strings, run_tags = run_tags, None
+        # the run_id of the run's metrics, or a new id if the run stopped before its metrics were written
+        run_id = metrics.last_run_metrics.run_id if metrics.last_run_metrics else uuid.uuid4().hex
+        profile_path = (output_dir or get_log_dir()) + '/' + get_profile_stem(script_folder, run_id, query_strings)
+        if 'cpu' in kinds:
+            profiler.dump_stats(profile_path + '.pstats')
+            print(__file__ + ': wrote ' + profile_path + '.pstats')
+        if 'memory' in kinds:
+            end_snapshot = tracemalloc.take_snapshot()
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            # leave out the allocations of tracemalloc and cProfile themselves
+            snapshot_filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, cProfile.__file__)]
+            with open(profile_path + '.tracemalloc.txt', 'w') as file:
+                file.write(format_allocation_report(script_folder, run_id, query_strings, start_snapshot.filter_traces(snapshot_filters),
+                                                    end_snapshot.filter_traces(snapshot_filters), peak_bytes, top))
+            print(__file__ + ': wrote ' + profile_path + '.tracemalloc.txt')
+
+
+def diff_profiles(before_path, after_path, sort='tottime'):
+    """
+    Return a row of (function, seconds before, seconds after, calls before, calls after) for each function in the pstats files
+    before_path or after_path, sorted by the largest change in seconds first
+
+    sort is tottime (seconds in the function itself) or cumtime (seconds including the functions it called)
+    """
+    field = {'tottime': 2, 'cumtime': 3}[sort]
+    before_stats = pstats.Stats(before_path).stats
+    after_stats = pstats.Stats(after_path).stats
+    rows = []
+    for function in set(before_stats) | set(after_stats):
+        before = before_stats.get(function, (0, 0, 0, 0, {}))
+        after = after_stats.get(function, (0, 0, 0, 0, {}))
+        rows.append((pstats.func_std_string(function), before[field], after[field], before[1], after[1]))
+    rows.sort(key=lambda row: abs(row[2] - row[1]), reverse=True)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the pstats files of two profiled runs')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    diff_parser = subparsers.add_parser('diff', help='print the functions whose time changed most between two pstats files')
+    diff_parser.add_argument('before', help='pstats file of the first run')
+    diff_parser.add_argument('after', help='pstats file of the second run')
+    diff_parser.add_argument('--top', type=int, default=20, help='number of functions printed')
+    diff_parser.add_argument('--sort', choices=('tottime', 'cumtime'), default='tottime', help='time compared')
+    args = parser.parse_args()
+
+    print('{:>12}{:>12}{:>12}{:>12}{:>12}  {}'.format('before (s)', 'after (s)', 'change (s)', 'calls', 'calls', 'function'))
+    for function, before_seconds, after_seconds, before_calls, after_calls in diff_profiles(args.before, args.after, args.sort)[:args.top]:
+        print('{:>12.4f}{:>12.4f}{:>+12.4f}{:>12}{:>12}  {}'.format(before_seconds, after_seconds, after_seconds - before_seconds,
+                                                                  before_calls, after_calls, function))
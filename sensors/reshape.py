@@ -0,0 +1,100 @@
+"""
+This module reshapes readings downloaded from a source into a long "reading frame"
+
+A reading frame is a pandas dataframe with one row per reading and the columns
+purpose_id, datetime, reading and units, which are the columns of the reading table.
+Every reshape is done with whole-column numpy operations instead of one python object per reading.
+"""
+from sensors import lazy
+
+numpy = lazy.lazy_import('numpy')
+pandas = lazy.lazy_import('pandas')
+
+
+READING_FRAME_COLUMNS = ['purpose_id', 'datetime', 'reading', 'units']
+# digital readings (e.g. from webctrl) are the strings "true" and "false"
+DIGITAL_VALUES = ['false', 'true']
+
+
+def epoch_to_datetime(timestamps):
+    """
+    Convert an array of integer unix timestamps (seconds) to a UTC DatetimeIndex
+    """
+    return pandas.to_datetime(numpy.asarray(timestamps, dtype=numpy.int64), unit='s', utc=True)
+
+
+def to_float(values):
+    """
+    Convert an array-like of numeric strings or digital "true"/"false" strings to a float64 array
+
+    Digital values are stored as 1.0 (true) and 0.0 (false).
+    """
+    values = numpy.asarray(values, dtype=object)
+    is_digital = numpy.isin(values, DIGITAL_VALUES)
+    floats = numpy.empty(len(values), dtype=numpy.float64)
+    floats[~is_digital] = values[~is_digital].astype(numpy.float64)
+    floats[is_digital] = values[is_digital] == 'true'
+    return floats
+
+
+def empty_reading_frame():
+    """
+    Return a reading frame with no rows
+    """
+    return pandas.DataFrame({
+        'purpose_id': numpy.array([], dtype=numpy.int64),
+        'datetime': pandas.DatetimeIndex([], tz='UTC'),
+        'reading': numpy.array([], dtype=numpy.float64),
+        'units': numpy.array([], dtype=object)})
+
+
+def melt_wide_readings(readings, datetimes, purpose_sensors):
+    """
+    Reshape a wide readings dataframe into a reading frame
+
+    readings has one column per data_sensor_info_mapping (e.g. an egauge register or a hobo csv column)
+    datetimes is array-like with the datetime of each row in readings
+    purpose_sensors is an iterable of rows with purpose_id, data_sensor_info_mapping and unit
+
+    Columns without a matching purpose_sensor are dropped and purpose_sensors without a matching column add no rows.
+    Rows are ordered by purpose_sensor, then by the order of readings.
+    """
+    datetimes = pandas.DatetimeIndex(datetimes)
+    purpose_ids = []
+    units = []
+    columns = []
+    for purpose_sensor in purpose_sensors:
+        if purpose_sensor.data_sensor_info_mapping in readings.columns:
+            purpose_ids.append(purpose_sensor.purpose_id)
+            units.append(purpose_sensor.unit)
+            columns.append(purpose_sensor.data_sensor_info_mapping)
+    row_count = len(datetimes)
+    if not columns or row_count == 0:
+        return empty_reading_frame()
+    # transpose so each purpose_sensor's column is contiguous once flattened
+    values = readings[columns].to_numpy(dtype=numpy.float64).T.ravel()
+    return pandas.DataFrame({
+        'purpose_id': numpy.repeat(numpy.asarray(purpose_ids, dtype=numpy.int64), row_count),
+        'datetime': datetimes.take(numpy.tile(numpy.arange(row_count), len(columns))),
+        'reading': values,
+        'units': numpy.repeat(numpy.asarray(units, dtype=object), row_count)})
+
+
+def series_readings(purpose_id, datetimes, values, unit):
+    """
+    Create a reading frame for a single purpose from a datetime array and a matching array of values
+    """
+    datetimes = pandas.DatetimeIndex(datetimes)
+    return pandas.DataFrame({
+        'purpose_id': numpy.full(len(datetimes), purpose_id, dtype=numpy.int64),
+        'datetime': datetimes,
+        'reading': numpy.asarray(values, dtype=numpy.float64),
+        'units': numpy.full(len(datetimes), unit, dtype=object)})
+
+
+def last_reading_datetimes(reading_frame):
+    """
+    Return a series mapping each purpose_id in reading_frame to the datetime of its latest reading
+    """
+    return reading_frame.groupby('purpose_id')['datetime'].max()
+
@@ -0,0 +1,152 @@
+"""
+This module maintains the reading_rollup table of 5-minute, hourly and daily aggregates of each purpose's readings
+
+Usage (from the project folder):
+    python3 sensors/rollup.py rebuild [--purpose-id <purpose_id>] [--start <datetime>] [--end <datetime>] [--chunk-days <days>]
+
+sensors/loader.py calls update_rollups() with the range of datetimes it inserted for each purpose, in the same transaction
+as the readings, so only the buckets touched by each batch are computed again. 5-minute buckets are computed from
+the reading table, hourly buckets from the 5-minute buckets and daily buckets from the hourly buckets.
+Buckets start at multiples of their length since midnight, in the same time as reading.datetime.
+
+rebuild deletes and computes again the rollups of every purpose (or of --purpose-id) with readings from --start to --end,
+--chunk-days at a time, committing after each chunk. Use it to fill reading_rollup for readings inserted before it existed.
+--start and --end are datetimes like "2019-02-01"; they default to the first and last reading.
+"""
+from pathlib import Path
+from sqlalchemy import text
+
+import argparse
+import os
+import pendulum
+import sys
+
+sys.path.append(str(Path(os.path.dirname(os.path.realpath(__file__))).parent))
+from sensors import db
+
+
+# length in seconds of the buckets of each rollup, each computed from the rollup before it
+BUCKET_SECONDS = (300, 3600, 86400)
+DEFAULT_CHUNK_DAYS = 30
+
+# start of the bucket_seconds long bucket of a timestamp column, e.g. 10:35:00 for 10:37:12 and 300 seconds
+BUCKET = "timestamp 'epoch' + floor(extract(epoch FROM {column}) / :bucket_seconds) * :bucket_seconds * interval '1 second'"
+# the buckets from the bucket of the first datetime through the bucket of the last datetime of each purpose
+TOUCHED_RANGES = """
+    WITH touched_range AS (
+        SELECT purpose_id, {first_bucket} AS range_start, {last_bucket} + :bucket_seconds * interval '1 second' AS range_end
+        FROM unnest(CAST(:purpose_ids AS BIGINT[]), CAST(:first_datetimes AS TIMESTAMP[]), CAST(:last_datetimes AS TIMESTAMP[]))
+            AS inserted_range (purpose_id, first_datetime, last_datetime)
+    )
+""".format(first_bucket=BUCKET.format(column='first_datetime'), last_bucket=BUCKET.format(column='last_datetime'))
+UPSERT_ROLLUP = """
+    INSERT INTO reading_rollup (purpose_id, bucket_seconds, bucket, reading_count, reading_sum, reading_min, reading_max,
+                                first_datetime, first_reading, last_datetime, last_reading)
+    {select}
+    ON CONFLICT (purpose_id, bucket_seconds, bucket) DO UPDATE SET reading_count = excluded.reading_count,
+        reading_sum = excluded.reading_sum, reading_min = excluded.reading_min, reading_max = excluded.reading_max,
+        first_datetime = excluded.first_datetime, first_reading = excluded.first_reading,
+        last_datetime = excluded.last_datetime, last_reading = excluded.last_reading
+"""
+# uses the reading index on (purpose_id, datetime) to read only the readings of the touched buckets
+SELECT_FROM_READING = """
+    SELECT reading.purpose_id, :bucket_seconds, {bucket} AS bucket, count(*), sum(reading), min(reading), max(reading),
+        min(datetime), (array_agg(reading ORDER BY datetime))[1], max(datetime), (array_agg(reading ORDER BY datetime DESC))[1]
+    FROM touched_range JOIN reading ON reading.purpose_id = touched_range.purpose_id
+        AND reading.datetime >= touched_range.range_start AND reading.datetime < touched_range.range_end
+    WHERE reading.reading <> 'NaN'
+    GROUP BY reading.purpose_id, bucket
+""".format(bucket=BUCKET.format(column='reading.datetime'))
+SELECT_FROM_ROLLUP = """
+    SELECT reading_rollup.purpose_id, :bucket_seconds, {bucket} AS rollup_bucket, sum(reading_count), sum(reading_sum),
+        min(reading_min), max(reading_max), min(first_datetime), (array_agg(first_reading ORDER BY first_datetime))[1],
+        max(last_datetime), (array_agg(last_reading ORDER BY last_datetime DESC))[1]
+    FROM touched_range JOIN reading_rollup ON reading_rollup.purpose_id = touched_range.purpose_id
+        AND reading_rollup.bucket_seconds = :source_bucket_seconds
+        AND reading_rollup.bucket >= touched_range.range_start AND reading_rollup.bucket < touched_range.range_end
+    GROUP BY reading_rollup.purpose_id, rollup_bucket
+""".format(bucket=BUCKET.format(column='reading_rollup.bucket'))
+DELETE_ROLLUPS = """
+    DELETE FROM reading_rollup WHERE purpose_id = :purpose_id AND bucket >= :start AND bucket < :end
+"""
+SELECT_READING_RANGES = """
+    SELECT purpose_id, min(datetime), max(datetime) FROM reading
+    WHERE datetime >= :start AND datetime < :end AND (CAST(:purpose_id AS BIGINT) IS NULL OR purpose_id = :purpose_id)
+    GROUP BY purpose_id ORDER BY purpose_id
+"""
+
+
+def update_rollups(conn, inserted_ranges):
+    """
+    Compute again the rollup buckets touched by readings inserted between the first and last datetime of each purpose
+
+    inserted_ranges is a dict of purpose_id: (first datetime, last datetime) with naive datetimes like reading.datetime.
+    Nothing is committed. Returns the number of rollup rows written
+    """
+    if not inserted_ranges:
+        return 0
+    purpose_ids = sorted(inserted_ranges)
+    parameters = {'purpose_ids': purpose_ids,
+                  'first_datetimes': [inserted_ranges[purpose_id][0] for purpose_id in purpose_ids],
+                  'last_datetimes': [inserted_ranges[purpose_id][1] for purpose_id in purpose_ids]}
+    rows = 0
+    source_bucket_seconds = None
+    for bucket_seconds in BUCKET_SECONDS:
+        if source_bucket_seconds is None:
+            select = SELECT_FROM_READING
+        else:
+            select = SELECT_FROM_ROLLUP
+        rows += conn.execute(text(TOUCHED_RANGES + UPSERT_ROLLUP.format(select=select)),
+                             dict(parameters, bucket_seconds=bucket_seconds, source_bucket_seconds=source_bucket_seconds)).rowcount
+        source_bucket_seconds = bucket_seconds
+    return rows
+
+
+def rebuild_rollups(Session, purpose_id=None, start=None, end=None, chunk_days=DEFAULT_CHUNK_DAYS):
+    """
+    Delete and compute again the rollups of purpose_id, or of every purpose, with readings from start to end (naive datetimes)
+
+    Each chunk of chunk_days days is committed, so a rebuild that stops can be run again from the last chunk printed
+    """
+    conn = Session()
+    try:
+        reading_ranges = conn.execute(text(SELECT_READING_RANGES), {'purpose_id': purpose_id,
+                                                                     'start': start or pendulum.datetime(1970, 1, 1).naive(),
+                                                                     'end': end or pendulum.datetime(9999, 1, 1).naive()}).fetchall()
+        conn.commit()
+        for reading_purpose_id, first_datetime, last_datetime in reading_ranges:
+            # chunks start at midnight, so each daily bucket is computed from all of its readings at once
+            chunk_start = pendulum.instance(first_datetime).naive().start_of('day')
+            while chunk_start <= last_datetime:
+                chunk_end = chunk_start.add(days=chunk_days)
+                conn.execute(text(DELETE_ROLLUPS), {'purpose_id': reading_purpose_id, 'start': chunk_start, 'end': chunk_end})
+                # the last datetime is in the last bucket of the chunk, not the first bucket of the next chunk
+                rows = update_rollups(conn, {reading_purpose_id: (chunk_start, chunk_end.subtract(microseconds=1))})
+                conn.commit()
+                print('purpose_id ' + str(reading_purpose_id) + ': wrote ' + str(rows) + ' rollup rows from ' + str(chunk_start)
+                      + ' to ' + str(chunk_end))
+                chunk_start = chunk_end
+    finally:
+        conn.close()
+
+
+def parse_datetime(datetime_string):
+    """
+    Parse a --start or --end argument as a naive datetime like reading.datetime
+    """
+    return pendulum.parse(datetime_string).naive()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintain the 5-minute, hourly and daily rollups of the reading table')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    rebuild_parser = subparsers.add_parser('rebuild', help='compute the rollups of a time range again from the reading table')
+    rebuild_parser.add_argument('--purpose-id', type=int, help='only rebuild the rollups of this purpose_id')
+    rebuild_parser.add_argument('--start', type=parse_datetime, help='datetime to rebuild from (default: first reading)')
+    rebuild_parser.add_argument('--end', type=parse_datetime, help='datetime to rebuild to (default: last reading)')
+    rebuild_parser.add_argument('--chunk-days', type=int, default=DEFAULT_CHUNK_DAYS, help='days of rollups per transaction')
+    args = parser.parse_args()
+
+    Session = db.get_sessionmaker()
+    rebuild_rollups(Session, args.purpose_id, args.start, args.end, args.chunk_days)
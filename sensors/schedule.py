@@ -0,0 +1,115 @@
+"""
+This module decides when each sensor is due to be polled, using the poll_schedule table
+
+A sensor is polled about once per sensor_info.sample_resolution (or DEFAULT_INTERVAL if it is not set),
+but never more often than the script runs. Every consecutive poll that returns no new readings (including failed requests)
+doubles the interval, up to MAX_INTERVAL, so dead or rarely updated sensors stop costing a request every run.
+The interval is shortened by a random fraction of up to JITTER, so sensors polled on the same interval drift apart
+instead of all being requested in the same run, while staying due by the next run of the script.
+Cron starts every run of a script on the same second, so a cron run first waits a random delay of up to START_DELAY
+(see get_start_delay()); runs of sensors/daemon.py are already spread out by the jitter of their intervals.
+
+Sensors without a poll_schedule row are always due.
+"""
+from sqlalchemy import text
+
+import random
+import re
+
+
+# seconds between polls of a sensor with no sample_resolution
+DEFAULT_INTERVAL = 300
+MIN_INTERVAL = 60
+# longest interval between polls of a sensor that keeps returning no new readings
+MAX_INTERVAL = 21600
+# largest fraction of the interval removed at random
+JITTER = 0.1
+# longest random wait of a cron run before it requests readings
+START_DELAY = 60
+# seconds per unit of sample_resolution; a number without units is in minutes
+SAMPLE_RESOLUTION_UNITS = {'': 60, 's': 1, 'sec': 1, 'second': 1, 'm': 60, 'min': 60, 'minute': 60,
+                           'h': 3600, 'hr': 3600, 'hour': 3600, 'hourly': 3600, 'd': 86400, 'day': 86400, 'daily': 86400}
+
+SELECT_NOT_DUE = """
+    SELECT purpose_id FROM poll_schedule WHERE purpose_id = ANY(:purpose_ids) AND next_poll_datetime > :current_time
+"""
+SELECT_EMPTY_POLLS = """
+    SELECT empty_polls FROM poll_schedule WHERE purpose_id = :purpose_id
+"""
+UPSERT_POLL = """
+    INSERT INTO poll_schedule (purpose_id, last_poll_datetime, next_poll_datetime, empty_polls)
+    VALUES (:purpose_id, :current_time, :next_poll_datetime, :empty_polls)
+    ON CONFLICT (purpose_id) DO UPDATE SET last_poll_datetime = excluded.last_poll_datetime,
+        next_poll_datetime = excluded.next_poll_datetime, empty_polls = excluded.empty_polls
+"""
+
+
+def parse_sample_resolution(sample_resolution):
+    """
+    Return sample_resolution (e.g. "1 min", "15 minutes", "1h", "hourly") in seconds, or None if it cannot be read
+    """
+    if not sample_resolution:
+        return None
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)?\s*([a-z]*)', sample_resolution.strip().lower())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    unit = match.group(2)
+    # allow plural units like "mins" or "hours"
+    if unit not in SAMPLE_RESOLUTION_UNITS and unit[:-1] in SAMPLE_RESOLUTION_UNITS and unit.endswith('s'):
+        unit = unit[:-1]
+    if unit not in SAMPLE_RESOLUTION_UNITS:
+        return None
+    return float(match.group(1) or 1) * SAMPLE_RESOLUTION_UNITS[unit]
+
+
+def get_poll_interval(sample_resolution_seconds, empty_polls, default_interval=DEFAULT_INTERVAL, max_interval=MAX_INTERVAL):
+    """
+    Return the seconds until the next poll of a sensor, before jitter
+
+    The interval is the sample resolution (at least MIN_INTERVAL), doubled for each of the sensor's empty_polls
+    (consecutive polls without new readings), up to max_interval.
+    """
+    interval = max(sample_resolution_seconds or default_interval, MIN_INTERVAL)
+    # an interval longer than max_interval is kept, but is not backed off further
+    return min(interval * 2 ** min(empty_polls, 32), max(interval, max_interval))
+
+
+def add_jitter(seconds, jitter=JITTER):
+    """
+    Shorten seconds by a random fraction of up to jitter
+    """
+    return seconds * (1 - jitter * random.random())
+
+
+def get_start_delay(max_delay=START_DELAY):
+    """
+    Return a random number of seconds up to max_delay for a cron run to wait before requesting readings
+    """
+    return max_delay * random.random()
+
+
+def get_due_purpose_ids(conn, purpose_ids, current_time):
+    """
+    Return the set of purpose_ids that are due to be polled at current_time
+    """
+    purpose_ids = [int(purpose_id) for purpose_id in purpose_ids]
+    if not purpose_ids:
+        return set()
+    not_due = conn.execute(text(SELECT_NOT_DUE), {'purpose_ids': purpose_ids, 'current_time': current_time})
+    return set(purpose_ids) - set(row[0] for row in not_due)
+
+
+def record_poll(conn, purpose_id, sample_resolution, new_readings, current_time):
+    """
+    Record a poll of purpose_id at current_time (a pendulum datetime) and schedule its next poll
+
+    new_readings is the number of new readings the poll returned; 0 for a poll that failed or returned nothing.
+    Nothing is committed. Returns the next poll datetime
+    """
+    empty_polls = conn.execute(text(SELECT_EMPTY_POLLS), {'purpose_id': purpose_id}).scalar() or 0
+    empty_polls = 0 if new_readings else empty_polls + 1
+    interval = add_jitter(get_poll_interval(parse_sample_resolution(sample_resolution), empty_polls))
+    next_poll_datetime = current_time.add(seconds=interval)
+    conn.execute(text(UPSERT_POLL), {'purpose_id': purpose_id, 'current_time': current_time,
+                                     'next_poll_datetime': next_poll_datetime, 'empty_polls': empty_polls})
+    return next_poll_datetime
@@ -0,0 +1,23 @@
+"""
+This module imports the egauge, webctrl and hobo scripts into a running process, e.g. sensors/daemon.py or sensors/backfill.py
+
+Each script is imported once from its */script folder, which is added to sys.path.
+"""
+import importlib
+import sys
+
+from sensors import db
+
+
+# script run for each sensor_info.script_folder; scripts are run with their */script folder as working directory
+SCRIPT_MODULES = {'egauge': 'api_egauge', 'webctrl': 'api_webctrl', 'hobo': 'extract_hobo'}
+
+
+def load_script(script_folder):
+    """
+    Import the script of script_folder once and return the module
+    """
+    script_path = db.PROJECT_PATH + '/' + script_folder + '/script'
+    if script_path not in sys.path:
+        sys.path.append(script_path)
+    return importlib.import_module(SCRIPT_MODULES[script_folder])
@@ -0,0 +1,85 @@
+"""
+Test suite for sensors.backfill using the unittest module
+"""
+from sensors import backfill
+
+import collections
+import concurrent.futures
+import datetime
+import pendulum
+import unittest
+
+
+Purpose = collections.namedtuple('Purpose', ['purpose_id'])
+
+
+class Connection:
+    """
+    Stands in for a database connection; returns the (checkpoint count, backfilled_through) given to it
+    and records the parameters of each statement
+    """
+
+    def __init__(self, checkpoint):
+        self.checkpoint = checkpoint
+        self.statements = []
+        self.commits = 0
+
+    def execute(self, clause, parameters):
+        self.statements.append((str(clause), parameters))
+        return self
+
+    def first(self):
+        return self.checkpoint
+
+    def commit(self):
+        self.commits += 1
+
+
+class TestBackfill(unittest.TestCase):
+    """
+    A test suite for the chunking and the checkpoints in sensors.backfill
+    """
+
+    def test_get_chunks_covers_range_without_overlap(self):
+        start = pendulum.datetime(2019, 2, 1, 0, 0, tz='Pacific/Honolulu')
+        end = start.add(hours=5, minutes=30)
+        chunks = backfill.get_chunks(start, end, 7200)
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(chunks[0][0], start)
+        self.assertEqual(chunks[-1][1], end)
+        for (first_start, first_end), (second_start, second_end) in zip(chunks, chunks[1:]):
+            self.assertEqual(first_end, second_start)
+        self.assertEqual(backfill.get_chunks(end, start, 7200), [])
+
+
+    def test_map_in_order_yields_in_submission_order(self):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            results = [(item, future.result()) for item, future in backfill.map_in_order(executor, lambda item: item * 2, range(10), 3)]
+        self.assertEqual(results, [(item, item * 2) for item in range(10)])
+
+
+    def test_get_checkpoint_resumes_only_if_every_purpose_has_one(self):
+        range_start = pendulum.datetime(2019, 2, 1, tz='Pacific/Honolulu')
+        purposes = [Purpose(1), Purpose(2)]
+        conn = Connection((2, datetime.datetime(2019, 2, 3)))
+        self.assertEqual(backfill.get_checkpoint(conn, purposes, range_start), pendulum.datetime(2019, 2, 3, tz='Pacific/Honolulu'))
+        self.assertEqual(conn.statements[0][1], {'purpose_ids': [1, 2], 'range_start': datetime.datetime(2019, 2, 1)})
+        self.assertEqual(backfill.get_checkpoint(Connection((1, datetime.datetime(2019, 2, 3))), purposes, range_start), range_start)
+        self.assertEqual(backfill.get_checkpoint(Connection((0, None)), purposes, range_start), range_start)
+
+
+    def test_save_checkpoint_commits_naive_datetimes(self):
+        range_start = pendulum.datetime(2019, 2, 1, tz='Pacific/Honolulu')
+        conn = Connection(None)
+        backfill.save_checkpoint(conn, [Purpose(1)], range_start, range_start.add(hours=6))
+        self.assertEqual(conn.statements, [(backfill.UPSERT_CHECKPOINT, {'purpose_ids': [1], 'range_start': datetime.datetime(2019, 2, 1),
+                                                                         'backfilled_through': datetime.datetime(2019, 2, 1, 6)})])
+        self.assertEqual(conn.commits, 1)
+        # a backfill without a start resumes from last_updated_datetime instead
+        conn = Connection(None)
+        backfill.save_checkpoint(conn, [Purpose(1)], None, range_start)
+        self.assertEqual(conn.statements, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+"""
+Test suite for sensors.bulktrend using the unittest module
+"""
+from sensors import bulktrend
+
+import unittest
+
+
+class TestBulkTrend(unittest.TestCase):
+    """
+    A test suite for the streaming webctrl csv parser
+    """
+    response = ('ABSPATH:1:#board_room/ht_stpt_tn,1282017600000,55.1,1282017900000,55\r\n'
+                '"ABSPATH:1:#board_room/""locked"",tn",1282017600000,false,1282017900000,true\r\n'
+                'ABSPATH:1:#empty_tn\r\n')
+
+
+    def parse(self, response, chunk_size, **kwargs):
+        chunks = [response[i:i + chunk_size].encode('utf-8') for i in range(0, len(response), chunk_size)]
+        return list(bulktrend.iter_trends(chunks, **kwargs))
+
+
+    def test_parse_in_any_chunk_size(self):
+        for chunk_size in [1, 2, 3, 7, 64, len(self.response)]:
+            trends = self.parse(self.response, chunk_size, block_size=2)
+            self.assertEqual([trend.id for trend in trends], ['ABSPATH:1:#board_room/ht_stpt_tn', 'ABSPATH:1:#board_room/"locked",tn', 'ABSPATH:1:#empty_tn'])
+            self.assertEqual(trends[0].timestamps.tolist(), [1282017600, 1282017900])
+            self.assertEqual(trends[0].values.tolist(), [55.1, 55.0])
+            self.assertEqual(trends[1].values.tolist(), [0.0, 1.0])
+            self.assertEqual(len(trends[2].timestamps), 0)
+
+
+    def test_last_line_without_terminator(self):
+        trends = self.parse('a_tn,1282017600000,1.5', 4)
+        self.assertEqual(trends[0].values.tolist(), [1.5])
+
+
+    def test_watermark_drops_stored_samples(self):
+        trends = self.parse(self.response, 5, watermarks={'ABSPATH:1:#board_room/ht_stpt_tn': 1282017600}, block_size=2)
+        self.assertEqual(trends[0].timestamps.tolist(), [1282017900])
+        self.assertEqual(trends[0].skipped, 1)
+        self.assertEqual(trends[1].skipped, 0)
+
+
+    def test_watermark_within_a_block(self):
+        response = 'a_tn,' + ','.join(str(1282017600000 + i * 300000) + ',' + str(i) for i in range(9)) + '\r\n'
+        for watermark, kept in [(1282017600 - 1, 9), (1282017600 + 4 * 300, 4), (1282017600 + 8 * 300, 0)]:
+            for chunk_size in [3, len(response)]:
+                trend, = self.parse(response, chunk_size, watermarks={'a_tn': watermark})
+                self.assertEqual(trend.values.tolist(), list(range(9 - kept, 9)))
+                self.assertEqual(trend.timestamps.tolist(), [1282017600 + i * 300 for i in range(9 - kept, 9)])
+                self.assertEqual(trend.skipped, 9 - kept)
+        # str chunks are parsed like the bytes of the response
+        trend, = bulktrend.iter_trends([response[:10], response[10:]], watermarks={'a_tn': 1282017600})
+        self.assertEqual(trend.skipped, 1)
+
+
+    def test_unpaired_fields_raise(self):
+        with self.assertRaises(ValueError):
+            self.parse('a_tn,1282017600000,1.5,1282017900000\r\n', 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
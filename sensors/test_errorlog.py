@@ -0,0 +1,38 @@
+"""
+Test suite for sensors.errorlog and the error_log partitions of sensors.partition using the unittest module
+"""
+from sensors import errorlog, partition
+
+import datetime
+import pendulum
+import unittest
+
+
+class TestErrorLog(unittest.TestCase):
+    """
+    A test suite for the days compacted by sensors.errorlog and the names of the error_log partitions
+    """
+
+    def test_cutoff_keeps_whole_days(self):
+        current_time = pendulum.datetime(2019, 2, 10, 13, 30, tz='Pacific/Honolulu')
+        self.assertEqual(errorlog.get_cutoff(7, current_time), pendulum.datetime(2019, 2, 3).naive())
+
+
+    def test_days_run_through_the_day_before_cutoff(self):
+        days = errorlog.get_days(datetime.date(2019, 2, 27), pendulum.datetime(2019, 3, 2).naive())
+        self.assertEqual([day.to_date_string() for day in days], ['2019-02-27', '2019-02-28', '2019-03-01'])
+        self.assertEqual(errorlog.get_days(datetime.date(2019, 3, 2), pendulum.datetime(2019, 3, 2).naive()), [])
+
+
+    def test_partition_names_of_each_table(self):
+        month = pendulum.datetime(2019, 2, 14).naive()
+        self.assertEqual(partition.get_partition_name(month), 'reading_y2019m02')
+        self.assertEqual(partition.get_partition_name(month, errorlog.TABLE), 'error_log_y2019m02')
+        # the partitions of a table being migrated are named after the table it replaces
+        self.assertEqual(partition.get_partition_name(month, errorlog.MIGRATION_TABLE), 'error_log_y2019m02')
+        self.assertEqual(partition.get_default_partition(errorlog.MIGRATION_TABLE), 'error_log_default')
+        self.assertEqual(partition.PARTITION_NAME_PATTERN.fullmatch('error_log_y2019m02').group(1), errorlog.TABLE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Test suite for sensors.gaps using the unittest module
+"""
+from sensors import gaps
+
+import datetime
+import unittest
+
+
+class Result:
+    """
+    Stands in for the result of a statement with one row
+    """
+
+    def __init__(self, row, rowcount):
+        self.row = row
+        self.rowcount = rowcount
+
+    def scalar(self):
+        return self.row[0]
+
+    def first(self):
+        return self.row
+
+
+class Connection:
+    """
+    Stands in for a database connection; returns the checkpoint and (latest datetime, cadence seconds) given to it
+    and records the parameters of each statement
+    """
+
+    def __init__(self, checkpoint, cadence, new_gaps=0):
+        self.checkpoint = checkpoint
+        self.cadence = cadence
+        self.new_gaps = new_gaps
+        self.statements = []
+
+    def execute(self, clause, parameters):
+        sql = str(clause)
+        self.statements.append((sql, parameters))
+        if 'FROM gap_checkpoint' in sql:
+            return Result((self.checkpoint,), 0)
+        if sql == gaps.SELECT_CADENCE:
+            return Result(self.cadence, 0)
+        return Result(None, self.new_gaps)
+
+    def get_parameters(self, sql):
+        return [parameters for statement, parameters in self.statements if statement == sql]
+
+
+class TestGaps(unittest.TestCase):
+    """
+    A test suite for the expected spacing and the checkpoint handling of sensors.gaps.detect_gaps
+    """
+
+    def test_get_expected_seconds(self):
+        self.assertEqual(gaps.get_expected_seconds('15 min', 60.0), 900)
+        # the median spacing of the readings is used if sample_resolution is not set or cannot be read
+        self.assertEqual(gaps.get_expected_seconds(None, 60.0), 60.0)
+        self.assertEqual(gaps.get_expected_seconds('varies', 60.0), 60.0)
+        self.assertIsNone(gaps.get_expected_seconds(None, None))
+
+
+    def test_detect_gaps_without_readings_keeps_checkpoint(self):
+        conn = Connection(None, (None, None))
+        self.assertEqual(gaps.detect_gaps(conn, 1, '1 min', None), 0)
+        self.assertEqual(conn.get_parameters(gaps.SELECT_CADENCE)[0]['checked_through'], gaps.FIRST_CHECKPOINT)
+        self.assertEqual(conn.get_parameters(gaps.INSERT_GAPS), [])
+        self.assertEqual(conn.get_parameters(gaps.UPSERT_CHECKPOINT), [])
+
+
+    def test_detect_gaps_moves_checkpoint_to_latest_reading(self):
+        checkpoint = datetime.datetime(2019, 2, 1)
+        latest_datetime = datetime.datetime(2019, 2, 2)
+        conn = Connection(checkpoint, (latest_datetime, 60.0), new_gaps=2)
+        self.assertEqual(gaps.detect_gaps(conn, 1, '1 min', None), 2)
+        insert_parameters, = conn.get_parameters(gaps.INSERT_GAPS)
+        self.assertEqual(insert_parameters['checked_through'], checkpoint)
+        self.assertEqual(insert_parameters['expected_seconds'], 60)
+        self.assertEqual(insert_parameters['gap_seconds'], 60 * gaps.GAP_FACTOR)
+        checkpoint_parameters, = conn.get_parameters(gaps.UPSERT_CHECKPOINT)
+        self.assertEqual(checkpoint_parameters['checked_through'], latest_datetime)
+        self.assertEqual(checkpoint_parameters['cadence_seconds'], 60.0)
+
+
+    def test_detect_gaps_without_expected_seconds_only_moves_checkpoint(self):
+        # a single new reading has no spacing, and the purpose has no sample_resolution
+        latest_datetime = datetime.datetime(2019, 2, 2)
+        conn = Connection(None, (latest_datetime, None))
+        self.assertEqual(gaps.detect_gaps(conn, 1, None, None), 0)
+        self.assertEqual(conn.get_parameters(gaps.INSERT_GAPS), [])
+        checkpoint_parameters, = conn.get_parameters(gaps.UPSERT_CHECKPOINT)
+        self.assertEqual(checkpoint_parameters['checked_through'], latest_datetime)
+        self.assertIsNone(checkpoint_parameters['cadence_seconds'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+"""
+Test suite for sensors.indexes using the unittest module
+"""
+from sensors import indexes
+
+import unittest
+
+
+class TestIndexes(unittest.TestCase):
+    """
+    A test suite for summarizing the plans of views in sensors.indexes
+    """
+
+    def test_summarize_plan(self):
+        explain_output = [{'Plan': {'Node Type': 'Hash Join', 'Plans': [
+            {'Node Type': 'Seq Scan', 'Relation Name': 'reading_y2019m02', 'Actual Rows': 10, 'Actual Loops': 2,
+             'Rows Removed by Filter': 5, 'Shared Hit Blocks': 3, 'Shared Read Blocks': 4},
+            {'Node Type': 'Index Scan', 'Relation Name': 'sensor_info', 'Index Name': 'sensor_info_pkey'}]},
+            'Execution Time': 1.5}]
+        view_plan = indexes.summarize_plan('view', explain_output)
+        self.assertEqual(view_plan.execution_milliseconds, 1.5)
+        self.assertEqual(view_plan.sequential_scans, [indexes.SequentialScan('reading_y2019m02', 20, 10, 7)])
+        self.assertEqual(view_plan.index_names, ['sensor_info_pkey'])
+
+
+if __name__ == '__main__':
+    unittest.main()
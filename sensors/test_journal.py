@@ -0,0 +1,32 @@
+"""
+Test suite for sensors.journal using the unittest module
+"""
+from sensors import journal, orm
+
+import unittest
+
+
+class TestJournal(unittest.TestCase):
+    """
+    A test suite for recording error_log rows in a sensors.journal.Journal
+    """
+
+    def test_record_keeps_rows_in_order(self):
+        error_log_journal = journal.Journal()
+        error_log_journal.record(2, None, orm.ErrorLog.PipelineStageEnum.database_insertion, was_success=True,
+                                 details={'csv_filename': 'a.csv'})
+        error_log_journal.record(1, None, orm.ErrorLog.PipelineStageEnum.data_acquisition, was_success=False, error_type='ValueError')
+        self.assertEqual([row['purpose_id'] for row in error_log_journal.rows], [2, 1])
+        # the enum is stored by name, like the orm stores it
+        self.assertEqual(error_log_journal.rows[0]['pipeline_stage'], 'database_insertion')
+        self.assertEqual(error_log_journal.rows[0]['details'], {'csv_filename': 'a.csv'})
+        self.assertEqual(error_log_journal.rows[1]['details'], {})
+        self.assertIsNone(error_log_journal.rows[1]['log_id'])
+
+
+    def test_flush_without_rows_does_not_use_the_database(self):
+        self.assertEqual(journal.Journal().flush(None), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""
+Test suite for sensors.matview using the unittest module
+"""
+from sensors import matview
+
+import unittest
+
+
+class TestMatview(unittest.TestCase):
+    """
+    A test suite for reading sql_views files and ordering their dependencies in sensors.matview
+    """
+
+    def test_read_view(self):
+        view_name, select = matview.read_view(matview.SQL_VIEWS_PATH + '/kat."dashboard-hvac".sql')
+        self.assertEqual(view_name, 'kat."dashboard-hvac"')
+        self.assertIn('JOIN reading', select)
+        self.assertFalse(select.endswith(';'))
+
+
+    def test_read_sql_view(self):
+        sql_view = matview.read_sql_view(matview.SQL_VIEWS_PATH + '/eguage_5min_avg_view2.sql')
+        self.assertEqual(sql_view.used_by, ['dashboard-pv-pos-whole-building-net', 'dashboard-readings-neg', 'dashboard-whole-building-net'])
+        self.assertEqual(sql_view.unique_columns, ['datetime_5min', 'purpose_id', 'units'])
+        sql_view = matview.read_sql_view(matview.SQL_VIEWS_PATH + '/kat."dashboard-union_individual".sql')
+        self.assertEqual(sql_view.used_by, ['dashboard-with-indoor-env', 'dashbd_indoorenv_weather_no_sched'])
+        self.assertIsNone(sql_view.unique_columns)
+
+
+    def test_get_key(self):
+        self.assertEqual(matview.get_key('kat."dashboard-hvac"'), ('kat', 'dashboard-hvac'))
+        self.assertEqual(matview.get_key('Eguage_5min_avg_view2'), ('public', 'eguage_5min_avg_view2'))
+        with self.assertRaises(ValueError):
+            matview.get_key('dashboard-hvac')
+
+
+    def test_build_dag(self):
+        sql_views = [matview.SqlView('a', 'SELECT * FROM reading', 'a.sql', [], None),
+                     matview.SqlView('kat."b"', 'SELECT * FROM a JOIN sensor_info ON true', 'b.sql', [], None),
+                     matview.SqlView('c', 'SELECT * FROM kat."b" JOIN A ON true', 'c.sql', ['b'], ['datetime'])]
+        upstream = matview.build_dag(sql_views)
+        self.assertEqual(upstream, {('public', 'a'): set(), ('kat', 'b'): {('public', 'a')},
+                                    ('public', 'c'): {('kat', 'b'), ('public', 'a')}})
+        self.assertEqual(matview.get_topological_order(upstream), [('public', 'a'), ('kat', 'b'), ('public', 'c')])
+        self.assertEqual(matview.get_downstream(upstream, [('public', 'a')]), {('kat', 'b'), ('public', 'c')})
+        self.assertEqual(matview.check_used_by(sql_views, upstream),
+                         ['kat."b" is used by [\'c\'], missing from its [used by] comment',
+                          'a is used by [\'b\', \'c\'], missing from its [used by] comment',
+                          'c is not used by [\'b\'] in sql_views'])
+        with self.assertRaises(ValueError):
+            matview.get_topological_order({('public', 'a'): {('public', 'b')}, ('public', 'b'): {('public', 'a')}})
+
+
+    def test_get_purpose_ids(self):
+        self.assertEqual(matview.get_purpose_ids('SELECT * FROM reading WHERE reading.purpose_id = ANY (ARRAY[84::bigint, 85::bigint])'), {84, 85})
+        self.assertEqual(matview.get_purpose_ids('SELECT * FROM sensor_info JOIN reading ON true WHERE purpose_id IN (1, 2) OR purpose_id = 3'), {1, 2, 3})
+        self.assertEqual(matview.get_purpose_ids('SELECT * FROM sensor_info'), set())
+        self.assertIsNone(matview.get_purpose_ids('SELECT * FROM reading_rollup WHERE bucket_seconds = 300'))
+        # the second select reads every purpose, even though the first is filtered
+        self.assertIsNone(matview.get_purpose_ids('SELECT * FROM reading WHERE purpose_id = 84 UNION SELECT * FROM reading WHERE datetime > now()'))
+
+
+    def test_get_view_purpose_ids(self):
+        sql_views = matview.read_sql_views()
+        view_purpose_ids = matview.get_view_purpose_ids(sql_views, matview.build_dag(list(sql_views.values())))
+        # selects from egauge_5min_avg_view1, which reads purposes 84 and 85
+        self.assertEqual(view_purpose_ids[('public', 'eguage_5min_avg_view2')], {84, 85})
+        self.assertEqual(view_purpose_ids[('kat', 'dashboard-whole-building-net')], {84, 85, 96, 109})
+        self.assertIsNone(view_purpose_ids[('kat', 'dashboard-readings-neg')])
+
+
+    def test_sql_views_have_no_cycles(self):
+        sql_views = matview.read_sql_views()
+        self.assertEqual(len(matview.get_topological_order(matview.build_dag(list(sql_views.values())))), len(sql_views))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+"""
+Test suite for sensors.metrics using the unittest module
+"""
+from sensors import metrics
+
+import os
+import tempfile
+import unittest
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    A test suite for the stage timings and counters of sensors.metrics
+    """
+
+    def tearDown(self):
+        metrics.run_metrics = None
+
+
+    def test_stages_add_up_within_a_run(self):
+        run_metrics = metrics.start_run('egauge')
+        for rows in (3, 4):
+            with metrics.stage('copy'):
+                pass
+            metrics.add('copy', rows=rows)
+        metrics.add('request', bytes=100)
+        self.assertEqual(list(run_metrics.stages), ['copy', 'request'])
+        self.assertEqual(run_metrics.stages['copy'].calls, 2)
+        self.assertEqual(run_metrics.stages['copy'].rows, 7)
+        self.assertEqual(run_metrics.stages['request'].bytes, 100)
+        self.assertEqual(run_metrics.stages['request'].calls, 0)
+
+
+    def test_stage_is_timed_when_it_raises(self):
+        run_metrics = metrics.start_run('webctrl')
+        with self.assertRaises(ValueError):
+            with metrics.stage('request'):
+                raise ValueError
+        self.assertEqual(run_metrics.stages['request'].calls, 1)
+
+
+    def test_stages_outside_a_run_are_not_recorded(self):
+        with metrics.stage('copy'):
+            metrics.add('copy', rows=1)
+        self.assertEqual(list(metrics.count_bytes('request', [b'ab', b'c'])), [b'ab', b'c'])
+        self.assertIsNone(metrics.run_metrics)
+
+
+    def test_textfile_has_a_sample_per_stage(self):
+        run_metrics = metrics.start_run('hobo')
+        metrics.add('copy', rows=5)
+        run_metrics.finish()
+        with tempfile.TemporaryDirectory() as textfile_dir:
+            run_metrics.write_textfile(textfile_dir)
+            self.assertEqual(os.listdir(textfile_dir), ['hobo.prom'])
+            with open(textfile_dir + '/hobo.prom') as file:
+                lines = file.read().splitlines()
+        self.assertIn('sensors_stage_rows{script_folder="hobo",stage="copy"} 5.0', lines)
+        self.assertIn('# TYPE sensors_stage_seconds gauge', lines)
+        self.assertEqual(len([line for line in lines if line.startswith('sensors_stage_calls{')]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""
+Test suite for sensors.pivot using the unittest module
+"""
+from sensors import pivot
+
+import glob
+import unittest
+
+
+SENSOR_INFO_ROWS = [
+    {'purpose_id': 1, 'building': 'frog-1', 'type': 'Temperature-air', 'room': 'Classroom'},
+    {'purpose_id': 2, 'building': 'frog-2', 'type': 'Temperature-air', 'room': 'Classroom'},
+    {'purpose_id': 3, 'building': 'frog-1', 'type': 'Temperature-mrt', 'room': None},
+    {'purpose_id': 84, 'building': 'frog-1', 'type': 'Temperature-air', 'room': 'Classroom'},
+]
+
+
+class TestPivot(unittest.TestCase):
+    """
+    A test suite for resolving sensor_info matches to purpose_ids and generating pivot views in sensors.pivot
+    """
+
+    def test_match_value(self):
+        self.assertTrue(pivot.match_value('Temperature-air', 'Temperature-air'))
+        self.assertTrue(pivot.match_value('Temperature-air', 'Temperature%'))
+        self.assertTrue(pivot.match_value('Power-avg (kW)', 'Power-avg%'))
+        self.assertFalse(pivot.match_value('Temperature-air', 'Temperature'))
+        self.assertFalse(pivot.match_value('exterior Temperature', 'Temperature%'))
+        self.assertFalse(pivot.match_value(None, '%'))
+
+
+    def test_resolve_purpose_ids(self):
+        self.assertEqual(pivot.resolve_purpose_ids(SENSOR_INFO_ROWS, {'type': 'Temperature%'}, exclude_purpose_ids={84}), [1, 2, 3])
+        self.assertEqual(pivot.resolve_purpose_ids(SENSOR_INFO_ROWS, {'building': '{building}', 'room': 'Classroom'}, 'frog-1'), [1, 84])
+        self.assertEqual(pivot.resolve_purpose_ids(SENSOR_INFO_ROWS, {'type': 'CO2'}), [])
+        with self.assertRaises(ValueError):
+            pivot.resolve_purpose_ids(SENSOR_INFO_ROWS, {'no_such_column': 'x'})
+
+
+    def test_build_view(self):
+        spec = {'view': 'classroom', 'buildings': ['frog-1', 'frog-2'], 'select': ['reading.datetime'], 'exclude_purpose_ids': [84],
+                'order_by': '2, 1', 'columns': [{'name': 'Temperature', 'match': {'building': '{building}', 'type': 'Temperature-air'}},
+                                                {'name': 'Both', 'match': [{'purpose_id': '1'}, {'purpose_id': '3'}], 'units': 'F'}]}
+        select = pivot.build_view(spec, SENSOR_INFO_ROWS)
+        frog1_select, frog2_select = select.split('\nUNION ALL\n')
+        self.assertIn("'frog-1'::text AS building", frog1_select)
+        self.assertIn("max(reading.reading) FILTER (WHERE reading.purpose_id = ANY ('{1}'::bigint[])) AS \"Temperature\"", frog1_select)
+        self.assertIn("FILTER (WHERE reading.purpose_id = ANY ('{1}'::bigint[]) AND reading.units::text = 'F'::text) + max(", frog1_select)
+        self.assertIn("WHERE reading.purpose_id = ANY ('{1,3}'::bigint[])", frog1_select)
+        self.assertNotIn('JOIN sensor_info', frog1_select)
+        self.assertIn("WHERE reading.purpose_id = ANY ('{1,2,3}'::bigint[])", frog2_select)
+        self.assertTrue(frog2_select.endswith('GROUP BY reading.datetime\n  ORDER BY 2, 1'))
+
+
+    def test_read_specs(self):
+        spec_filenames = glob.glob(pivot.PIVOT_PATH + '/*.json')
+        self.assertTrue(spec_filenames)
+        for spec_filename in spec_filenames:
+            spec = pivot.read_spec(spec_filename)
+            self.assertIn('view', spec)
+            self.assertTrue(spec['columns'])
@@ -0,0 +1,89 @@
+"""
+Test suite for sensors.profiling using the unittest module
+"""
+from sensors import metrics, profiling
+
+import cProfile
+import logging
+import os
+import tempfile
+import unittest
+
+
+def spin(repeats):
+    return sum(range(repeats))
+
+
+class TestProfiling(unittest.TestCase):
+    """
+    A test suite for profiling runs and comparing profiles with sensors.profiling
+    """
+
+    def tearDown(self):
+        metrics.run_metrics = None
+        metrics.last_run_metrics = None
+
+
+    def test_profile_kinds(self):
+        self.assertEqual(profiling.get_profile_kinds('cpu'), {'cpu'})
+        self.assertEqual(profiling.get_profile_kinds('all'), {'cpu', 'memory'})
+        self.assertEqual(profiling.get_profile_kinds(' CPU, memory '), {'cpu', 'memory'})
+        self.assertEqual(profiling.get_profile_kinds(''), set())
+        with self.assertRaises(ValueError):
+            profiling.get_profile_kinds('disk')
+
+
+    def test_profile_stem_is_tagged_with_query_strings(self):
+        self.assertEqual(profiling.get_profile_stem('hobo', 'abc', []), 'hobo-abc')
+        self.assertEqual(profiling.get_profile_stem('webctrl', 'abc', ['#frog/1', 'b']), 'webctrl-abc--frog-1_b')
+        self.assertEqual(profiling.get_profile_stem('egauge', 'abc', ['d', 'c', 'b', 'a']), 'egauge-abc-a_b_c_and_1_more')
+
+
+    def test_profile_run_writes_files_named_after_the_run(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            with profiling.profile_run('egauge', 'all', output_dir):
+                run_metrics = metrics.start_run('egauge')
+                profiling.tag('egauge1')
+                spin(1000)
+                metrics.last_run_metrics = run_metrics
+            self.assertEqual(sorted(os.listdir(output_dir)), ['egauge-' + run_metrics.run_id + '-egauge1.pstats',
+                                                              'egauge-' + run_metrics.run_id + '-egauge1.tracemalloc.txt'])
+        # tags outside a profiled run are ignored
+        profiling.tag('egauge2')
+        self.assertIsNone(profiling.run_tags)
+
+
+    def test_profile_run_writes_files_next_to_the_log_file(self):
+        root_logger = logging.getLogger()
+        handlers = root_logger.handlers
+        with tempfile.TemporaryDirectory() as log_dir:
+            handler = logging.FileHandler(log_dir + '/error.log')
+            # test runners may add handlers of their own to the root logger
+            root_logger.handlers = [handler]
+            try:
+                self.assertEqual(profiling.get_log_dir(), os.path.abspath(log_dir))
+                with profiling.profile_run('hobo', 'cpu'):
+                    spin(1000)
+                root_logger.handlers = []
+                self.assertEqual(profiling.get_log_dir(), '.')
+            finally:
+                root_logger.handlers = handlers
+                handler.close()
+            self.assertEqual(len([filename for filename in os.listdir(log_dir) if filename.endswith('.pstats')]), 1)
+
+
+    def test_diff_profiles_finds_changed_functions(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            for name, repeats in (('before', 1), ('after', 200000)):
+                profiler = cProfile.Profile()
+                profiler.runcall(spin, repeats)
+                profiler.dump_stats(output_dir + '/' + name + '.pstats')
+            rows = profiling.diff_profiles(output_dir + '/before.pstats', output_dir + '/after.pstats', 'cumtime')
+        spin_rows = [row for row in rows if row[0].endswith('(spin)')]
+        self.assertEqual(len(spin_rows), 1)
+        self.assertEqual(spin_rows[0][3:], (1, 1))
+        self.assertGreater(spin_rows[0][2], spin_rows[0][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
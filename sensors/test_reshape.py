@@ -0,0 +1,57 @@
+"""
+Test suite for sensors.reshape using the unittest module
+"""
+from collections import namedtuple
+from sensors import reshape
+
+import numpy
+import pandas
+import unittest
+
+
+PurposeSensor = namedtuple('PurposeSensor', ['purpose_id', 'data_sensor_info_mapping', 'unit'])
+
+
+class TestReshape(unittest.TestCase):
+    """
+    A test suite for the reshape functions used by the egauge and webctrl scripts
+    """
+    readings = pandas.DataFrame({'Date & Time': [1549015200, 1549015260, 1549015320],
+                                 'Usage [kW]': [1.5, 2.5, 3.5],
+                                 'Generation [kW]': [0.0, 0.25, 0.5],
+                                 'Unmapped [kW]': [9.0, 9.0, 9.0]})
+
+
+    def test_melt_wide_readings_matches_per_cell_loop(self):
+        purpose_sensors = [PurposeSensor(1, 'Usage [kW]', 'kW'), PurposeSensor(2, 'Generation [kW]', 'kW'), PurposeSensor(3, 'Missing [kW]', 'kW')]
+        reading_frame = reshape.melt_wide_readings(self.readings, reshape.epoch_to_datetime(self.readings['Date & Time']), purpose_sensors)
+        expected = [(purpose_sensor.purpose_id, pandas.Timestamp(timestamp, unit='s', tz='UTC'), reading)
+                    for purpose_sensor in purpose_sensors
+                    for timestamp, reading in zip(self.readings['Date & Time'], self.readings.get(purpose_sensor.data_sensor_info_mapping, []))]
+        actual = list(zip(reading_frame['purpose_id'], reading_frame['datetime'], reading_frame['reading']))
+        self.assertEqual(expected, actual)
+        self.assertEqual(list(reading_frame.columns), reshape.READING_FRAME_COLUMNS)
+
+
+    def test_melt_wide_readings_without_rows_or_matches(self):
+        no_match = reshape.melt_wide_readings(self.readings, reshape.epoch_to_datetime(self.readings['Date & Time']), [PurposeSensor(3, 'Missing [kW]', 'kW')])
+        no_rows = reshape.melt_wide_readings(self.readings.iloc[0:0], reshape.epoch_to_datetime([]), [PurposeSensor(1, 'Usage [kW]', 'kW')])
+        self.assertTrue(no_match.empty)
+        self.assertTrue(no_rows.empty)
+
+
+    def test_last_reading_datetimes(self):
+        purpose_sensors = [PurposeSensor(1, 'Usage [kW]', 'kW'), PurposeSensor(2, 'Generation [kW]', 'kW')]
+        reading_frame = reshape.melt_wide_readings(self.readings, reshape.epoch_to_datetime(self.readings['Date & Time']), purpose_sensors)
+        last_datetimes = reshape.last_reading_datetimes(reading_frame)
+        self.assertEqual(last_datetimes[1], pandas.Timestamp(1549015320, unit='s', tz='UTC'))
+        self.assertEqual(last_datetimes[2], pandas.Timestamp(1549015320, unit='s', tz='UTC'))
+
+
+    def test_to_float_converts_digital_values(self):
+        self.assertTrue(numpy.array_equal(reshape.to_float(['55.1', 'true', 'false', '55']), [55.1, 1.0, 0.0, 55.0]))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
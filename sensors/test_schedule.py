@@ -0,0 +1,47 @@
+"""
+Test suite for sensors.schedule using the unittest module
+"""
+from sensors import schedule
+
+import unittest
+
+
+class TestSchedule(unittest.TestCase):
+    """
+    A test suite for the poll interval calculations in sensors.schedule
+    """
+
+    def test_parse_sample_resolution(self):
+        self.assertEqual(schedule.parse_sample_resolution('1 min'), 60)
+        self.assertEqual(schedule.parse_sample_resolution('15 Minutes'), 900)
+        self.assertEqual(schedule.parse_sample_resolution('30s'), 30)
+        self.assertEqual(schedule.parse_sample_resolution('hourly'), 3600)
+        self.assertEqual(schedule.parse_sample_resolution('5'), 300)
+        self.assertIsNone(schedule.parse_sample_resolution(None))
+        self.assertIsNone(schedule.parse_sample_resolution('varies'))
+
+
+    def test_get_poll_interval_backs_off_to_max_interval(self):
+        self.assertEqual(schedule.get_poll_interval(None, 0), schedule.DEFAULT_INTERVAL)
+        # intervals are never shorter than MIN_INTERVAL
+        self.assertEqual(schedule.get_poll_interval(1, 0), schedule.MIN_INTERVAL)
+        self.assertEqual(schedule.get_poll_interval(300, 2), 1200)
+        self.assertEqual(schedule.get_poll_interval(300, 1000), schedule.MAX_INTERVAL)
+        # a sample resolution longer than MAX_INTERVAL is kept
+        self.assertEqual(schedule.get_poll_interval(86400, 3), 86400)
+
+
+    def test_add_jitter_only_shortens_interval(self):
+        for _ in range(100):
+            seconds = schedule.add_jitter(300)
+            self.assertTrue(300 * (1 - schedule.JITTER) <= seconds <= 300)
+
+
+    def test_get_start_delay(self):
+        for _ in range(100):
+            self.assertTrue(0 <= schedule.get_start_delay() <= schedule.START_DELAY)
+        self.assertEqual(schedule.get_start_delay(0), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,13 @@
+-- Averages egauge readings in 5 minute increments from the reading_rollup table (see sensors/rollup.py),
+-- like eguage_5min_avg_view2, without reading or grouping the raw readings
+-- datetime_5min is the end of each 5 minute bucket, like egauge_5min_avg_view1
+-- [used by NA]
+CREATE VIEW egauge_5min_rollup AS 
+
+ SELECT reading_rollup.bucket + '00:05:00'::interval AS datetime_5min,
+    reading_rollup.purpose_id,
+    'kW'::character varying(255) AS units,
+    reading_rollup.reading_sum / reading_rollup.reading_count::double precision AS avg
+   FROM reading_rollup
+  WHERE reading_rollup.bucket_seconds = 300 AND reading_rollup.purpose_id = ANY (ARRAY[84::bigint, 85::bigint])
+  ORDER BY (reading_rollup.bucket + '00:05:00'::interval), reading_rollup.purpose_id;
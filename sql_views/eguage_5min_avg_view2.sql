@@ -1,6 +1,7 @@
 -- Averages egauge readings in 5 minute increments 
 -- [used by dashboard-pv-pos-whole-building-net, dashboard-readings-neg,
 -- dashboard-whole-building-net]
+-- [materialized unique (datetime_5min, purpose_id, units)]
 CREATE VIEW eguage_5min_avg_view2 AS 
 
  SELECT egauge_5min_avg_view1.datetime_5min,
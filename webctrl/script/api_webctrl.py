@@ -6,149 +6,223 @@ and reshape and insert those readings into a database.
 It also uses an error_log table to store information about those attempts.
 """
 from pathlib import Path
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import or_
 
 # import json #used if we want to output json file
-import configparser
+import argparse
+import collections
+import contextlib
 import logging
-import orm_webctrl
 import os
 import pendulum
-import requests
+import sys
+import time
+
+# add the project folder to sys.path so the shared sensors package can be imported
+sys.path.append(str(Path(os.path.dirname(os.path.realpath(__file__))).parent.parent))
+from sensors import bulktrend, db, journal, lazy, loader, metrics, orm, profiling, reshape, schedule
+
+numpy = lazy.lazy_import('numpy')
+requests = lazy.lazy_import('requests')
 
 
 logging.basicConfig(filename='error.log', format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+# maximum number of trend source ids sent in one webctrl api request
+MAX_IDS_PER_REQUEST = 100
+# bytes read from the webctrl api response at a time
+CHUNK_SIZE = 65536
 
 
-# connect to database by creating a session
-# def get_db_handler(db_url='postgresql:///sensors'):
-def get_db_handler():
-    """
-    1. get database name from text file "config.txt" in parent directory of webctrl/script/
-    2. create a sqlalchemy engine for database using database url
-    3. use sqlalchemy sessionmaker to create Session object from engine
-    4. create an instance of Session called conn (represents database "connection")
-    """
-    # get path of config file located in parent of parent directory
-    config_path = str(Path(os.path.dirname(os.path.realpath(__file__))).parent.parent) + "/config.txt"
-    with open(config_path, "r") as file:
-        #prepend '[DEFAULT]\n' since ConfigParser requires section headers in config files
-        config_string = '[DEFAULT]\n' + file.read()
-    config = configparser.ConfigParser()
-    config.read_string(config_string)
-    db_url = "postgresql:///" + config['DEFAULT']['db']
-    db = create_engine(db_url)
-    Session = sessionmaker(db)
-    conn = Session()
-    return conn
+def get_api_user(conn):
+    """
+    get webctrl username and password from the api_authentication table
+
+    raises an IndexError if there are no webctrl users in database
+    """
+    webctrl_user_row = conn.query(orm.ApiAuthentication.username, orm.ApiAuthentication.password).filter_by(script_folder=orm.SensorInfo.ScriptFolderEnum.webctrl)[0]
+    return (webctrl_user_row[0], webctrl_user_row[1])
+
+
+def group_sensors_by_start_date(sensors, max_ids_per_request=MAX_IDS_PER_REQUEST):
+    """
+    Group sensors that can share one webctrl api request
+
+    Sensors are grouped by the date of their last_updated_datetime (the request start date),
+    and each group is split into batches of at most max_ids_per_request sensors.
+    Sensors without a last_updated_datetime are put in batches of their own, so only they fail in get_data_from_api().
+    Returns a list of sensor lists
+    """
+    sensors_by_start_date = collections.OrderedDict()
+    batches = []
+    for sensor in sensors:
+        if sensor.last_updated_datetime:
+            start_date = pendulum.instance(sensor.last_updated_datetime).to_date_string()
+            sensors_by_start_date.setdefault(start_date, []).append(sensor)
+        else:
+            batches.append([sensor])
+    for start_date_sensors in sensors_by_start_date.values():
+        for i in range(0, len(start_date_sensors), max_ids_per_request):
+            batches.append(start_date_sensors[i:i + max_ids_per_request])
+    return batches
 
 
-# returns the last_updated_datetime and the readings after a successful api call
+# returns the readings for each query_string after a successful api call
 #def get_readings_from_webctrl_api(conn, query_string):
-def get_data_from_api(sensor, conn):
+def get_data_from_api(sensors, api_user):
     """
-    1. build webctrl api request using sensor.query_string and sensor.last_updated_datetime from sensor_info table
-    2. send request to webctrl api and attempt to download the readings data
+    1. build one webctrl api request with the query_string of every sensor in sensors
+    and the earliest last_updated_datetime of sensors from sensor_info table
+    2. send request to webctrl api and attempt to download the readings data for all sensors
+    3. stream the csv response through sensors.bulktrend, dropping samples at or before each sensor's last_updated_datetime,
+    and yield a bulktrend.Trend of timestamp and value arrays for each query_string as soon as it is parsed
 
-    3. generate timestamp of data request
-    4. use sensor.purpose_id to insert success or failure was_success in error_log
+    Success or failure is logged to error_log by the caller for each sensor, since the ids of some sensors may be missing from the response
     """
     current_time = pendulum.now('Pacific/Honolulu')
-    current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
     # if no timestamp is found, raise exception
-    if not sensor.last_updated_datetime:
+    if not all(sensor.last_updated_datetime for sensor in sensors):
         raise Exception('No last_updated_datetime found')
-    #get webctrl user information
-    webctrl_user_row = conn.query(orm_webctrl.ApiAuthentication.username, orm_webctrl.ApiAuthentication.password).filter_by(script_folder=orm_webctrl.SensorInfo.ScriptFolderEnum.webctrl)[0]
-    # returns a TypeError if there are no users in database
-    api_user = webctrl_user_row[0]
-    api_pass = webctrl_user_row[1]
-    host = 'http://www.soest.hawaii.edu/hneienergy/bulktrendserver/read'
-    start_date = pendulum.instance(sensor.last_updated_datetime).to_date_string()
+    start_date = pendulum.instance(min(sensor.last_updated_datetime for sensor in sensors)).to_date_string()
     #use current time to extract end date
     end_date = current_time.to_date_string()
+    # if sensors share a query_string, keep samples after the earliest of their last_updated_datetimes
+    watermarks = {}
+    for sensor in sensors:
+        watermarks[sensor.query_string] = min(watermarks.get(sensor.query_string, float('inf')), get_last_updated_timestamp(sensor))
+    return stream_trends(watermarks, start_date, end_date, api_user)
+
+
+def stream_trends(watermarks, start_date, end_date, api_user):
+    """
+    Download the samples of each trend id in watermarks from start_date through end_date (date strings) from the webctrl api
+    and yield a bulktrend.Trend for each id as soon as it is parsed, so only one trend is in memory at a time
+
+    Samples at or before the id's watermark (a unix timestamp) are dropped while the response is streamed.
+    The response is read while the trends are used, and is closed when the generator is exhausted or closed.
+    Raises requests.HTTPError if the api does not answer 200 OK.
+    The request is timed as the request stage of sensors.metrics, and reading and parsing the response as the parse_csv stage.
+    """
+    host = 'http://www.soest.hawaii.edu/hneienergy/bulktrendserver/read'
     if start_date > end_date:
         raise ValueError('Error: start_date ' + start_date + ' was later than end_date ' + end_date)
-    output_format = 'json'
-    params = {'id': sensor.query_string, 'start': start_date, 'end': end_date, 'format': output_format}
-    auth = (api_user, api_pass)
-    readings = requests.post(host, params=params, auth=tuple(auth))
-    if readings.status_code == requests.codes.ok:
-        print('API request was successful' + str(readings))
-        error_log_row = orm_webctrl.ErrorLog(datetime=current_time, was_success=True, purpose_id=sensor.purpose_id, pipeline_stage=orm_webctrl.ErrorLog.PipelineStageEnum.data_acquisition)
-        conn.add(error_log_row)
-        conn.commit()
-        return readings
-    else:
-        readings.raise_for_status()
+    # csv can be parsed as a stream in constant memory, unlike json
+    output_format = 'csv'
+    # the api reads one trend source per id parameter; send parameters in the body since there may be many ids
+    params = {'id': sorted(watermarks), 'start': start_date, 'end': end_date, 'format': output_format}
+    with metrics.stage('request'):
+        readings = requests.post(host, data=params, auth=tuple(api_user), stream=True)
+    try:
+        if readings.status_code != requests.codes.ok:
+            readings.raise_for_status()
+            # raise_for_status() only raises for 4xx and 5xx statuses
+            raise requests.HTTPError('Unexpected status ' + str(readings.status_code) + ' from the webctrl api', response=readings)
+        print('API request for ' + str(len(params['id'])) + ' id(s) was successful' + str(readings))
+        trends = bulktrend.iter_trends(metrics.count_bytes('parse_csv', readings.iter_content(chunk_size=CHUNK_SIZE)), watermarks)
+        while True:
+            with metrics.stage('parse_csv'):
+                trend = next(trends, None)
+            if trend is None:
+                return
+            metrics.add('parse_csv', rows=len(trend.timestamps))
+            yield trend
+    finally:
+        readings.close()
+
+
+def request_trends(watermarks, start_date, end_date, api_user):
+    """
+    Return a dict mapping each trend id in watermarks to its bulktrend.Trend from stream_trends()
+
+    Every trend is kept in memory, so sensors/backfill.py uses it with the one query_string it backfills.
+    Does not use the database, so it can run in a worker thread.
+    """
+    return {trend.id: trend for trend in stream_trends(watermarks, start_date, end_date, api_user)}
+
+
+def log_success_to_connect_to_api(conn, sensors, current_time):
+    """
+    for each sensor insert a successful data_acquisition row into error_log, all in one insert
+    """
+    error_log_journal = journal.Journal()
+    for sensor in sensors:
+        error_log_journal.record(sensor.purpose_id, current_time, orm.ErrorLog.PipelineStageEnum.data_acquisition, was_success=True)
+    error_log_journal.flush(conn)
+    conn.commit()
+
+
+def get_last_updated_timestamp(sensor):
+    """
+    Return sensor.last_updated_datetime as a unix timestamp comparable to webctrl sample timestamps
+    """
+    # add 10 hours for comparison because webctrl timestamps are GMT and last_updated_datetime is GMT - 10
+    return pendulum.instance(sensor.last_updated_datetime).add(hours=10).timestamp()
+
+
+def reshape_samples(trend, sensor):
+    """
+    Reshape the timestamp and value arrays of a bulktrend.Trend into a reading frame for sensor
+
+    Only samples after sensor.last_updated_datetime are kept.
+    """
+    # samples are sorted by time, so binary search for the first sample after last_updated_datetime
+    first_new_sample = numpy.searchsorted(trend.timestamps, get_last_updated_timestamp(sensor), side='right')
+    return reshape.series_readings(sensor.purpose_id, reshape.epoch_to_datetime(trend.timestamps[first_new_sample:]), trend.values[first_new_sample:], sensor.unit)
 
 
 #def insert_webctrl_readings_into_db(conn, readings, sensors):
-def insert_readings_into_database(conn, readings, sensor):
+def insert_readings_into_database(conn, trend, sensor):
     """
-    1. for each row of data, attempt to insert into readings table if datetime of row is after sensor.last_updated_datetime
-        2. keep track of the latest last_updated_datetime in new_last_updated_datetime
+    1. reshape the trend downloaded for sensor.query_string into a reading frame containing only rows with datetime after sensor.last_updated_datetime
+    2. generate timestamp of data insert attempt
+    3. use purpose_id to insert a success row into error_log with a sensors.journal.Journal, which returns its log_id
+    (the row is rolled back with the readings if step 4 fails)
+    4. bulk load every row of the reading frame into the reading table with that log_id, skipping readings already in the table
+
+    5. Use the latest datetime in the reading frame to update last_updated_datetime of current sensor in sensor_info
 
-    3. Use new_last_updated_datetime to update last_updated_datetime of current sensor in sensor_info
-    4. generate timestamp of data insert attempt
-    5. use purpose_id to insert success or failure of data insert attempt during step 1
+    returns the number of readings inserted
     """
     current_time = pendulum.now('Pacific/Honolulu')
     current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
-    new_last_updated_datetime = ''
-    rows_inserted = 0
-    sensor_json_data = readings.json()
-    # query_string = sensor_json_data[0]['id']
-    readings = sensor_json_data[0]['s']
     #TEST
-    print(str(len(readings)) + ' readings obtained', )
-    for reading in readings:
-        reading_time = ''
-        reading_value = ''
-        for key in reading.keys():
-            if key is 't':
-                reading_timestamp = reading[key]
-                # slice off extra digits since pendulum.from_timestamp() uses 10 digit timestamps
-                reading_time = pendulum.from_timestamp(int(str(reading_timestamp)[:10]))
-                reading_time = reading_time.set(microsecond=reading_time.microsecond - (reading_time.microsecond % 10000))
-            #'a' type values stand for analog; are like double datatypes
-            #'d' type values stand for digital; are like booleans
-            elif key is 'a' or key is 'd':
-                reading_value = reading[key]
-        # subtract 10 hours from reading time for comparison because it's GMT and last_updated_datetime is GMT - 10
-        if reading_time.subtract(hours=10) > pendulum.instance(sensor.last_updated_datetime):
-            reading_row = orm_webctrl.Reading(purpose_id=sensor.purpose_id, datetime=reading_time, reading=reading_value, units=sensor.unit, upload_timestamp=current_time)
-            conn.add(reading_row)
-            rows_inserted += 1
-            new_last_updated_datetime = reading_time
-    # #TEST
-    # with open("output.txt", 'w') as outfile:
-    #     json.dump(sensor_json_data, outfile, indent=4)
-    if new_last_updated_datetime:
-        conn.query(orm_webctrl.SensorInfo).filter(orm_webctrl.SensorInfo.purpose_id == sensor.purpose_id).update(
-            {"last_updated_datetime": new_last_updated_datetime})
-    error_log_row = orm_webctrl.ErrorLog(datetime=current_time, was_success=True, purpose_id=sensor.purpose_id, pipeline_stage=orm_webctrl.ErrorLog.PipelineStageEnum.database_insertion)
-    conn.add(error_log_row)
-    # need to flush and refresh to get error_log_row.log_id
-    conn.flush()
-    conn.refresh(error_log_row)
-    # update current set of readings with related log_id
-    conn.query(orm_webctrl.Reading.log_id). \
-        filter(orm_webctrl.Reading.purpose_id == sensor.purpose_id,
-               orm_webctrl.Reading.upload_timestamp == current_time). \
-        update({'log_id': error_log_row.log_id})
-    conn.commit()
+    print(str(len(trend.timestamps) + trend.skipped) + ' readings obtained', )
+    with metrics.stage('reshape'):
+        reading_frame = reshape_samples(trend, sensor)
+    metrics.add('reshape', rows=reading_frame.shape[0])
+    print(str(len(trend.timestamps) + trend.skipped - reading_frame.shape[0]) + ' readings skipped (at or before last_updated_datetime)')
+    with metrics.stage('error_log'):
+        error_log_journal = journal.Journal()
+        error_log_journal.record(sensor.purpose_id, current_time, orm.ErrorLog.PipelineStageEnum.database_insertion, was_success=True)
+        log_id, = error_log_journal.flush(conn)
+    metrics.add('error_log', rows=1)
+    with metrics.stage('copy'):
+        rows_inserted = loader.copy_readings(conn, reading_frame, current_time, log_ids=log_id).get(sensor.purpose_id, 0)
+    metrics.add('copy', rows=rows_inserted)
+    with metrics.stage('update_sensor_info'):
+        if not reading_frame.empty:
+            new_last_updated_datetime = reading_frame['datetime'].max().to_pydatetime()
+            # only move last_updated_datetime forward, since a backfill may insert readings older than it
+            conn.query(orm.SensorInfo).filter(orm.SensorInfo.purpose_id == sensor.purpose_id,
+                                                      or_(orm.SensorInfo.last_updated_datetime == None, orm.SensorInfo.last_updated_datetime < new_last_updated_datetime)).update(
+                {"last_updated_datetime": new_last_updated_datetime}, synchronize_session=False)
+        conn.commit()
     print(rows_inserted, ' row(s) inserted')
+    return rows_inserted
 
 
 #log_failure_to_get_readings_from_webctrl_api
-def log_failure_to_connect_to_api(conn, exception, sensor):
+def log_failure_to_connect_to_api(conn, exception, sensors):
+    """
+    for each sensor insert a failed data_acquisition row into error_log, all in one insert
+    """
     current_time = pendulum.now('Pacific/Honolulu')
     current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
-    logging.exception('log_failure_to_connect_to_api')
-    error_log_row = orm_webctrl.ErrorLog(datetime=current_time, error_type=exception.__class__.__name__, pipeline_stage=orm_webctrl.ErrorLog.PipelineStageEnum.data_acquisition, purpose_id=sensor.purpose_id, was_success=False)
-    conn.add(error_log_row)
+    # exception may not have been raised, e.g. the KeyError of an id missing from the api response
+    logging.error('log_failure_to_connect_to_api', exc_info=exception)
+    error_log_journal = journal.Journal()
+    for sensor in sensors:
+        error_log_journal.record(sensor.purpose_id, current_time, orm.ErrorLog.PipelineStageEnum.data_acquisition, was_success=False, error_type=exception.__class__.__name__)
+    error_log_journal.flush(conn)
     conn.commit()
 
 
@@ -159,23 +233,80 @@ def log_failure_to_connect_to_database(conn, exception, sensor):
     current_time = pendulum.now('Pacific/Honolulu')
     current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
     logging.exception('log_failure_to_connect_to_database')
-    error_log_row = orm_webctrl.ErrorLog(datetime=current_time, error_type=exception.__class__.__name__, pipeline_stage=orm_webctrl.ErrorLog.PipelineStageEnum.database_insertion, purpose_id=sensor.purpose_id, was_success=False)
-    conn.add(error_log_row)
+    error_log_journal = journal.Journal()
+    error_log_journal.record(sensor.purpose_id, current_time, orm.ErrorLog.PipelineStageEnum.database_insertion, was_success=False, error_type=exception.__class__.__name__)
+    error_log_journal.flush(conn)
     conn.commit()
 
 
-if __name__ == '__main__':
-    # connect to the database
-    conn = get_db_handler()
-    sensors = conn.query(orm_webctrl.SensorInfo.purpose_id, orm_webctrl.SensorInfo.query_string, orm_webctrl.SensorInfo.last_updated_datetime, orm_webctrl.SensorInfo.unit).filter_by(script_folder=orm_webctrl.SensorInfo.ScriptFolderEnum.webctrl, is_active=True)
+def run(Session):
+    """
+    Request readings for every active webctrl sensor that is due to be polled and insert them, using a session created with Session
+
+    Sensors are due according to sensors.schedule;
+    the next poll of each sensor is scheduled from its sample_resolution and whether new readings were inserted.
+    Called once per cron run by __main__ and once per cycle by sensors/daemon.py
+    The time and rows of each stage are recorded in run_metrics by sensors.metrics.
+    """
+    metrics.start_run('webctrl')
+    conn = Session()
+    current_time = pendulum.now('Pacific/Honolulu')
+    current_time = current_time.set(microsecond=current_time.microsecond - (current_time.microsecond % 10000))
+    sensors = conn.query(orm.SensorInfo.purpose_id, orm.SensorInfo.query_string, orm.SensorInfo.last_updated_datetime, orm.SensorInfo.unit, orm.SensorInfo.sample_resolution).filter_by(script_folder=orm.SensorInfo.ScriptFolderEnum.webctrl, is_active=True).all()
+    due_purpose_ids = schedule.get_due_purpose_ids(conn, [sensor.purpose_id for sensor in sensors], current_time)
+    sensors = [sensor for sensor in sensors if sensor.purpose_id in due_purpose_ids]
+    print(str(len(sensors)) + ' sensor(s) due to be polled')
     for sensor in sensors:
+        profiling.tag(sensor.query_string)
+    # sensors that fail or return nothing are backed off
+    new_readings = {}
+    try:
+        api_user = get_api_user(conn)
+    except Exception as exception: #catch missing webctrl user (IndexError) or database exceptions
+        log_failure_to_connect_to_api(conn, exception, sensors)
+        sensors = []
+    # one api request per batch of sensors instead of one per sensor
+    for batch in group_sensors_by_start_date(sensors):
+        # the sensors of each query_string whose trend has not been received yet
+        pending_sensors = collections.OrderedDict()
+        for sensor in batch:
+            pending_sensors.setdefault(sensor.query_string, []).append(sensor)
         try:
-            readings = get_data_from_api(sensor, conn)
+            # each trend is inserted as it is streamed, so only one trend of the batch is in memory at a time
+            with contextlib.closing(get_data_from_api(batch, api_user)) as trends:
+                for trend in trends:
+                    trend_sensors = pending_sensors.pop(trend.id, [])
+                    request_time = pendulum.now('Pacific/Honolulu')
+                    request_time = request_time.set(microsecond=request_time.microsecond - (request_time.microsecond % 10000))
+                    log_success_to_connect_to_api(conn, trend_sensors, request_time)
+                    for sensor in trend_sensors:
+                        try:
+                            new_readings[sensor.purpose_id] = insert_readings_into_database(conn, trend, sensor)
+                        except Exception as exception: #catch database exeptions like sqlalchemy.exc.InternalError, sqlalchemy.exc.OperationalError, sqlalchemy.exc.ProgrammingError, psycopg2.IntegrityError(try to insert rows with duplicate keys)
+                            log_failure_to_connect_to_database(conn, exception, sensor)
         except Exception as exception: #catch webctrl api request exceptions like requests.exceptions.ConnectionError
-            log_failure_to_connect_to_api(conn, exception, sensor)
+            # the sensors whose trends were received before the request failed keep their success rows
+            log_failure_to_connect_to_api(conn, exception, [sensor for query_string_sensors in pending_sensors.values() for sensor in query_string_sensors])
             continue
-        try:
-            insert_readings_into_database(conn, readings, sensor)
-        except Exception as exception: #catch database exeptions like sqlalchemy.exc.InternalError, sqlalchemy.exc.OperationalError, sqlalchemy.exc.ProgrammingError, TypeError (if no users in database), psycopg2.IntegrityError(try to insert rows with duplicate keys)
-            log_failure_to_connect_to_database(conn, exception, sensor)
+        # sensors whose id was missing from the api response
+        for query_string, query_string_sensors in pending_sensors.items():
+            log_failure_to_connect_to_api(conn, KeyError(query_string), query_string_sensors)
+    with metrics.stage('schedule'):
+        for sensor in sensors:
+            schedule.record_poll(conn, sensor.purpose_id, sensor.sample_resolution, new_readings.get(sensor.purpose_id, 0), current_time)
+        conn.commit()
     conn.close()
+    metrics.finish_run(Session)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Request readings of active webctrl sensors and insert them into the database')
+    parser.add_argument('--profile', choices=('cpu', 'memory', 'all'),
+                        help='profile the run with cProfile (cpu), tracemalloc (memory) or both (all), writing the profiles next to error.log (default: the SENSORS_PROFILE environment variable)')
+    parser.add_argument('--start-delay', type=float, default=schedule.START_DELAY,
+                        help='wait a random number of seconds up to this before requesting readings, so runs started by cron at the same second are spread out (default ' + str(schedule.START_DELAY) + ')')
+    args = parser.parse_args()
+    time.sleep(schedule.get_start_delay(args.start_delay))
+    # connect to the database
+    with profiling.profile_run('webctrl', args.profile):
+        run(db.get_sessionmaker())